@@ -3,8 +3,91 @@ import sys
 import argparse
 import glob
 import os
+import time
+import math
 
-def printer(name, obj, prov=False):
+
+def format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def describe_layout(obj):
+    """
+    Describe how a dataset is stored - chunking, compression, and
+    how much space it takes on disc compared to in memory.
+    """
+    logical = obj.size * obj.dtype.itemsize
+    stored = obj.id.get_storage_size()
+
+    if obj.chunks is None:
+        layout = "contiguous"
+    else:
+        layout = f"chunks={obj.chunks}"
+
+    filters = []
+    if obj.compression is not None:
+        opts = "" if obj.compression_opts is None else f"({obj.compression_opts})"
+        filters.append(f"{obj.compression}{opts}")
+    if obj.shuffle:
+        filters.append("shuffle")
+    if obj.fletcher32:
+        filters.append("fletcher32")
+    filters = "+".join(filters) if filters else "uncompressed"
+
+    if stored == 0:
+        ratio = "unallocated"
+    else:
+        ratio = f"ratio={logical / stored:.2f}"
+
+    return (
+        f"{layout} {filters} logical={format_bytes(logical)} "
+        f"stored={format_bytes(stored)} {ratio}"
+    )
+
+
+def benchmark_read(obj, chunk_rows, max_chunks):
+    """
+    Time reading a column in blocks of chunk_rows, as the pipeline
+    iterators do, and return the throughput in bytes per second.
+
+    Only the first max_chunks blocks are read, to keep this quick on
+    large catalogs. Results include the effect of the OS page cache,
+    so the first run on a file will be the most realistic.
+    """
+    n = obj.shape[0]
+    if n == 0:
+        return None, 0
+
+    nbytes = 0
+    t0 = time.perf_counter()
+    for s in range(0, min(n, chunk_rows * max_chunks), chunk_rows):
+        e = min(s + chunk_rows, n)
+        nbytes += obj[s:e].nbytes
+    t = time.perf_counter() - t0
+    return nbytes / t, nbytes
+
+
+def chunks_per_read(obj, chunk_rows):
+    # The most HDF5 chunks that any block of chunk_rows rows touches. A block
+    # straddling many small chunks means many small reads and decompressions;
+    # a chunk much larger than the block means re-reading data.
+    if obj.chunks is None or obj.ndim == 0:
+        return None
+    c = obj.chunks[0]
+    if obj.shape[0] <= chunk_rows:
+        return max(1, math.ceil(obj.shape[0] / c))
+    # Blocks start at multiples of chunk_rows, so their offsets within a
+    # chunk are multiples of the gcd.  If these don't line up with the chunks
+    # then some blocks straddle one extra chunk.
+    offset = c - math.gcd(chunk_rows, c)
+    return math.ceil((offset + chunk_rows) / c)
+
+
+def printer(name, obj, prov=False, layout=False, bench=False, chunk_rows=100_000, max_chunks=10):
     indent = "    " * name.count("/")
     bits = name.split("/")
     if (not prov) and (bits[0] == "provenance"):
@@ -16,38 +99,81 @@ def printer(name, obj, prov=False):
         print(f"{indent}[{name}]")
     elif isinstance(obj, h5py.Dataset):
         print(f"{indent}- {name} {obj.dtype} {obj.shape}")
+        if layout:
+            print(f"{indent}    layout: {describe_layout(obj)}")
+            r = chunks_per_read(obj, chunk_rows)
+            if r is not None:
+                print(f"{indent}    chunks per {chunk_rows:,} row read: {r}")
+        if bench and obj.ndim > 0:
+            rate, nbytes = benchmark_read(obj, chunk_rows, max_chunks)
+            if rate is not None:
+                print(
+                    f"{indent}    read: {format_bytes(rate)}/s "
+                    f"(from {format_bytes(nbytes)})"
+                )
 
     if hasattr(obj, "attrs"):
         d = dict(obj.attrs)
         for k, v in d.items():
             print(f"{indent}    * {k} = {v}")
 
-def printer_prov(name, obj):
-    return printer(name, obj, prov=True)
 
-def main(path, prov):
+def summarize(f):
+    # Totals over the whole file, skipping provenance
+    totals = {"logical": 0, "stored": 0, "datasets": 0}
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset) and not name.startswith("provenance"):
+            totals["logical"] += obj.size * obj.dtype.itemsize
+            totals["stored"] += obj.id.get_storage_size()
+            totals["datasets"] += 1
+
+    f.visititems(visit)
+    file_size = os.path.getsize(f.filename)
+    print(
+        f"{totals['datasets']} datasets: logical size {format_bytes(totals['logical'])}, "
+        f"stored {format_bytes(totals['stored'])}, file size {format_bytes(file_size)}"
+    )
+
+
+def main(path, prov, layout=False, bench=False, chunk_rows=100_000, max_chunks=10):
     if os.path.isdir(path):
         files = glob.glob(f"{path}/*.hdf") + glob.glob(f"{path}/*.hdf5")
     else:
         files = [path]
+
+    def p(name, obj):
+        return printer(
+            name,
+            obj,
+            prov=prov,
+            layout=layout,
+            bench=bench,
+            chunk_rows=chunk_rows,
+            max_chunks=max_chunks,
+        )
+
     for infile in files:
         print("-"*80)
         print(infile)
         print("")
-        p = printer_prov if prov else printer
         with h5py.File(infile, "r") as f:
             f.visititems(p)
+            if layout or bench:
+                print("")
+                summarize(f)
         print("")
         print("")
 
 
 
-
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Print contents of HDF5 file or directory of files")
     parser.add_argument("path", help="Name of file or directory")
     parser.add_argument("--prov", action="store_true", help="Include the provenance section")
+    parser.add_argument("--layout", action="store_true", help="Report chunking, compression, and size on disc of each dataset")
+    parser.add_argument("--bench", action="store_true", help="Time reading each dataset in blocks of --chunk-rows")
+    parser.add_argument("--chunk-rows", type=int, default=100_000, help="Rows per read, as in the chunk_rows option of stages")
+    parser.add_argument("--max-chunks", type=int, default=10, help="Maximum number of blocks to read per dataset when benchmarking")
     args = parser.parse_args()
-    main(args.path, args.prov)
\ No newline at end of file
+    main(args.path, args.prov, args.layout, args.bench, args.chunk_rows, args.max_chunks)
@@ -2,47 +2,163 @@
 Pipeline modules for the 3x2pt (TX) project.
 
 """
-# Make sure any stages you want to use in a pipeline
-# are imported here.
+import importlib
+import ceci
 from .base_stage import PipelineStage
-from .source_selector import (
-    TXSourceSelectorMetacal,
-    TXSourceSelectorLensfit,
-    TXSourceSelectorMetadetect,
-)
-from .lens_selector import TXMeanLensSelector
-from .photoz import TXRandomPhotozPDF
-from .photoz_stack import TXPhotozSourceStack, TXPhotozLensStack
-from .random_cats import TXRandomCat
-from .twopoint_fourier import TXTwoPointFourier
-from .twopoint import TXTwoPoint
-from .blinding import TXBlinding
-from .input_cats import TXCosmoDC2Mock
-from .photoz_mlz import PZPDFMLZ
-from .covariance import TXFourierGaussianCovariance, TXRealGaussianCovariance
-from .metacal_gcr_input import TXMetacalGCRInput
-from .diagnostics import TXSourceDiagnosticPlots, TXLensDiagnosticPlots
-from .exposure_info import TXExposureInfo
-from .psf_diagnostics import TXPSFDiagnostics, TXRoweStatistics
-from .noise_maps import TXSourceNoiseMaps, TXLensNoiseMaps, TXNoiseMapsJax
-from .ingest_redmagic import TXIngestRedmagic
-from .maps import TXMainMaps
-from .auxiliary_maps import TXAuxiliarySourceMaps, TXAuxiliaryLensMaps
-from .map_plots import TXMapPlots
-from .masks import TXSimpleMask
-from .metadata import TXTracerMetadata
-from .convergence import TXConvergenceMaps
-from .map_correlations import TXMapCorrelations
-from .rail import PZRailTrainLens, PZRailTrainSource
-from .rail import PZRailEstimateLens, PZRailEstimateSource
-from .theory import TXTwoPointTheoryReal, TXTwoPointTheoryFourier
-from .jackknife import TXJackknifeCenters
-from .twopoint_null_tests import TXGammaTFieldCenters
-from .twopoint_plots import TXTwoPointPlots, TXTwoPointPlotsFourier
-from .calibrate import TXShearCalibration
-
-# Here are the stages that mostly will be used for other projects
-# such as the self-calibration of Intrinsic alignment.
-from .extensions.twopoint_scia import TXSelfCalibrationIA
-from .extensions.clmm import TXTwoPointRLens
-from .covariance_nmt import TXFourierNamasterCovariance, TXRealNamasterCovariance
+
+# Stage modules are imported lazily, only when a stage in them is
+# needed, since between them they pull in a lot of heavy dependencies
+# (NaMaster, RAIL, JAX, ...) and every process in every job would otherwise
+# pay for importing all of them. Make sure any stages you want to use in
+# a pipeline are listed here, with the module (relative to txpipe) that
+# defines them.
+STAGE_MODULES = {
+    "TXSourceSelector": ".source_selector",
+    "TXSourceSelectorMetacal": ".source_selector",
+    "TXSourceSelectorLensfit": ".source_selector",
+    "TXSourceSelectorMetadetect": ".source_selector",
+    "TXSourceSelectorHSC": ".source_selector",
+    "TXBaseLensSelector": ".lens_selector",
+    "TXTruthLensSelector": ".lens_selector",
+    "TXMeanLensSelector": ".lens_selector",
+    "TXModeLensSelector": ".lens_selector",
+    "TXRandomForestLensSelector": ".lens_selector",
+    "TXLensCatalogSplitter": ".lens_selector",
+    "TXLensCatalogSplitter3D": ".lens_selector",
+    "TXExternalLensCatalogSplitter": ".lens_selector",
+    "TXExternalLensCatalogSplitter3D": ".lens_selector",
+    "TXRandomPhotozPDF": ".photoz",
+    "TXPhotozSourceStack": ".photoz_stack",
+    "TXPhotozLensStack": ".photoz_stack",
+    "TXSourceTrueNumberDensity": ".photoz_stack",
+    "TXLensTrueNumberDensity": ".photoz_stack",
+    "TXPhotozPlots": ".photoz_stack",
+    "TXRandomCat": ".random_cats",
+    "TXTwoPointFourier": ".twopoint_fourier",
+    "TXTwoPoint": ".twopoint",
+    "TXTwoPointPixel": ".twopoint",
+    "TXBlinding": ".blinding",
+    "TXNullBlinding": ".blinding",
+    "TXCosmoDC2Mock": ".input_cats",
+    "TXBuzzardMock": ".input_cats",
+    "TXGaussianSimsMock": ".input_cats",
+    "PZPDFMLZ": ".photoz_mlz",
+    "TXFourierGaussianCovariance": ".covariance",
+    "TXRealGaussianCovariance": ".covariance",
+    "TXFourierTJPCovariance": ".covariance",
+    "TXMetacalGCRInput": ".metacal_gcr_input",
+    "TXIngestStars": ".metacal_gcr_input",
+    "TXSourceDiagnosticPlots": ".diagnostics",
+    "TXLensDiagnosticPlots": ".diagnostics",
+    "TXExposureInfo": ".exposure_info",
+    "TXPSFDiagnostics": ".psf_diagnostics",
+    "TXRoweStatistics": ".psf_diagnostics",
+    "TXGalaxyStarShear": ".psf_diagnostics",
+    "TXGalaxyStarDensity": ".psf_diagnostics",
+    "TXBrighterFatterPlot": ".psf_diagnostics",
+    "TXSourceNoiseMaps": ".noise_maps",
+    "TXLensNoiseMaps": ".noise_maps",
+    "TXExternalLensNoiseMaps": ".noise_maps",
+    "TXNoiseMapsJax": ".noise_maps",
+    "TXIngestRedmagic": ".ingest_redmagic",
+    "TXBaseMaps": ".maps",
+    "TXSourceMaps": ".maps",
+    "TXLensMaps": ".maps",
+    "TXExternalLensMaps": ".maps",
+    "TXMainMaps": ".maps",
+    "TXDensityMaps": ".maps",
+    "TXAuxiliarySourceMaps": ".auxiliary_maps",
+    "TXAuxiliaryLensMaps": ".auxiliary_maps",
+    "TXUniformDepthMap": ".auxiliary_maps",
+    "TXMapPlots": ".map_plots",
+    "TXSimpleMask": ".masks",
+    "TXTracerMetadata": ".metadata",
+    "TXConvergenceMaps": ".convergence",
+    "TXConvergenceMapPlots": ".convergence",
+    "TXMapCorrelations": ".map_correlations",
+    "PZRailTrainLens": ".rail.train",
+    "PZRailTrainSource": ".rail.train",
+    "PZRailTrainLensFromSource": ".rail.train",
+    "PZRailTrainSourceFromLens": ".rail.train",
+    "PZRailEstimateLens": ".rail.estimate",
+    "PZRailEstimateSource": ".rail.estimate",
+    "PZRailEstimateLensFromSource": ".rail.estimate",
+    "PZRailEstimateSourceFromLens": ".rail.estimate",
+    "PZRailSummarize": ".rail.summarize",
+    "PZRealizationsPlot": ".rail.summarize",
+    "TXParqetToHDF": ".rail.conversions",
+    "TXTwoPointTheoryReal": ".theory",
+    "TXTwoPointTheoryFourier": ".theory",
+    "TXJackknifeCenters": ".jackknife",
+    "TXGammaTFieldCenters": ".twopoint_null_tests",
+    "TXGammaTStars": ".twopoint_null_tests",
+    "TXGammaTRandoms": ".twopoint_null_tests",
+    "TXApertureMass": ".twopoint_null_tests",
+    "TXStarCatalogSplitter": ".twopoint_null_tests",
+    "TXTwoPointPlots": ".twopoint_plots",
+    "TXTwoPointPlotsFourier": ".twopoint_plots",
+    "TXShearCalibration": ".calibrate",
+    # Here are the stages that mostly will be used for other projects
+    # such as the self-calibration of Intrinsic alignment.
+    "TXSelfCalibrationIA": ".extensions.twopoint_scia",
+    "TXTwoPointRLens": ".extensions.clmm.rlens",
+    "TXFourierNamasterCovariance": ".covariance_nmt",
+    "TXRealNamasterCovariance": ".covariance_nmt",
+}
+
+
+def load_stage_module(name):
+    """
+    Import the module defining the named stage, which registers
+    it (and any other stages in the same module) with ceci.
+
+    Returns None if the stage is not a TXPipe one.
+    """
+    module = STAGE_MODULES.get(name)
+    if module is None:
+        return None
+    return importlib.import_module(module, __name__)
+
+
+def load_all_stages():
+    """
+    Import every stage module, as used to happen on import of txpipe.
+    """
+    for module in sorted(set(STAGE_MODULES.values())):
+        importlib.import_module(module, __name__)
+
+
+class _LazyStageRegistry(dict):
+    # ceci looks up stage classes by name in a single dictionary shared by all
+    # stage classes. We swap that for this one, which imports the module defining
+    # a stage the first time it is asked for, so that pipelines that just
+    # "import txpipe" (or list it in their modules) still find every stage.
+    def __missing__(self, name):
+        if load_stage_module(name) is None:
+            raise KeyError(name)
+        return dict.__getitem__(self, name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+if not isinstance(ceci.PipelineStage.pipeline_stages, _LazyStageRegistry):
+    ceci.PipelineStage.pipeline_stages = _LazyStageRegistry(
+        ceci.PipelineStage.pipeline_stages
+    )
+
+
+def __getattr__(name):
+    # Allows "from txpipe import TXTwoPoint" and "txpipe.TXTwoPoint",
+    # importing the module only at that point.
+    module = load_stage_module(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return PipelineStage.get_stage(name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(STAGE_MODULES))
@@ -1,5 +1,26 @@
 # This file must exist with these contents
-from . import *
+import sys
+from . import PipelineStage, load_all_stages
 
 if __name__ == "__main__":
+    # Stages are only imported when they are needed. But to list all of
+    # them in the help we have to import everything.
+    if len(sys.argv) < 2 or sys.argv[1] in ["--help", "-h"]:
+        load_all_stages()
+
+    # Report how long it takes to import the stage and its dependencies,
+    # to help catch slow imports creeping in. If just a stage name is given
+    # then we stop after the report, otherwise run as normal.
+    if "--import-report" in sys.argv:
+        from .utils.timer import import_time_report
+
+        sys.argv.remove("--import-report")
+        if len(sys.argv) < 2:
+            statement = "import txpipe; txpipe.load_all_stages()"
+        else:
+            statement = f"import txpipe; txpipe.PipelineStage.get_stage({sys.argv[1]!r})"
+        import_time_report(statement)
+        if len(sys.argv) < 3:
+            sys.exit(0)
+
     PipelineStage.main()
@@ -1,10 +1,16 @@
 from ceci import PipelineStage as PipelineStageBase
-from .data_types import HDFFile
+from .data_types import HDFFile, ParquetFile
 from textwrap import dedent
 from .utils.provenance import find_module_versions, git_diff, git_current_revision
+from .utils.checkpoint import Checkpointer
+from .utils.misc import prefetch_iterated
+from .utils.column_cache import ColumnCache
 import sys
 import datetime
 import socket
+import hashlib
+import bisect
+import numpy as np
 
 
 class PipelineStage(PipelineStageBase):
@@ -18,6 +24,9 @@ class PipelineStage(PipelineStageBase):
     outputs = []
     config_options = {}
 
+    # The slow-to-collect parts of the provenance, once we have them
+    _cached_provenance = None
+
     def run(self):
         print("Please do not execute this stage again.")
 
@@ -56,7 +65,326 @@ class PipelineStage(PipelineStageBase):
         )
         sys.stdout.flush()
 
-    def combined_iterators(self, rows, *inputs, parallel=True):
+    def optional_config(self, name, default):
+        """
+        Get a configuration value that a stage may not declare in its
+        config_options, but that can be set in the configuration file.
+
+        We can't use self.config.get for this, since for declared options
+        it returns the parameter object rather than its value.
+        """
+        if name in self.config:
+            return self.config[name]
+        return default
+
+    def create_catalog_dataset(self, group, name, shape, dtype, downcast=False, **kwargs):
+        """
+        Create a dataset for an output catalog column, chunked to match
+        this stage's chunk_rows option.
+
+        The output_compression option, if set (e.g. "lzf" or "gzip:4"), is
+        used to compress it, and if output_downcast is set then columns marked
+        downcast here are stored as float32. See create_catalog_dataset in
+        utils/hdf_tools.py for details.
+        """
+        from .utils.hdf_tools import create_catalog_dataset
+
+        return create_catalog_dataset(
+            group,
+            name,
+            shape,
+            dtype,
+            chunk_rows=self.optional_config("chunk_rows", None),
+            compression=self.optional_config("output_compression", None),
+            downcast=downcast and self.optional_config("output_downcast", False),
+            **kwargs,
+        )
+
+    def get_column_cache(self, parallel=True):
+        """
+        Get the ColumnCache object to use for reading input columns,
+        or None if the column_cache_dir option is not set.
+
+        The cache size is set by the column_cache_max_gb option.
+        If parallel is True then the processes share the work of
+        caching columns, so they must all use the cache together.
+        """
+        directory = self.optional_config("column_cache_dir", "")
+        if not directory:
+            return None
+        max_gb = self.optional_config("column_cache_max_gb", 100.0)
+        comm = self.comm if parallel else None
+        return ColumnCache(directory, int(max_gb * 1024**3), comm=comm)
+
+    def iterate_hdf(
+        self,
+        tag,
+        group_name,
+        cols,
+        chunk_rows,
+        parallel=True,
+        longest=False,
+        resume_row=0,
+        aligned=False,
+    ):
+        """
+        Loop through chunks of the input data from an HDF5 file with the given tag.
+
+        This extends the parent class method to read columns through a
+        ColumnCache if the column_cache_dir option is set, in which case the
+        chunks are read-only slices of memory-mapped arrays. Otherwise, or if
+        the file has no UUID to identify it, the file is read directly.
+
+        If resume_row is set then this process skips its chunks before that
+        row, which were done before a checkpoint.
+
+        If the input is a Parquet file then it is read with iterate_parquet,
+        giving the same chunks as an HDF5 file would unless aligned is set,
+        in which case the chunks follow the Parquet row groups; see
+        iterate_parquet.  Aligned is ignored for HDF5 files.  The group name is
+        not used for Parquet files.  Stages that also read other information from
+        the file, like the catalog type of shear catalogs, still need HDF5;
+        use get_input_size for the size of a catalog that may be either.
+        """
+        if self.is_parquet_input(tag):
+            yield from self.iterate_parquet(
+                tag,
+                cols,
+                chunk_rows,
+                parallel=parallel,
+                aligned=aligned,
+                resume_row=resume_row,
+            )
+            return
+
+        cache = self.get_column_cache(parallel=parallel)
+        if cache is None:
+            f = self.open_input(tag)
+            group = f[group_name]
+            uuid = "UNKNOWN"
+        else:
+            f = self.open_input(tag, wrapper=True)
+            group = f.file[group_name]
+            uuid = f.provenance["uuid"]
+
+        if uuid == "UNKNOWN":
+            columns = {col: group[col] for col in cols}
+        else:
+            columns = {
+                col: cache.column(uuid, group_name, col, group[col]) for col in cols
+            }
+
+        # Check all the columns are the same length, as in the parent method
+        N = [len(c) for c in columns.values()]
+        n = max(N)
+        if (not longest) and any(n_i != n for n_i in N):
+            f.close()
+            raise ValueError(
+                f"Different columns among {cols} in file {tag} group {group_name}"
+                "are different sizes - if this is acceptable set longest=True"
+            )
+
+        ranges = self.data_ranges_by_rank(
+            n, chunk_rows, parallel=parallel, resume_row=resume_row
+        )
+        try:
+            for start, end in ranges:
+                data = {col: c[start:end] for col, c in columns.items()}
+                yield start, end, data
+        finally:
+            f.close()
+
+    def is_parquet_input(self, tag):
+        """
+        Check if the input with the given tag is a Parquet file, from its suffix.
+        """
+        return self.get_input(tag).endswith((".pq", ".parquet"))
+
+    def get_input_size(self, tag, group_name, col="ra"):
+        """
+        Get the number of rows in an input catalog, which can be either an
+        HDF5 file, in which case the size of the given column is used, or a
+        Parquet file.
+
+        Stages that use this, and iterate_hdf, for their catalog inputs can
+        be given Parquet catalogs instead of HDF5 ones.
+        """
+        if self.is_parquet_input(tag):
+            f = ParquetFile(self.get_input(tag), "r")
+            n = f.get_size()
+            f.close()
+            return n
+
+        with self.open_input(tag) as f:
+            return f[f"{group_name}/{col}"].size
+
+    def iterate_parquet(
+        self, tag, cols, chunk_rows, parallel=True, aligned=True, resume_row=0
+    ):
+        """
+        Loop through chunks of the input data from a Parquet file with the given tag.
+
+        Only the chosen columns are read, and numeric columns are not copied
+        when they are converted from arrow to numpy.
+
+        If aligned is True then whole row groups (the smallest unit of a Parquet file
+        that can be read) are split between processes, and each is yielded in
+        chunks of up to chunk_rows.  This reads each row group exactly once, but
+        the chunks do not line up with those from iterate_hdf, so it can't be
+        combined with iteration through another file.
+
+        If aligned is False the chunks are the same as for iterate_hdf, and
+        the row groups needed for each chunk are read, keeping the most
+        recent ones in case the next chunk needs them too. This is most
+        efficient when chunk_rows is a multiple of the row group size.
+
+        Parameters
+        ----------
+        tag: str
+            The tag from the inputs list to use
+        cols: list
+            The columns to read
+        chunk_rows: int
+            Maximum number of rows to read and return at once
+        parallel: bool
+            Whether to split up data among processes (parallel=True) or give
+            all processes all data (parallel=False).  Default = True.
+        aligned: bool
+            Whether to split chunks by row groups, as described above
+        resume_row: int
+            Chunks before this row, done before a checkpoint, are skipped
+
+        Returns
+        -------
+        it: iterator
+            Iterator yielding (int, int, dict) tuples of (start, end, data)
+        """
+        f = ParquetFile(self.get_input(tag), "r")
+        ranges = f.row_group_ranges()
+
+        if aligned:
+            groups = range(len(ranges))
+            if parallel:
+                groups = self.split_tasks_by_rank(groups)
+
+            for i in groups:
+                group_start, group_end = ranges[i]
+                data = None
+                for start in range(group_start, group_end, chunk_rows):
+                    end = min(start + chunk_rows, group_end)
+                    # Skip chunks done before a checkpoint
+                    if parallel and start < resume_row:
+                        continue
+                    # Only read the row group once we know we need it
+                    if data is None:
+                        data = f.read_row_group(i, cols)
+                    s = start - group_start
+                    e = end - group_start
+                    yield start, end, {col: x[s:e] for col, x in data.items()}
+            return
+
+        group_starts = [r[0] for r in ranges]
+        loaded = {}
+        for start, end in self.data_ranges_by_rank(
+            f.get_size(), chunk_rows, parallel=parallel, resume_row=resume_row
+        ):
+            # The range of row groups overlapping this chunk
+            first = bisect.bisect_right(group_starts, start) - 1
+            last = bisect.bisect_right(group_starts, end - 1) - 1
+            needed = range(first, last + 1)
+
+            # Re-use any we already have
+            loaded = {
+                i: loaded[i] if i in loaded else f.read_row_group(i, cols)
+                for i in needed
+            }
+
+            data = {}
+            for col in cols:
+                pieces = []
+                for i in needed:
+                    group_start, group_end = ranges[i]
+                    s = max(start, group_start) - group_start
+                    e = min(end, group_end) - group_start
+                    pieces.append(loaded[i][col][s:e])
+                data[col] = pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+            yield start, end, data
+
+    def data_ranges_by_rank(self, n_rows, chunk_rows, parallel=True, resume_row=0):
+        # We extend the parent method to skip chunks before resume_row,
+        # which were completed in an earlier run.
+        for start, end in super().data_ranges_by_rank(
+            n_rows, chunk_rows, parallel=parallel
+        ):
+            if parallel and start < resume_row:
+                continue
+            yield start, end
+
+    def open_checkpoint(self, tag, n_rows):
+        """
+        Make a Checkpointer for a stage that loops over chunks of data,
+        if the checkpoint_interval option is set for the stage.
+
+        The checkpoint is saved next to the in-progress output with the given tag,
+        which is the file that can be re-opened to carry on with when resuming.
+
+        Parameters
+        ----------
+        tag: str
+            The main output tag for the stage
+        n_rows: int
+            The number of rows the loop goes through, in chunks of chunk_rows
+
+        Returns
+        -------
+        checkpoint: Checkpointer or None
+            None if checkpointing is switched off
+        """
+        interval = self.optional_config("checkpoint_interval", 0)
+        if not interval:
+            return None
+
+        # Anything that changes which chunks a process gets or what
+        # it does with them means we can't use an old checkpoint.
+        config_text = repr(sorted((k, str(v)) for k, v in self.config.items()))
+        key = {
+            "nprocess": self.size,
+            "config": hashlib.md5(config_text.encode()).hexdigest(),
+        }
+        path = self.get_output(self.get_aliased_tag(tag))
+        chunk_rows = self.config["chunk_rows"]
+        n_chunks = (n_rows + chunk_rows - 1) // chunk_rows
+        return Checkpointer(
+            path, interval, key, rank=self.rank, comm=self.comm, n_chunks=n_chunks
+        )
+
+    def combined_iterators(
+        self, rows, *inputs, parallel=True, prefetch=None, resume_row=0
+    ):
+        """
+        Iterate through chunks of several HDF5 inputs at the same time.
+
+        The remaining arguments should come in threes: tag, group, column list.
+        The data from the files is merged into a single dictionary for each chunk.
+        Chunks before resume_row are skipped, as in iterate_hdf.
+
+        If there is only one input, so the chunks do not have to line up with
+        another file, and the stage is not checkpointing, then a Parquet input is
+        read in chunks aligned to its row groups, which reads each one only once.
+
+        If prefetch is set (or if it is None and the stage has a prefetch_chunks
+        configuration option) then up to that many chunks are read ahead
+        in a background thread while the caller works on the current one.
+        """
+        if prefetch is None:
+            prefetch = self.optional_config("prefetch_chunks", 0)
+
+        it = self._combined_iterators(
+            rows, *inputs, parallel=parallel, resume_row=resume_row
+        )
+        return prefetch_iterated(it, prefetch)
+
+    def _combined_iterators(self, rows, *inputs, parallel=True, resume_row=0):
         if not len(inputs) % 3 == 0:
             raise ValueError(
                 "Arguments to combined_iterators should be in threes: "
@@ -64,13 +392,25 @@ class PipelineStage(PipelineStageBase):
             )
         n = len(inputs) // 3
 
+        # Checkpoints are saved on the chunk schedule of iterate_hdf,
+        # so they need the unaligned chunks.
+        aligned = n == 1 and not self.optional_config("checkpoint_interval", 0)
+
         iterators = []
         for i in range(n):
             tag = inputs[3 * i]
             section = inputs[3 * i + 1]
             cols = inputs[3 * i + 2]
             iterators.append(
-                self.iterate_hdf(tag, section, cols, rows, parallel=parallel)
+                self.iterate_hdf(
+                    tag,
+                    section,
+                    cols,
+                    rows,
+                    parallel=parallel,
+                    resume_row=resume_row,
+                    aligned=aligned,
+                )
             )
 
         for it in zip(*iterators):
@@ -79,12 +419,20 @@ class PipelineStage(PipelineStageBase):
                 data.update(d)
             yield s, e, data
 
-    def gather_provenance(self):
-        provenance = {}
+    def setup_mpi(self, comm=None):
+        super().setup_mpi(comm)
 
-        for key, value in self.config.items():
-            provenance[f"config/{key}"] = str(value)
+        # All the processes come through here, so this is a good place to
+        # collect the slow parts of the provenance, once, on the root process,
+        # rather than having every process run git and re-open the inputs.
+        if self.comm is not None:
+            info = self._input_and_git_provenance() if self.rank == 0 else None
+            self._cached_provenance = self.comm.bcast(info)
 
+    def _input_and_git_provenance(self):
+        # These are slow to collect, but can't change while the stage runs,
+        # so gather_provenance only does this once.
+        provenance = {}
         for name, tag_cls in self.inputs:
             try:
                 f = self.open_input(name, wrapper=True)
@@ -97,13 +445,33 @@ class PipelineStage(PipelineStageBase):
 
         provenance["gitdiff"] = git_diff()
         provenance["githead"] = git_current_revision()
+        return provenance
+
+    def gather_provenance(self):
+        """
+        Collect information about the configuration, inputs, code version
+        and modules used by this stage, to be saved in outputs.
+
+        The input UUIDs and git information are collected only once per stage,
+        and under MPI only on the root process.  The configuration and module
+        versions can change while the stage runs, so they are collected
+        every time.
+        """
+        provenance = {}
+
+        for key, value in self.config.items():
+            provenance[f"config/{key}"] = str(value)
+
+        if self._cached_provenance is None:
+            self._cached_provenance = self._input_and_git_provenance()
+        provenance.update(self._cached_provenance)
 
         for module, version in find_module_versions().items():
             provenance[f"versions/{module}"] = version
 
         return provenance
 
-    def open_output(self, tag, wrapper=False, **kwargs):
+    def open_output(self, tag, wrapper=False, resume=False, **kwargs):
         """
         Find and open an output file with the given tag, in write mode.
 
@@ -117,6 +485,8 @@ class PipelineStage(PipelineStageBase):
         also saves configuration information.  Putting this here right
         now for testing.
 
+        If resume is True then the existing in-progress file is re-opened
+        to carry on writing to it, instead of a new one being created.
         """
         # This is added to cope with the new "aliases" system
         # in ceci - it lets us run the same code with different
@@ -162,10 +532,13 @@ class PipelineStage(PipelineStageBase):
                 )
                 raise RuntimeError("h5py module is not MPI-enabled.")
 
-        extra_provenance = self.gather_provenance()
-
-        # Return an opened object representing the file
-        obj = output_class(path, "w", extra_provenance=extra_provenance, **kwargs)
+        # Return an opened object representing the file.
+        # When resuming the provenance is already in the file.
+        if resume:
+            obj = output_class(path, "r+", **kwargs)
+        else:
+            extra_provenance = self.gather_provenance()
+            obj = output_class(path, "w", extra_provenance=extra_provenance, **kwargs)
 
         if wrapper:
             return obj
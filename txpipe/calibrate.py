@@ -1,6 +1,12 @@
 from .base_stage import PipelineStage
 from .data_types import ShearCatalog, TomographyCatalog
-from .utils import read_shear_catalog_type, Calibrator, Splitter, rename_iterated
+from .utils import (
+    read_shear_catalog_type,
+    Calibrator,
+    Splitter,
+    rename_iterated,
+    chunk_bin_offsets,
+)
 import numpy as np
 
 
@@ -25,6 +31,11 @@ class TXShearCalibration(PipelineStage):
 
     We are not (yet) saving per-patch catalogs for TreeCorr here. We might want to
     do that later.
+
+    By default the work is split up by bin among processes, so there's no point
+    using more than nbin + 1 processes. If row_parallel is set then a first cheap
+    pass over the bin column works out where each chunk goes in the output,
+    and then each process reads and writes only its own chunks.
     """
 
     name = "TXShearCalibration"
@@ -42,6 +53,8 @@ class TXShearCalibration(PipelineStage):
         "chunk_rows": 100_000,
         "subtract_mean_shear": True,
         "extra_cols": [""],
+        "row_parallel": False,
+        "buffer_bytes": 100_000_000,
     }
 
     def run(self):
@@ -75,19 +88,26 @@ class TXShearCalibration(PipelineStage):
         else:
             output_cols = ["ra", "dec", "weight", "g1", "g2","c1","c2"] + extra_cols
 
-        # We parallelize by bin.  This isn't ideal but we don't know the number
-        # of objects in each bin per chunk, so we can't parallelize in full.  This
-        #  is a quick stage though.
         bins = list(range(nbin)) + ["all"]
-        my_bins = list(self.split_tasks_by_rank(bins))
+        row_parallel = self.config["row_parallel"]
 
-        # Print out which bins this proc will do, also as a prompt to the user
-        #  in case they're wondering why adding procs doesn't help
-        if my_bins:
-            my_bins_text = ", ".join(str(x) for x in my_bins)
-            print(f"Process {self.rank} collating bins: [{my_bins_text}]")
+        if row_parallel:
+            # Every process does every bin, but only for its own chunks
+            my_bins = bins
+            offsets = self.compute_chunk_offsets(nbin)
         else:
-            print(f"Note: Process {self.rank} will not do anything.")
+            # We parallelize by bin.  This isn't ideal but we don't know the number
+            # of objects in each bin per chunk, so we can't parallelize in full.  This
+            #  is a quick stage though.
+            my_bins = list(self.split_tasks_by_rank(bins))
+
+            # Print out which bins this proc will do, also as a prompt to the user
+            #  in case they're wondering why adding procs doesn't help
+            if my_bins:
+                my_bins_text = ", ".join(str(x) for x in my_bins)
+                print(f"Process {self.rank} collating bins: [{my_bins_text}]")
+            else:
+                print(f"Note: Process {self.rank} will not do anything.")
 
         # make the iterator that loops through data
         it = self.combined_iterators(
@@ -99,20 +119,23 @@ class TXShearCalibration(PipelineStage):
             "shear_tomography_catalog",
             "tomography",
             ["source_bin"],
-            parallel=False,
+            parallel=row_parallel,
         )
 
         #  Main loop
         for s, e, data in rename_iterated(it, renames):
 
-            if self.rank == 0:
+            if row_parallel:
+                print(f"Rank {self.rank} processing data {s:,} - {e:,}")
+                chunk_offsets = offsets[s // self.config["chunk_rows"]]
+            elif self.rank == 0:
                 print(f"Rank 0 processing data {s:,} - {e:,}")
 
             # Rename mcal_g1 -> g1 etc
             self.rename_metacal(data)
 
             #  Now output the calibrated bin data for this processor
-            for b in my_bins:
+            for i, b in enumerate(my_bins):
 
                 # Select objects to go in this bin
                 if b == "all":
@@ -124,25 +147,50 @@ class TXShearCalibration(PipelineStage):
                     w = np.where(data["source_bin"] == b)
                     cal = cals[b]
 
-                # Cut down the data to just this selection for output
-                d = {name: data[name][w] for name in output_cols}
+                # Cut down the data to just this selection for output.
+                # The shears go into a single stacked array so they can be
+                # calibrated in place without making more copies.
+                d = {
+                    name: data[name][w]
+                    for name in output_cols
+                    if name not in ("g1", "g2")
+                }
+                g = np.empty((2, w[0].size), dtype=data["g1"].dtype)
+                g[0] = data["g1"][w]
+                g[1] = data["g2"][w]
 
                 # Calibrate the shear columns
                 if cat_type=='hsc':
-                    d["g1"], d["g2"] = cal.apply(
-                        d["g1"], d["g2"], d["c1"], d["c2"]
-                    )
+                    cal.apply_inplace(g, d["c1"], d["c2"])
                 else:
-                    d["g1"], d["g2"] = cal.apply(
-                        d["g1"], d["g2"], subtract_mean=subtract_mean_shear
-                    )
+                    cal.apply_inplace(g, subtract_mean=subtract_mean_shear)
+                d["g1"], d["g2"] = g
 
                 # Write output, keeping track of sizes
-                splitter.write_bin(d, b)
+                start = chunk_offsets[i] if row_parallel else None
+                splitter.write_bin(d, b, start=start)
 
-        splitter.finish(my_bins)
+        if row_parallel:
+            splitter.finish(comm=self.comm)
+        else:
+            splitter.finish(my_bins)
         output_file.close()
 
+    def compute_chunk_offsets(self, nbin):
+        # Read just the bin column to work out how many objects
+        # from each chunk go in each bin, and so where each chunk
+        # should be written in the output.
+        chunk_rows = self.config["chunk_rows"]
+        with self.open_input("shear_tomography_catalog") as f:
+            n = f["tomography/source_bin"].size
+        n_chunk = (n + chunk_rows - 1) // chunk_rows
+
+        it = self.iterate_hdf(
+            "shear_tomography_catalog", "tomography", ["source_bin"], chunk_rows
+        )
+        chunks = ((s // chunk_rows, data["source_bin"]) for s, e, data in it)
+        return chunk_bin_offsets(chunks, nbin, n_chunk, self.comm)
+
     def setup_output(self, extra_cols):
         # count the expected number of objects per bin from the tomo data
         with self.open_input("shear_tomography_catalog") as f:
@@ -172,7 +220,14 @@ class TXShearCalibration(PipelineStage):
         bins["all"] = count2d
         # These are the possible integer columns
         dtypes = {"id": "i8", "flags": "i8"}
-        splitter = Splitter(g, "bin", cols, bins, dtypes=dtypes)
+        splitter = Splitter(
+            g,
+            "bin",
+            cols,
+            bins,
+            dtypes=dtypes,
+            buffer_bytes=self.config["buffer_bytes"],
+        )
 
         return f, splitter, nbin
 
@@ -39,8 +39,12 @@ class DataFile:
         self.path = path
         self.mode = mode
 
-        if mode not in ["r", "w"]:
-            raise ValueError(f"File 'mode' argument must be 'r' or 'w' not '{mode}'")
+        # r+ mode is used to re-open an incomplete output file and carry
+        # on writing to it, for example when resuming from a checkpoint
+        if mode not in ["r", "w", "r+"]:
+            raise ValueError(
+                f"File 'mode' argument must be 'r', 'r+' or 'w' not '{mode}'"
+            )
 
         self.file = self.open(path, mode, **kwargs)
 
@@ -503,13 +507,56 @@ class PickleFile(DataFile):
 
 
 class ParquetFile(DataFile):
+    """
+    A Parquet file, read using pyarrow.
+
+    As well as being used as an input type directly, this is used by
+    PipelineStage.iterate_hdf to read catalogs that are supplied as Parquet
+    instead of HDF5. Parquet files are split into "row groups", which are
+    the smallest unit that can be read, so the methods here work
+    with those.
+    """
+
     suffiz = "pq"
 
     def open(self, path, mode):
         import pyarrow.parquet
         if mode != "r":
             raise NotImplementedError("Not implemented writing to Parquet")
-        return pyarrow.parquet.ParquetFile(path)
+        return pyarrow.parquet.ParquetFile(path, memory_map=True)
 
     def close(self):
         pass
+
+    def get_size(self):
+        return self.file.metadata.num_rows
+
+    def row_group_ranges(self):
+        """
+        Return a list of the (start, end) rows of each row group in the file.
+        """
+        import numpy as np
+
+        sizes = [
+            self.file.metadata.row_group(i).num_rows
+            for i in range(self.file.num_row_groups)
+        ]
+        ends = np.cumsum(sizes, dtype=int)
+        starts = ends - sizes
+        return list(zip(starts, ends))
+
+    def read_row_group(self, i, cols):
+        """
+        Read the selected columns from a row group, as a dictionary of numpy arrays.
+
+        Where possible (numeric columns with no missing values) the arrays share
+        memory with the arrow table, instead of being copied.
+        """
+        table = self.file.read_row_group(i, columns=cols)
+        data = {}
+        for col in cols:
+            column = table.column(col)
+            if column.num_chunks == 1:
+                column = column.chunk(0)
+            data[col] = column.to_numpy(zero_copy_only=False)
+        return data
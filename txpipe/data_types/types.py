@@ -328,6 +328,45 @@ class PhotozPDFFile(HDFFile):
     required_datasets = []
 
 
+class CompactPhotozPDFFile(PhotozPDFFile):
+    """
+    PDFs on a redshift grid as written by the RAIL estimation stages,
+    in the "pdf" group, in any of their storage formats: float32,
+    float16, 16-bit integers with a scale per object ("quantized"),
+    or a set of quantiles.
+    """
+
+    required_datasets = ["pdf/zgrid"]
+
+    def read_zgrid(self):
+        return self.file["pdf/zgrid"][:]
+
+    def storage(self):
+        # Files from before the storage option was added are float32
+        return self.file["pdf"].attrs.get("storage", "float32")
+
+    def read_pdfs(self, start=None, end=None):
+        """
+        Read a range of rows of PDFs, decoded to float32 values on the
+        redshift grid, whatever format they are stored in.
+        """
+        from ..utils.pdfs import dequantize_pdfs, pdfs_from_quantiles
+        import numpy as np
+
+        g = self.file["pdf"]
+        storage = self.storage()
+        if storage in ["float32", "float16"]:
+            return g["pdf"][start:end].astype(np.float32, copy=False)
+        elif storage == "quantized":
+            return dequantize_pdfs(g["pdf"][start:end], g["scale"][start:end])
+        elif storage == "quantiles":
+            return pdfs_from_quantiles(
+                self.read_zgrid(), g["quantiles"][start:end], g["quantile_levels"][:]
+            )
+        else:
+            raise ValueError(f"Unknown PDF storage type {storage}")
+
+
 class CSVFile(DataFile):
     suffix = "csv"
 
@@ -9,6 +9,7 @@ from .utils.calibration_tools import (
     apply_lensfit_calibration,
     MeanShearInBins,
     read_shear_catalog_type,
+    metacal_variants,
     metadetect_variants,
     band_variants,
 )
@@ -24,6 +25,11 @@ class TXSourceDiagnosticPlots(PipelineStage):
     This includes both tomographic and 2D measurements, and includes
     the PSF as a function of various quantities as well as overall
     histograms.
+
+    For metacal catalogs, if the tomography catalog includes the bins
+    of each object under the sheared variants (the response_columns option
+    of the selector), then these and the per-object responses are used
+    instead of reading the sheared shear columns.
     """
 
     name = "TXSourceDiagnosticPlots"
@@ -83,6 +89,7 @@ class TXSourceDiagnosticPlots(PipelineStage):
         psf_prefix = self.config["psf_prefix"]
         shear_prefix = self.config["shear_prefix"]
         bands = self.config["bands"]
+        self.response_columns = (cat_type == "metacal") and self.has_response_columns()
 
         if cat_type == "metacal":
             shear_cols = [
@@ -111,6 +118,9 @@ class TXSourceDiagnosticPlots(PipelineStage):
                 "mcal_s2n_2m",
                 "weight",
             ] + [f"mcal_mag_{b}" for b in bands]
+            if self.response_columns:
+                variants = metacal_variants("mcal_g1", "mcal_g2")
+                shear_cols = [c for c in shear_cols if c not in variants[2:]]
         elif cat_type == "metadetect":
             # g1, g2, T, psf_g1, psf_g2, T, s2n, weight, magnitudes
             shear_cols = metadetect_variants(
@@ -144,6 +154,8 @@ class TXSourceDiagnosticPlots(PipelineStage):
 
         shear_tomo_cols = ["source_bin"]
 
+        # The selections here cut on source_bin != -1 whether or not the
+        # variant bins are available, so we don't need them.
         if self.config["shear_catalog_type"] == "metacal":
             more_iters = ["shear_tomography_catalog", "response", ["R_gamma"]]
         elif self.config["shear_catalog_type"] == "lensfit":
@@ -181,6 +193,10 @@ class TXSourceDiagnosticPlots(PipelineStage):
             except StopIteration:
                 pass
 
+    def has_response_columns(self):
+        with self.open_input("shear_tomography_catalog") as f:
+            return "response/source_bin_1p" in f
+
     def plot_psf_shear(self):
         # mean shear in bins of PSF
         print("Making PSF shear plot")
@@ -201,6 +217,7 @@ class TXSourceDiagnosticPlots(PipelineStage):
             delta_gamma,
             cut_source_bin=True,
             shear_catalog_type=self.config["shear_catalog_type"],
+            response_columns=self.response_columns,
         )
         p2 = MeanShearInBins(
             f"{psf_prefix}g2",
@@ -208,6 +225,7 @@ class TXSourceDiagnosticPlots(PipelineStage):
             delta_gamma,
             cut_source_bin=True,
             shear_catalog_type=self.config["shear_catalog_type"],
+            response_columns=self.response_columns,
         )
 
         psf_g_mid = 0.5 * (psf_g_edges[1:] + psf_g_edges[:-1])
@@ -313,6 +331,7 @@ class TXSourceDiagnosticPlots(PipelineStage):
             delta_gamma,
             cut_source_bin=True,
             shear_catalog_type=self.config["shear_catalog_type"],
+            response_columns=self.response_columns,
         )
 
         while True:
@@ -391,6 +410,7 @@ class TXSourceDiagnosticPlots(PipelineStage):
             delta_gamma,
             cut_source_bin=True,
             shear_catalog_type=self.config["shear_catalog_type"],
+            response_columns=self.response_columns,
         )
 
         while True:
@@ -461,6 +481,7 @@ class TXSourceDiagnosticPlots(PipelineStage):
             delta_gamma,
             cut_source_bin=True,
             shear_catalog_type=self.config["shear_catalog_type"],
+            response_columns=self.response_columns,
         )
 
         while True:
@@ -20,6 +20,13 @@ class TXCosmoDC2Mock(PipelineStage):
     This is mainly useful for testing infrastructure in advance
     of the DC2 catalogs being available, but might also be handy
     for starting from a purer simulation.
+
+    By default the outputs are made at the maximum size they could be, and cut
+    down at the end once we know how many objects passed the cuts. If exact_sizing
+    is set we instead run a first, cheaper pass through the catalog that just
+    applies the cuts and counts the objects, so that the outputs can be made
+    at exactly the right size. The random number generator is re-seeded for each
+    chunk so that both passes select the same objects.
     """
 
     name = "TXCosmoDC2Mock"
@@ -45,6 +52,7 @@ class TXCosmoDC2Mock(PipelineStage):
         "Mag_r_limit": -19,  # used to decide what objects to cut out
         "metadetect": True,  # Alternatively we will mock a  metacal catalog
         "add_shape_noise": True, 
+        "exact_sizing": False,  # count the output size first instead of truncating
     }
 
     def data_iterator(self, gc):
@@ -114,14 +122,32 @@ class TXCosmoDC2Mock(PipelineStage):
                 f"Will select approx {100*select_fraction:.2f}% of objects ({target_size})"
             )
 
+        # Either count exactly how many objects we will have, or allocate
+        # the maximum we could need and cut down afterwards
+        exact_sizing = self.config["exact_sizing"]
+        if exact_sizing:
+            # This is drawn at random so that the overall behaviour is as before,
+            # but the same for both passes.
+            base_seed = np.random.randint(2**31)
+            if self.comm is not None:
+                base_seed = self.comm.bcast(base_seed)
+            output_size = self.count_output_rows(gc, N, target_size, base_seed)
+        else:
+            output_size = target_size
+
         # Prepare output files
         metacal_file = self.open_output("shear_catalog", parallel=self.is_mpi())
         photo_file = self.open_output("photometry_catalog", parallel=self.is_mpi())
-        photo_cols = self.setup_photometry_output(photo_file, target_size)
+        resizable = not exact_sizing
+        photo_cols = self.setup_photometry_output(photo_file, output_size, resizable)
         if self.config["metadetect"]:
-            metacal_cols = self.setup_metadetect_output(metacal_file, target_size)
+            metacal_cols = self.setup_metadetect_output(
+                metacal_file, output_size, resizable
+            )
         else:
-            metacal_cols = self.setup_metacal_output(metacal_file, target_size)
+            metacal_cols = self.setup_metacal_output(
+                metacal_file, output_size, resizable
+            )
 
         # Load the metacal response file
         self.load_metacal_response_model()
@@ -131,37 +157,20 @@ class TXCosmoDC2Mock(PipelineStage):
         count = 0
 
         # Loop through chunks of
-        for data in self.data_iterator(gc):
+        for i, data in enumerate(self.data_iterator(gc)):
             # The initial chunk size, of all the input data.
             # This will be reduced later as we remove objects
             some_col = list(data.keys())[0]
             chunk_size = len(data[some_col])
             print(f"Process {self.rank} read chunk {count} - {count+chunk_size} of {N}")
             count += chunk_size
-            # Select a random fraction of the catalog if we are cutting down
-            # We can't just take the earliest galaxies because they are ordered
-            # by redshift
-            if target_size != N:
-                select = np.random.uniform(size=chunk_size) < select_fraction
-                nselect = select.sum()
-                print(f"Cutting down to {nselect}/{chunk_size} objects")
-                for name in list(data.keys()):
-                    data[name] = data[name][select]
-
-            # Simulate the various output data sets
-            mock_photometry = self.make_mock_photometry(data)
-
-            # Cut out any objects too faint to be detected and measured.
-            # We have to do this after the photometry, so that we know if
-            # the object is detected, but we can do it before making the mock
-            # metacal info, saving us some time simulating un-needed objects
-            if (
-                self.config["snr_limit"] > 0
-            ):  # otherwise there is no need to run this function which is slow
-                self.remove_undetected(data, mock_photometry)
-
-            if self.config["apply_mag_cut"]:
-                self.apply_magnitude_cut(data)
+
+            # Make sure we make the same choices as in the counting pass
+            if exact_sizing:
+                self.seed_chunk(base_seed, i)
+
+            # Cut down the data and make the photometry
+            mock_photometry = self.select_and_make_photometry(data, N, target_size)
 
             if self.config["metadetect"]:
                 mock_shear = self.make_mock_metadetect(data, mock_photometry)
@@ -181,7 +190,7 @@ class TXCosmoDC2Mock(PipelineStage):
             # Save all output
             self.write_output(
                 start,
-                target_size,
+                output_size,
                 photo_cols,
                 metacal_cols,
                 photo_file,
@@ -193,14 +202,85 @@ class TXCosmoDC2Mock(PipelineStage):
             # The next iteration starts writing where the current one ends.
             start = end
 
-            if start >= target_size:
+            if start >= output_size:
                 break
         # Tidy up
 
         photo_file.close()
         metacal_file.close()
 
-        self.truncate_outputs(end)
+        if not exact_sizing:
+            self.truncate_outputs(end)
+
+    def select_and_make_photometry(self, data, N, target_size):
+        """
+        Cut down a chunk of the input catalog to a random subset if we are
+        making a smaller catalog, make the mock photometry for it, and
+        apply the detection and magnitude cuts.
+
+        The data dictionary is modified in place to remove cut objects.
+
+        Returns
+        -------
+        mock_photometry: dict
+            The mock photometry for the objects that pass the cuts
+        """
+        # Select a random fraction of the catalog if we are cutting down
+        # We can't just take the earliest galaxies because they are ordered
+        # by redshift
+        if target_size != N:
+            select_fraction = target_size / N
+            some_col = list(data.keys())[0]
+            chunk_size = len(data[some_col])
+            select = np.random.uniform(size=chunk_size) < select_fraction
+            nselect = select.sum()
+            print(f"Cutting down to {nselect}/{chunk_size} objects")
+            for name in list(data.keys()):
+                data[name] = data[name][select]
+
+        # Simulate the various output data sets
+        mock_photometry = self.make_mock_photometry(data)
+
+        # Cut out any objects too faint to be detected and measured.
+        # We have to do this after the photometry, so that we know if
+        # the object is detected, but we can do it before making the mock
+        # metacal info, saving us some time simulating un-needed objects
+        if (
+            self.config["snr_limit"] > 0
+        ):  # otherwise there is no need to run this function which is slow
+            self.remove_undetected(data, mock_photometry)
+
+        if self.config["apply_mag_cut"]:
+            self.apply_magnitude_cut(data)
+
+        return mock_photometry
+
+    def count_output_rows(self, gc, N, target_size, base_seed):
+        """
+        Do a first pass through the catalog, applying only the
+        cuts, to count how many objects we will output.
+
+        The random seed is set at the start of each chunk, in the same
+        way as in the main pass, so the same objects are selected.
+        """
+        n = 0
+        for i, data in enumerate(self.data_iterator(gc)):
+            self.seed_chunk(base_seed, i)
+            mock_photometry = self.select_and_make_photometry(data, N, target_size)
+            n += len(mock_photometry["id"])
+
+        if self.comm is not None:
+            n = self.comm.allreduce(n)
+
+        n = min(n, target_size)
+        print(f"Counting pass found {n:,} objects to output")
+        return n
+
+    def seed_chunk(self, base_seed, i):
+        # Each chunk on each process gets its own random stream,
+        # which is the same in the counting and main passes.
+        seed = np.random.SeedSequence([base_seed, self.rank, i]).generate_state(1)
+        np.random.seed(seed)
 
     def truncate_outputs(self, n):
         import h5py
@@ -237,7 +317,7 @@ class TXCosmoDC2Mock(PipelineStage):
         print(f"- Rank {self.rank} writing output to {start}-{start+chunk_size}")
         return start, end
 
-    def setup_photometry_output(self, photo_file, target_size):
+    def setup_photometry_output(self, photo_file, target_size, resizable=True):
         # Get a list of all the column names
         cols = ["ra", "dec", "extendedness"]
         for band in self.bands:
@@ -252,18 +332,25 @@ class TXCosmoDC2Mock(PipelineStage):
         group = photo_file.create_group("photometry")
 
         # Extensible columns becase we don't know the size yet.
-        # We will cut down the size at the end.
+        # We will cut down the size at the end, unless we counted it exactly.
+        # Magnitudes, errors and S/N can be stored at lower precision.
+        maxshape = (target_size,) if resizable else None
         for col in cols:
-            group.create_dataset(
-                col, (target_size,), maxshape=(target_size,), dtype="f8"
+            self.create_catalog_dataset(
+                group,
+                col,
+                target_size,
+                "f8",
+                maxshape=maxshape,
+                downcast=col.startswith(("mag_", "snr_")),
             )
 
         # The only non-float column for now
-        group.create_dataset("id", (target_size,), maxshape=(target_size,), dtype="i8")
+        self.create_catalog_dataset(group, "id", target_size, "i8", maxshape=maxshape)
 
         return cols + ["id"]
 
-    def setup_metadetect_output(self, metacal_file, target_size):
+    def setup_metadetect_output(self, metacal_file, target_size, resizable=True):
         # Get a list of all the column names
         cols = metadetect_variants(
             "g1",
@@ -287,22 +374,26 @@ class TXCosmoDC2Mock(PipelineStage):
         group = metacal_file.create_group("shear")
 
         # Extensible columns becase we don't know the size yet.
-        # We will cut down the size at the end.
+        # We will cut down the size at the end, unless we counted it exactly.
+        maxshape = (target_size,) if resizable else None
         for col in cols:
-            group.create_dataset(
-                col, (target_size,), maxshape=(target_size,), dtype="f8"
+            self.create_catalog_dataset(
+                group,
+                col,
+                target_size,
+                "f8",
+                maxshape=maxshape,
+                downcast=col.split("/")[-1].startswith(("mag", "T_err")),
             )
 
         # Integer columns
         int_cols = metadetect_variants("id", "flags")
         for col in int_cols:
-            group.create_dataset(
-                col, (target_size,), maxshape=(target_size,), dtype="i8"
-            )
+            self.create_catalog_dataset(group, col, target_size, "i8", maxshape=maxshape)
 
         return cols + int_cols
 
-    def setup_metacal_output(self, metacal_file, target_size):
+    def setup_metacal_output(self, metacal_file, target_size, resizable=True):
         # Get a list of all the column names
         cols = (
             [
@@ -327,19 +418,22 @@ class TXCosmoDC2Mock(PipelineStage):
         group = metacal_file.create_group("shear")
 
         # Extensible columns becase we don't know the size yet.
-        # We will cut down the size at the end.
-
+        # We will cut down the size at the end, unless we counted it exactly.
+        maxshape = (target_size,) if resizable else None
         for col in cols:
-            group.create_dataset(
-                col, (target_size,), maxshape=(target_size,), dtype="f8"
+            self.create_catalog_dataset(
+                group,
+                col,
+                target_size,
+                "f8",
+                maxshape=maxshape,
+                downcast=col.startswith(("mcal_mag", "mcal_T_err")),
             )
 
-        group.create_dataset("id", (target_size,), maxshape=(target_size,), dtype="i8")
+        self.create_catalog_dataset(group, "id", target_size, "i8", maxshape=maxshape)
 
         for col in metacal_variants("mcal_flags"):
-            group.create_dataset(
-                col, (target_size,), maxshape=(target_size,), dtype="i8"
-            )
+            self.create_catalog_dataset(group, col, target_size, "i8", maxshape=maxshape)
 
         return cols + ["id", "mcal_flags"]
 
@@ -975,6 +1069,7 @@ class TXBuzzardMock(TXCosmoDC2Mock):
         "max_npix": 99999999999999,
         "unit_response": False,
         "flip_g2": True,  # this matches the metacal definition, and the treecorr/namaster one
+        "exact_sizing": False,  # count the output size first instead of truncating
     }
 
 
@@ -1013,6 +1108,7 @@ class TXGaussianSimsMock(TXCosmoDC2Mock):
         "apply_mag_cut": False,  # used when comparing to descqa measurements
         "metadetect": True,  # Alternatively we will mock a  metacal catalog
         "add_shape_noise": False, # the input cats already have shape noise included
+        "exact_sizing": False,  # count the output size first instead of truncating
     }
 
     def data_iterator(self, cat):
@@ -7,12 +7,127 @@ from .data_types import (
     FiducialCosmology,
     FitsFile,
 )
-from .utils import LensNumberDensityStats, Splitter, rename_iterated
+from .utils import (
+    LensNumberDensityStats,
+    Splitter,
+    rename_iterated,
+    chunk_bin_offsets,
+)
 from .binning import build_tomographic_classifier, apply_classifier
 import numpy as np
 import warnings
 
 
+def boss_lens_bin(mag_g, mag_r, mag_i, zbin, nbin, cuts, out=None, block_rows=100_000):
+    """
+    Apply the BOSS LOWZ and CMASS photometry cuts and assign the
+    selected objects to their tomographic bin, in one pass.
+
+    This applies the same cuts as TXBaseLensSelector.select_lens followed
+    by calculate_tomography, but the colours and cuts are worked out in
+    blocks of rows, in float32, in a few scratch arrays that are re-used for
+    each block, instead of making a dozen full-length temporary arrays.
+
+    Because of the float32 rounding, objects lying within about 1e-6 mag of
+    a cut can land on the other side of it, so a small number of objects
+    at the boundaries may be selected or binned differently from the
+    float64 selection.
+
+    Parameters
+    ----------
+    mag_g, mag_r, mag_i: arrays of shape (n,)
+        The magnitudes of the objects
+
+    zbin: int array of shape (n,)
+        The tomographic bin from the redshift alone, or -1 for none
+
+    nbin: int
+        The number of tomographic bins
+
+    cuts: dict
+        The cut values, with the same keys as the TXBaseLensSelector
+        configuration options
+
+    out: int array of shape (n,) or None
+        If set, the output is written to this array
+
+    block_rows: int
+        The number of rows to do at once
+
+    Returns
+    -------
+    lens_bin: int array of shape (n,)
+        The lens bin of each object, or -1 for none
+
+    counts: int array of shape (nbin,)
+        The number of objects in each bin
+    """
+    n = len(mag_i)
+    if out is None:
+        out = np.empty(n, dtype=np.int32)
+    counts = np.zeros(nbin, dtype=int)
+
+    m = min(n, block_rows)
+    ri = np.empty(m, dtype=np.float32)
+    gr = np.empty(m, dtype=np.float32)
+    t = np.empty(m, dtype=np.float32)
+    u = np.empty(m, dtype=np.float32)
+    sel = np.empty(m, dtype=bool)
+    lowz = np.empty(m, dtype=bool)
+    cmass = np.empty(m, dtype=bool)
+
+    for s in range(0, n, block_rows):
+        e = min(s + block_rows, n)
+        k = e - s
+        g = mag_g[s:e]
+        r = mag_r[s:e]
+        i = mag_i[s:e]
+        ri_k, gr_k, t_k, u_k = ri[:k], gr[:k], t[:k], u[:k]
+        sel_k, lowz_k, cmass_k = sel[:k], lowz[:k], cmass[:k]
+
+        np.subtract(r, i, out=ri_k)
+        np.subtract(g, r, out=gr_k)
+
+        # LOWZ: |cperp| < cperp_cut, with cperp = (r - i) - (g - r) / 4 - 0.18
+        np.multiply(gr_k, 0.25, out=t_k)
+        np.subtract(ri_k, t_k, out=t_k)
+        t_k -= 0.18
+        np.abs(t_k, out=t_k)
+        np.less(t_k, cuts["cperp_cut"], out=lowz_k)
+
+        # r < r_cpar_cut + cpar / 0.3, with cpar = 0.7 (g - r) + 1.2 ((r - i) - 0.18)
+        np.multiply(ri_k, 1.2, out=t_k)
+        np.multiply(gr_k, 0.7, out=u_k)
+        t_k += u_k
+        t_k -= 1.2 * 0.18
+        t_k /= 0.3
+        t_k += cuts["r_cpar_cut"]
+        np.less(r, t_k, out=sel_k)
+        lowz_k &= sel_k
+        np.greater(r, cuts["r_lo_cut"], out=sel_k)
+        lowz_k &= sel_k
+        np.less(r, cuts["r_hi_cut"], out=sel_k)
+        lowz_k &= sel_k
+
+        # CMASS
+        np.greater(i, cuts["i_lo_cut"], out=cmass_k)
+        np.less(i, cuts["i_hi_cut"], out=sel_k)
+        cmass_k &= sel_k
+        np.less(ri_k, cuts["r_i_cut"], out=sel_k)
+        cmass_k &= sel_k
+
+        # Objects in either sample keep their redshift bin
+        np.logical_or(lowz_k, cmass_k, out=sel_k)
+        np.logical_not(sel_k, out=sel_k)
+        out_k = out[s:e]
+        out_k[:] = zbin[s:e]
+        out_k[sel_k] = -1
+
+        counts += np.bincount(out_k + 1, minlength=nbin + 1)[1:]
+
+    return out, counts
+
+
 class TXBaseLensSelector(PipelineStage):
     """
     Base class for lens object selection, using the BOSS Target Selection.
@@ -22,6 +137,10 @@ class TXBaseLensSelector(PipelineStage):
     shear-position calibrations.
 
     The cut used here is simplistic and should be replaced.
+
+    If checkpoint_interval is set then progress is saved every
+    that many chunks, and the stage will resume from there if re-run
+    after being stopped.
     """
 
     name = "TXBaseLensSelector"
@@ -45,6 +164,7 @@ class TXBaseLensSelector(PipelineStage):
         "i_hi_cut": 19.9,
         "r_i_cut": 2.0,
         "random_seed": 42,
+        "checkpoint_interval": 0,
     }
 
     def run(self):
@@ -60,20 +180,28 @@ class TXBaseLensSelector(PipelineStage):
          - Average the selection biases
          - Write out biases and close the output
         """
-        import astropy.table
-        import sklearn.ensemble
-
         if self.name == "TXBaseLensSelector":
             raise ValueError("Do not run TXBaseLensSelector - run a sub-class")
 
         # Suppress some warnings from numpy that are not relevant
         original_warning_settings = np.seterr(all="ignore")
 
-        # The output file we will put the tomographic
-        # information into
-        output_file = self.setup_output()
-
-        iterator = self.data_iterator()
+        # If we are resuming a previous run that was stopped part-way through
+        # then we carry on with the same output file.
+        n = self.get_input_size("photometry_catalog", "photometry")
+        checkpoint = self.open_checkpoint("lens_tomography_catalog", n)
+        if checkpoint is not None and checkpoint.resuming:
+            output_file = self.open_output(
+                "lens_tomography_catalog", parallel=True, resume=True
+            )
+        else:
+            # The output file we will put the tomographic
+            # information into
+            output_file = self.setup_output()
+            # Make sure the file structure is on disc in case we
+            # need to come back to it after being stopped.
+            if checkpoint is not None:
+                output_file.flush()
 
         selector = self.prepare_selector()
 
@@ -84,18 +212,22 @@ class TXBaseLensSelector(PipelineStage):
 
         number_density_stats = LensNumberDensityStats(nbin_lens, self.comm)
 
+        # Pick up the counts from the previous run, if there is one.
+        # The iterator then skips the chunks that it already did.
+        resume_row = 0
+        if checkpoint is not None:
+            resume_row = checkpoint.restore(number_density_stats=number_density_stats)
+
+        iterator = self.data_iterator(resume_row=resume_row)
+
         # Loop through the input data, processing it chunk by chunk
         for (start, end, phot_data) in iterator:
             print(f"Process {self.rank} running selection for rows {start:,}-{end:,}")
 
             pz_data = self.apply_redshift_cut(phot_data, selector)
 
-            # Select lens bin objects
-            lens_gals = self.select_lens(phot_data)
-
-            # Combine this selection with size and snr cuts to produce a source selection
-            # and calculate the shear bias it would generate
-            tomo_bin, counts = self.calculate_tomography(pz_data, phot_data, lens_gals)
+            # Select lens objects and combine with the redshift bins
+            tomo_bin, counts = self.select_lens_bins(pz_data, phot_data)
 
             # Save the tomography for this chunk
             self.write_tomography(output_file, start, end, tomo_bin)
@@ -104,12 +236,18 @@ class TXBaseLensSelector(PipelineStage):
             # These will be brought together at the end.
             number_density_stats.add_data(tomo_bin)
 
+            if checkpoint is not None:
+                checkpoint.completed(end, output_file)
+
         # Do the selection bias averaging and output that too.
         self.write_global_values(output_file, number_density_stats)
 
         # Save and complete
         output_file.close()
 
+        if checkpoint is not None:
+            checkpoint.finish()
+
         # Restore the original warning settings in case we are being called from a library
         np.seterr(**original_warning_settings)
 
@@ -123,12 +261,10 @@ class TXBaseLensSelector(PipelineStage):
 
         z = phot_data[f"z"]
 
-        zbin = np.repeat(-1, len(z))
-        for zi in range(nbin):
-            mask_zbin = (z >= self.config["lens_zbin_edges"][zi]) & (
-                z < self.config["lens_zbin_edges"][zi + 1]
-            )
-            zbin[mask_zbin] = zi
+        # Objects with lens_zbin_edges[i] <= z < lens_zbin_edges[i + 1]
+        # are in bin i, and any outside the edges (or NaN) get -1
+        zbin = np.digitize(z, self.config["lens_zbin_edges"]) - 1
+        zbin[zbin == nbin] = -1
 
         pz_data[f"zbin"] = zbin
 
@@ -141,13 +277,14 @@ class TXBaseLensSelector(PipelineStage):
         Creates the data sets and groups to put module output
         in the tomography_catalog output file.
         """
-        n = self.open_input("photometry_catalog")["photometry/ra"].size
+        # The photometry catalog can be HDF5 or Parquet
+        n = self.get_input_size("photometry_catalog", "photometry")
         nbin_lens = len(self.config["lens_zbin_edges"]) - 1
 
         outfile = self.open_output("lens_tomography_catalog", parallel=True)
         group = outfile.create_group("tomography")
-        group.create_dataset("lens_bin", (n,), dtype="i")
-        group.create_dataset("lens_weight", (n,), dtype="f")
+        self.create_catalog_dataset(group, "lens_bin", n, "i4")
+        self.create_catalog_dataset(group, "lens_weight", n, "f4")
         group.create_dataset("lens_counts", (nbin_lens,), dtype="i")
         group.create_dataset("lens_counts_2d", (1,), dtype="i")
 
@@ -196,9 +333,44 @@ class TXBaseLensSelector(PipelineStage):
             group["lens_counts"][:] = lens_counts
             group["lens_counts_2d"][:] = lens_counts_2d
 
+    def select_lens_bins(self, pz_data, phot_data):
+        """
+        Select lens objects and assign them to tomographic bins.
+
+        This applies select_lens and then calculate_tomography. When the
+        stage uses the standard BOSS cuts and binning it instead uses the
+        faster fused version in boss_lens_bin, which gives the bin directly.
+
+        Returns
+        -------
+        tomo_bin: int array
+            The lens bin for each object, or -1 for no bin
+        counts: int array
+            The number of objects in each bin
+        """
+        cls = type(self)
+        if (cls.select_lens is TXBaseLensSelector.select_lens) and (
+            cls.calculate_tomography is TXBaseLensSelector.calculate_tomography
+        ):
+            nbin = len(self.config["lens_zbin_edges"]) - 1
+            return boss_lens_bin(
+                phot_data["mag_g"],
+                phot_data["mag_r"],
+                phot_data["mag_i"],
+                pz_data["zbin"],
+                nbin,
+                self.config,
+            )
+
+        lens_gals = self.select_lens(phot_data)
+        return self.calculate_tomography(pz_data, phot_data, lens_gals)
+
     def select_lens(self, phot_data):
         """Photometry cuts based on the BOSS Galaxy Target Selection:
         http://www.sdss3.org/dr9/algorithms/boss_galaxy_ts.php
+
+        Unless this is overridden, select_lens_bins uses the faster
+        boss_lens_bin instead, which should be kept consistent with this.
         """
         mag_i = phot_data["mag_i"]
         mag_r = phot_data["mag_r"]
@@ -247,19 +419,13 @@ class TXBaseLensSelector(PipelineStage):
     def calculate_tomography(self, pz_data, phot_data, lens_gals):
 
         nbin = len(self.config["lens_zbin_edges"]) - 1
-        n = len(phot_data["mag_i"])
 
         # The main output data - the tomographic
         # bin index for each object, or -1 for no bin.
-        tomo_bin = np.repeat(-1, n)
+        tomo_bin = np.where(lens_gals == 1, pz_data["zbin"], -1)
 
         # We also keep count of total count of objects in each bin
-        counts = np.zeros(nbin, dtype=int)
-
-        for i in range(nbin):
-            sel_00 = (pz_data["zbin"] == i) & (lens_gals == 1)
-            tomo_bin[sel_00] = i
-            counts[i] = sel_00.sum()
+        counts = np.bincount(tomo_bin + 1, minlength=nbin + 1)[1:]
 
         return tomo_bin, counts
 
@@ -277,7 +443,7 @@ class TXTruthLensSelector(TXBaseLensSelector):
         ("photometry_catalog", HDFFile),
     ]
 
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         print(f"We are cheating and using the true redshift.")
         chunk_rows = self.config["chunk_rows"]
         phot_cols = ["mag_i", "mag_r", "mag_g", "redshift_true"]
@@ -286,7 +452,11 @@ class TXTruthLensSelector(TXBaseLensSelector):
         # This code can be run in parallel, and different processes will
         # each get different chunks of the data
         for s, e, data in self.iterate_hdf(
-            "photometry_catalog", "photometry", phot_cols, chunk_rows
+            "photometry_catalog",
+            "photometry",
+            phot_cols,
+            chunk_rows,
+            resume_row=resume_row,
         ):
             data["z"] = data["redshift_true"]
             yield s, e, data
@@ -305,7 +475,7 @@ class TXMeanLensSelector(TXBaseLensSelector):
         ("lens_photoz_pdfs", HDFFile),
     ]
 
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         chunk_rows = self.config["chunk_rows"]
         phot_cols = ["mag_i", "mag_r", "mag_g"]
         z_cols = ["zmean"]
@@ -319,6 +489,7 @@ class TXMeanLensSelector(TXBaseLensSelector):
             "lens_photoz_pdfs",
             "ancil",
             z_cols,
+            resume_row=resume_row,
         )
 
         return rename_iterated(it, rename)
@@ -337,7 +508,7 @@ class TXModeLensSelector(TXBaseLensSelector):
         ("lens_photoz_pdfs", HDFFile),
     ]
 
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         chunk_rows = self.config["chunk_rows"]
         phot_cols = ["mag_i", "mag_r", "mag_g"]
         z_cols = ["zmode"]
@@ -351,6 +522,7 @@ class TXModeLensSelector(TXBaseLensSelector):
             "lens_photoz_pdfs",
             "ancil",
             z_cols,
+            resume_row=resume_row,
         )
 
         return rename_iterated(it, rename)
@@ -369,14 +541,19 @@ class TXRandomForestLensSelector(TXBaseLensSelector):
         "lens_zbin_edges": [float],
         "random_seed": 42,
         "mag_i_limit": 24.1,
+        "checkpoint_interval": 0,
     }
 
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         chunk_rows = self.config["chunk_rows"]
         phot_cols = ["mag_u", "mag_g", "mag_r", "mag_i", "mag_z", "mag_y"]
 
         for s, e, data in self.iterate_hdf(
-            "photometry_catalog", "photometry", phot_cols, chunk_rows
+            "photometry_catalog",
+            "photometry",
+            phot_cols,
+            chunk_rows,
+            resume_row=resume_row,
         ):
             yield s, e, data
 
@@ -409,6 +586,11 @@ class TXLensCatalogSplitter(PipelineStage):
     Split a lens catalog file into a new file with separate bins
 
     Splitting up like this helps reduce memory usage in TreeCorr later
+
+    By default processes each handle different bins, reading the complete
+    catalog. If row_parallel is set then the bin column is read once first to work
+    out where each chunk should go in each bin, and then processes each read and
+    write different chunks.
     """
 
     name = "TXLensCatalogSplitter"
@@ -426,6 +608,8 @@ class TXLensCatalogSplitter(PipelineStage):
         "initial_size": 100_000,
         "chunk_rows": 100_000,
         "extra_cols": [""],
+        "row_parallel": False,
+        "buffer_bytes": 100_000_000,
     }
 
     def run(self):
@@ -447,31 +631,66 @@ class TXLensCatalogSplitter(PipelineStage):
         bins = {b: c for b, c in enumerate(counts)}
         bins["all"] = count2d
         dtypes = {"id": "i8", "flags": "i8"}
-        splitter = Splitter(cat_group, "bin", cols + extra_cols, bins, dtypes=dtypes)
+        splitter = Splitter(
+            cat_group,
+            "bin",
+            cols + extra_cols,
+            bins,
+            dtypes=dtypes,
+            buffer_bytes=self.config["buffer_bytes"],
+        )
 
-        my_bins = list(self.split_tasks_by_rank(bins))
-        if my_bins:
-            my_bins_text = ", ".join(str(x) for x in my_bins)
-            print(f"Process {self.rank} collating bins: [{my_bins_text}]")
+        row_parallel = self.config["row_parallel"]
+        if row_parallel:
+            # Every process does every bin, but only for its own chunks
+            my_bins = list(bins)
+            offsets = self.compute_chunk_offsets(nbin)
         else:
-            print(f"Note: Process {self.rank} will not do anything.")
+            my_bins = list(self.split_tasks_by_rank(bins))
+            if my_bins:
+                my_bins_text = ", ".join(str(x) for x in my_bins)
+                print(f"Process {self.rank} collating bins: [{my_bins_text}]")
+            else:
+                print(f"Note: Process {self.rank} will not do anything.")
 
         for s, e, data in self.data_iterator():
-            if self.rank == 0:
+            if row_parallel:
+                print(f"Process {self.rank} binning data in range {s:,} - {e:,}")
+                chunk_offsets = offsets[s // self.config["chunk_rows"]]
+            elif self.rank == 0:
                 print(f"Process 0 binning data in range {s:,} - {e:,}")
 
             data["weight"] = data["lens_weight"]
-            for b in my_bins:
+            for i, b in enumerate(my_bins):
                 if b == "all":
                     w = np.where(data["lens_bin"] >= 0)
                 else:
                     w = np.where(data["lens_bin"] == b)
                 d = {name: col[w] for name, col in data.items()}
-                splitter.write_bin(d, b)
+                start = chunk_offsets[i] if row_parallel else None
+                splitter.write_bin(d, b, start=start)
 
-        splitter.finish(my_bins)
+        if row_parallel:
+            splitter.finish(comm=self.comm)
+        else:
+            splitter.finish(my_bins)
         cat_output.close()
 
+    def compute_chunk_offsets(self, nbin):
+        # Read just the bin column to work out how many objects
+        # from each chunk go in each bin, and so where each chunk
+        # should be written in the output.
+        chunk_rows = self.config["chunk_rows"]
+        with self.open_input("lens_tomography_catalog") as f:
+            n = f["tomography/lens_bin"].size
+        n_chunk = (n + chunk_rows - 1) // chunk_rows
+
+        it = self.iterate_hdf(
+            "lens_tomography_catalog", "tomography", ["lens_bin"], chunk_rows
+        )
+        chunks = ((s // chunk_rows, data["lens_bin"]) for s, e, data in it)
+        return chunk_bin_offsets(chunks, nbin, n_chunk, self.comm)
+
     def data_iterator(self):
         extra_cols = [c for c in self.config["extra_cols"] if c]
         return self.combined_iterators(
@@ -484,7 +703,7 @@ class TXLensCatalogSplitter(PipelineStage):
             "photometry_catalog",
             "photometry",
             ["ra", "dec"] + extra_cols,
-            parallel=False,
+            parallel=self.config["row_parallel"],
         )
 
 
@@ -515,7 +734,7 @@ class TXExternalLensCatalogSplitter(TXLensCatalogSplitter):
             "lens_catalog",
             "lens",
             ["ra", "dec"] + extra_cols,
-            parallel=False,
+            parallel=self.config["row_parallel"],
         )
 
 
@@ -567,7 +786,7 @@ class TXLensCatalogSplitter3D(TXLensCatalogSplitter):
             "lens_photoz_pdfs",
             "ancil",
             [z_col],
-            parallel=False,
+            parallel=self.config["row_parallel"],
         )
 
         # This iterates through chunks of the input catalogs, but for each
@@ -625,7 +844,7 @@ class TXExternalLensCatalogSplitter3D(TXLensCatalogSplitter):
             "lens_catalog",
             "lens",
             ["ra", "dec"] + extra_cols,
-            parallel=False,
+            parallel=self.config["row_parallel"],
         )
 
         # See the explanation of this in the TXLensCatalogSplitter3D
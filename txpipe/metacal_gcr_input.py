@@ -170,8 +170,8 @@ class TXMetacalGCRInput(PipelineStage):
 
         f = self.open_output(name)
         g = f.create_group(group)
-        for name in cols:
-            g.create_dataset(name, shape=(n,), dtype=cat[name].dtype)
+        for col in cols:
+            self.create_catalog_dataset(g, col, n, cat[col].dtype)
         return f
 
     def add_weight_column(self, data):
@@ -321,8 +321,8 @@ class TXIngestStars(PipelineStage):
 
         f = self.open_output(name)
         g = f.create_group(group)
-        for name in cols:
-            g.create_dataset(name, shape=(n,), dtype=cat[name].dtype)
+        for col in cols:
+            self.create_catalog_dataset(g, col, n, cat[col].dtype)
         return f
 
     def write_output(self, output_file, group_name, cols, start, end, data):
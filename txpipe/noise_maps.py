@@ -169,24 +169,28 @@ class TXSourceNoiseMaps(TXBaseMaps):
         # We need to calibrate the shear maps
         cal, _ = Calibrator.load(self.get_input("shear_tomography_catalog"))
 
+        # Workspace for the calibrated maps, re-used for each
+        # bin and realization
+        g = np.empty((2, npix))
+
         for b in range(nbin_source):
             for i in range(lensing_realizations):
 
                 bin_mask = np.where(GW[:, b] > 0)
 
-                g1 = G1[:, b, i] / GW[:, b]
-                g2 = G2[:, b, i] / GW[:, b]
+                np.divide(G1[:, b, i], GW[:, b], out=g[0])
+                np.divide(G2[:, b, i], GW[:, b], out=g[1])
 
-                g1, g2 = cal[b].apply(g1, g2, subtract_mean=False)
+                cal[b].apply_inplace(g, subtract_mean=False)
 
                 maps["source_noise_maps", f"rotation_{i}/g1_{b}"] = (
                     reverse_map[bin_mask],
-                    g1[bin_mask],
+                    g[0][bin_mask],
                 )
 
                 maps["source_noise_maps", f"rotation_{i}/g2_{b}"] = (
                     reverse_map[bin_mask],
-                    g2[bin_mask],
+                    g[1][bin_mask],
                 )
         return maps
 
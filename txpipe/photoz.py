@@ -1,6 +1,49 @@
 from .base_stage import PipelineStage
 from .data_types import PhotozPDFFile, ShearCatalog, YamlFile, HDFFile
 import numpy as np
+import os
+
+
+def lognormal_pdfs(z, medians, sigmas, out):
+    """
+    Evaluate a set of log-normal PDFs on a common redshift grid.
+
+    This gives the same results as scipy.stats.lognorm.pdf(z, s=sigma, scale=median)
+    for each object, but computes them all at once, in place in the output
+    array, and in its precision.
+
+    Parameters
+    ----------
+    z: array of shape (nz,)
+        Sorted redshift values to evaluate at
+    medians: array of shape (nobj,)
+        The median redshift of each object
+    sigmas: array of shape (nobj,)
+        The width of each PDF in log(z)
+    out: array of shape (nobj, nz)
+        The space for the output PDFs
+    """
+    dtype = out.dtype
+    medians = np.asarray(medians)[:, np.newaxis]
+    sigmas = np.asarray(sigmas, dtype=dtype)[:, np.newaxis]
+
+    # The PDF is zero at z <= 0. Since z is sorted we can work
+    # on the rest as a view of the output
+    i0 = np.searchsorted(z, 0.0, side="right")
+    out[:, :i0] = 0
+    zpos = np.asarray(z[i0:])
+    view = out[:, i0:]
+
+    # exp(-(ln(z/median)^2 / (2 sigma^2)) / (sigma z sqrt(2 pi))
+    # The logs are subtracted at the input precision, since the exponent is
+    # large in the tails and this is where most of the rounding would come from.
+    np.subtract(np.log(zpos), np.log(medians), out=view, casting="same_kind")
+    np.square(view, out=view)
+    view *= -0.5 / sigmas**2
+    np.exp(view, out=view)
+    view /= sigmas * np.sqrt(2 * np.pi, dtype=dtype)
+    view /= zpos.astype(dtype)
+    return out
 
 
 class TXRandomPhotozPDF(PipelineStage):
@@ -37,7 +80,15 @@ class TXRandomPhotozPDF(PipelineStage):
     # means there is no default value for that parameter and the
     # user must include the parameter in the config file, of that type.
     # Otherwise the entry lists the default value for the parameter.
-    config_options = {"zmax": float, "nz": int, "chunk_rows": 10000, "bands": "ugriz"}
+    config_options = {
+        "zmax": float,
+        "nz": int,
+        "chunk_rows": 10000,
+        "bands": "ugriz",
+        # Number of threads for computing PDFs. Zero means use OMP_NUM_THREADS,
+        # which is set from the threads_per_process in the pipeline file.
+        "threads": 0,
+    }
 
     def run(self):
         """
@@ -50,8 +101,6 @@ class TXRandomPhotozPDF(PipelineStage):
          - closes the output file
 
         """
-        import scipy.stats
-
         zmax = self.config["zmax"]
         nz = self.config["nz"]
         z = np.linspace(0.0, zmax, nz)
@@ -109,6 +158,9 @@ class TXRandomPhotozPDF(PipelineStage):
         and assumed to be a mean or similar statistic from each bin,
         for each of the five metacalibrated variants of the magnitudes.
 
+        The PDFs are computed all at once, optionally split between
+        threads.
+
         Parameters
         ----------
 
@@ -128,8 +180,6 @@ class TXRandomPhotozPDF(PipelineStage):
             Point-estimated photo-zs for each of the 5 metacalibrated variants
 
         """
-        import scipy.stats
-
         # Number of z points we will be using
         nz = self.config["nz"]
 
@@ -148,12 +198,27 @@ class TXRandomPhotozPDF(PipelineStage):
         # the point estimates.  That's why the 5 is there.
         point_estimates = np.empty((5, nobj), dtype="f4")
 
-        # Loop through each object and make a fake PDF
-        # for it, saving it to the output space
-        for i, (mu, sigma) in enumerate(zip(medians, sigmas)):
-            pdf = scipy.stats.lognorm.pdf(z, s=sigma, scale=mu)
-            pdfs[i] = pdf
-            point_estimates[:, i] = mu
+        # Make the fake PDFs, directly in the output space
+        nthread = self.config["threads"] or int(os.environ.get("OMP_NUM_THREADS", 1))
+        if nthread > 1 and nobj > nthread:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # numpy releases the GIL during these calculations, so threads
+            # working on separate blocks of rows run at the same time.
+            edges = np.linspace(0, nobj, nthread + 1).astype(int)
+            with ThreadPoolExecutor(nthread) as executor:
+                jobs = [
+                    executor.submit(
+                        lognormal_pdfs, z, medians[s:e], sigmas[s:e], pdfs[s:e]
+                    )
+                    for s, e in zip(edges[:-1], edges[1:])
+                ]
+                for job in jobs:
+                    job.result()
+        else:
+            lognormal_pdfs(z, medians, sigmas, pdfs)
+
+        point_estimates[:] = medians
 
         return pdfs, point_estimates
 
@@ -1,5 +1,6 @@
 from .base_stage import PipelineStage
 from .data_types import PhotozPDFFile, ShearCatalog, YamlFile, HDFFile, DataFile
+from .utils import grouped_histogram
 import sys
 import numpy as np
 
@@ -169,16 +170,27 @@ class PZPDFMLZ(PipelineStage):
 
         x = np.vstack(x).T
 
-        pdfs = np.empty((nrow, nbin))
-        point_estimates = np.empty(nrow)
+        # Run all the tree regressors on all the rows. Each tree gives a
+        # varying number of values for each row, so we keep a flat array
+        # of all of them and record which row each came from.
+        values = []
+        rows = []
+        for T in trees:
+            tree_values = [np.ravel(T.get_vals(xi)) for xi in x]
+            counts = [len(v) for v in tree_values]
+            values.append(np.concatenate(tree_values))
+            rows.append(np.repeat(np.arange(nrow), counts))
+        values = np.concatenate(values)
+        rows = np.concatenate(rows)
+
+        # Now histogram the values for every row at once
+        pdfs = grouped_histogram(values, rows, nrow, z).astype(float)
+        pdfs /= pdfs.sum(axis=1)[:, np.newaxis]
+
+        # and take the mean of the values for each row
+        point_estimates = np.bincount(rows, weights=values, minlength=nrow)
+        point_estimates /= np.bincount(rows, minlength=nrow)
 
-        for i in range(nrow):
-            # Run all the tree regressors on each of the metacal
-            # variants
-            values = np.concatenate([T.get_vals(x[i]) for T in trees]).ravel()
-            pdfs[i], _ = np.histogram(values, bins=z)
-            pdfs[i] /= pdfs[i].sum()
-            point_estimates[i] = np.mean(values)
         return pdfs, point_estimates
 
     def write_output(self, output_file, start, end, pdfs, point_estimates):
@@ -1,5 +1,12 @@
 from .base_stage import PipelineStage
-from .data_types import PhotozPDFFile, TomographyCatalog, HDFFile, PNGFile, NOfZFile
+from .data_types import (
+    PhotozPDFFile,
+    CompactPhotozPDFFile,
+    TomographyCatalog,
+    HDFFile,
+    PNGFile,
+    NOfZFile,
+)
 from .utils.mpi_utils import in_place_reduce
 from .utils import rename_iterated
 import numpy as np
@@ -28,7 +35,7 @@ class Stack:
         self.counts = np.zeros(nbin)
         self._set_manually = False
 
-    def add_pdfs(self, bins, pdfs):
+    def add_pdfs(self, bins, pdfs, weights=None):
         """
         Add a set of PDFs to the stack, per tomographic bin
 
@@ -38,11 +45,61 @@ class Stack:
             The tomographic bin for each object
         pdfs: 2d array[float]
             The p(z) per object
+        weights: array[float] or None
+            Optional weight per object. If used, the counts are sums of weights
+            so the final stacks are weighted means.
         """
-        for b in range(self.nbin):
-            w = np.where(bins == b)
-            self.stack[b] += pdfs[w].sum(axis=0)
-            self.counts[b] += w[0].size
+        sums, counts = self.bin_sums(bins, pdfs, weights)
+        self.add_sums(sums, counts)
+
+    def bin_sums(self, bins, pdfs, weights=None):
+        """
+        Sum a set of PDFs in each tomographic bin, without adding them
+        to the stack. Objects not in any bin are skipped.
+
+        This is done in one pass as a product of an (nbin, nobj) indicator
+        matrix with the PDFs, rather than copying out the PDFs for each bin.
+        float32 PDFs are summed as float32 within the chunk.
+
+        Parameters
+        ----------
+        bins: array[int]
+            The tomographic bin for each object
+        pdfs: 2d array[float]
+            The p(z) per object
+        weights: array[float] or None
+            Optional weight per object
+
+        Returns
+        -------
+        sums: array of shape (nbin, nz)
+            The (weighted) sum of the PDFs in each bin
+        counts: array of shape (nbin,)
+            The number of objects, or total weight, in each bin
+        """
+        dtype = pdfs.dtype if pdfs.dtype.kind == "f" else np.float64
+        index = np.flatnonzero((bins >= 0) & (bins < self.nbin))
+
+        indicator = np.zeros((self.nbin, len(bins)), dtype=dtype)
+        indicator[bins[index], index] = 1 if weights is None else weights[index]
+
+        sums = indicator @ pdfs
+        counts = indicator.sum(axis=1, dtype=np.float64)
+        return sums, counts
+
+    def add_sums(self, sums, counts):
+        """
+        Add sums of PDFs, as computed by bin_sums, to the stack
+
+        Parameters
+        ----------
+        sums: array of shape (nbin, nz)
+            The sum of the PDFs in each bin
+        counts: array of shape (nbin,)
+            The number of objects, or total weight, in each bin
+        """
+        self.stack += sums
+        self.counts += counts
 
     def set_bin(self, b, n_of_z):
         """
@@ -59,7 +116,7 @@ class Stack:
         self.counts[b] = 1
         self._set_manually = True
 
-    def add_delta_function(self, bins, z):
+    def add_delta_function(self, bins, z, weights=None):
         """
         Add a set of objects to the stack whose redshift
         is known perfectly
@@ -70,19 +127,51 @@ class Stack:
             The tomographic bin for each object
         z: array[float]
             The redshift per object
+        weights: array[float] or None
+            Optional weight per object
+        """
+        sums, counts = self.delta_function_sums(bins, z, weights)
+        self.add_sums(sums, counts)
+
+    def delta_function_sums(self, bins, z, weights=None):
+        """
+        Histogram a set of objects with known redshifts in each tomographic
+        bin, without adding them to the stack. Objects not in any bin, or
+        outside the redshift range, are skipped.
+
+        All the bins are done with a single bincount over a combined
+        (tomographic bin, redshift bin) index.
+
+        Parameters
+        ----------
+        bins: array[int]
+            The tomographic bin for each object
+        z: array[float]
+            The redshift per object
+        weights: array[float] or None
+            Optional weight per object
+
+        Returns
+        -------
+        sums: array of shape (nbin, nz)
+            The (weighted) histogram in each bin
+        counts: array of shape (nbin,)
+            The number of objects, or total weight, in each bin
         """
         # here self.z are the edges of the bins the nz will have.
-        stack_bin = np.digitize(z, self.z)
-        for b in range(self.nbin):
-            w = np.where(bins == b)
-            stack_bin_b = stack_bin[w]
-            for i in stack_bin_b:
-                if 0 <= i < self.nz:
-                    # digitize returns numbers between 1 and len(self.z)-1
-                    # that is why we need to subtract 1 here, since the
-                    # minimum value of i will be 1.
-                    self.stack[b][i - 1] += 1
-                    self.counts[b] += 1
+        # digitize returns numbers between 1 and len(self.z)-1 for
+        # objects in range, so we subtract 1 to get the bin index
+        stack_bin = np.digitize(z, self.z) - 1
+        keep = (
+            (bins >= 0) & (bins < self.nbin) & (stack_bin >= 0) & (stack_bin < self.nz - 1)
+        )
+        index = bins[keep] * self.nz + stack_bin[keep]
+        w = None if weights is None else weights[keep]
+
+        sums = np.bincount(index, weights=w, minlength=self.nbin * self.nz)
+        sums = sums.reshape(self.nbin, self.nz).astype(np.float64)
+        counts = sums.sum(axis=1)
+        return sums, counts
 
     def save(self, outfile, comm=None):
         """
@@ -101,8 +190,11 @@ class Stack:
         if comm is not None:
             if self._set_manually:
                 raise RuntimeError("Tried to set n(z) manually with MPI")
-            in_place_reduce(self.stack, comm)
-            in_place_reduce(self.counts, comm)
+            # Reduce the stacks and counts together, in one operation
+            totals = np.column_stack([self.stack, self.counts])
+            in_place_reduce(totals, comm)
+            self.stack = totals[:, :-1]
+            self.counts = totals[:, -1]
 
             # only root saves output
             if comm.Get_rank() != 0:
@@ -184,6 +276,11 @@ class TXPhotozSourceStack(PipelineStage):
         return stack, stack2d
 
     def data_iterator(self):
+        if self.has_compact_pdfs("source_photoz_pdfs"):
+            return self.compact_data_iterator(
+                "source_photoz_pdfs", "shear_tomography_catalog", "source_bin"
+            )
+
         # This collects together matching inputs from the different
         # input files and returns an iterator to them which yields
         # start, end, data
@@ -200,14 +297,43 @@ class TXPhotozSourceStack(PipelineStage):
 
         return rename_iterated(it, rename)
 
+    def has_compact_pdfs(self, tag):
+        # PDFs from the RAIL estimation stages are in a "pdf" group with
+        # a "zgrid", and may be in any of the compact formats they can write.
+        # Older PDF files are in the qp layout, in "data" and "meta", and
+        # some other stages write a "pdf" group in a different layout.
+        with self.open_input(tag) as f:
+            return "pdf/zgrid" in f
+
+    def compact_data_iterator(self, pdf_tag, tomo_tag, bin_col):
+        # Iterate through the tomography, and read and decode
+        # the PDFs for the same rows.  Only one chunk of PDFs is
+        # decoded at once, so memory use is the same as for float32 files.
+        pdf_file = CompactPhotozPDFFile(self.get_input(pdf_tag), "r")
+        it = self.iterate_hdf(
+            tomo_tag, "tomography", [bin_col], self.config["chunk_rows"]
+        )
+        for s, e, data in it:
+            data["pdf"] = pdf_file.read_pdfs(s, e)
+            yield s, e, data
+        pdf_file.close()
+
+    def read_z(self, tag):
+        with self.open_input(tag) as f:
+            if "pdf" in f:
+                return f["pdf/zgrid"][:]
+            # This is the syntax for reading a complete HDF column
+            return f["meta/xvals"][0, :]
+
     def stack_data(self, name, data, outputs):
         # add the data we have loaded into the stacks
         stack, stack2d = outputs
-        stack.add_pdfs(data[f"{name}_bin"], data["pdf"])
+        sums, counts = stack.bin_sums(data[f"{name}_bin"], data["pdf"])
+        stack.add_sums(sums, counts)
         # -1 indicates no selection.  For the non-tomo 2d case
-        # we just say anything that is >=0 is set to bin zero, like this
-        bin2d = data[f"{name}_bin"].clip(-1, 0)
-        stack2d.add_pdfs(bin2d, data["pdf"])
+        # anything that is >=0 goes in, so its stack is the total
+        # of the tomographic ones.
+        stack2d.add_sums(sums.sum(axis=0, keepdims=True), counts.sum(keepdims=True))
 
     def write_outputs(self, tag, outputs):
         stack, stack2d = outputs
@@ -242,11 +368,7 @@ class TXPhotozSourceStack(PipelineStage):
         # then close it again, because we're going to use the
         # built-in iterator method to get the rest of the data
 
-        # open_input is a method defined on the superclass.
-        # it knows about different file formats (pdf, fits, etc)
-        with self.open_input("source_photoz_pdfs") as photoz_file:
-            # This is the syntax for reading a complete HDF column
-            z = photoz_file["meta/xvals"][0, :]
+        z = self.read_z("source_photoz_pdfs")
 
         # Save again but for the number of bins in the tomography catalog
         with self.open_input("shear_tomography_catalog") as tomo_file:
@@ -300,6 +422,11 @@ class TXPhotozLensStack(TXPhotozSourceStack):
         self.write_outputs("lens_photoz_stack", outputs)
 
     def data_iterator(self):
+        if self.has_compact_pdfs("lens_photoz_pdfs"):
+            return self.compact_data_iterator(
+                "lens_photoz_pdfs", "lens_tomography_catalog", "lens_bin"
+            )
+
         # This collects together matching inputs from the different
         # input files and returns an iterator to them which yields
         # start, end, data
@@ -332,11 +459,7 @@ class TXPhotozLensStack(TXPhotozSourceStack):
         # then close it again, because we're going to use the
         # built-in iterator method to get the rest of the data
 
-        # open_input is a method defined on the superclass.
-        # it knows about different file formats (pdf, fits, etc)
-        with self.open_input("lens_photoz_pdfs") as photoz_file:
-            # This is the syntax for reading a complete HDF column
-            z = photoz_file["meta/xvals"][0, :]
+        z = self.read_z("lens_photoz_pdfs")
 
         # Save again but for the number of bins in the tomography catalog
         with self.open_input("lens_tomography_catalog") as tomo_file:
@@ -419,9 +542,12 @@ class TXSourceTrueNumberDensity(TXPhotozSourceStack):
 
     def stack_data(self, name, data, outputs):
         stack, stack2d = outputs
-        stack.add_delta_function(data[f"{name}_bin"], data["redshift_true"])
-        bin2d = data[f"{name}_bin"].clip(-1, 0)
-        stack2d.add_delta_function(bin2d, data["redshift_true"])
+        sums, counts = stack.delta_function_sums(
+            data[f"{name}_bin"], data["redshift_true"]
+        )
+        stack.add_sums(sums, counts)
+        # As in the PDF case the 2D stack is the total of the tomographic ones
+        stack2d.add_sums(sums.sum(axis=0, keepdims=True), counts.sum(keepdims=True))
 
     def get_metadata(self):
         # Check we are running on a photo file with redshift_true
@@ -1,6 +1,7 @@
 from ..base_stage import PipelineStage
-from ..data_types import PhotozPDFFile, HDFFile, PickleFile, ShearCatalog
-from ..utils import rename_iterated
+from ..data_types import CompactPhotozPDFFile, HDFFile, PickleFile, ShearCatalog
+from ..utils import rename_iterated, prefetch_iterated
+from ..utils.pdfs import pdf_quantiles, quantize_pdfs
 from ..utils.calibration_tools import read_shear_catalog_type
 from .utils import convert_unseen
 import numpy as np
@@ -25,6 +26,20 @@ class PZRailEstimateSource(PipelineStage):
     The training stage is (currently all) serial, but applying the trained
     model can be done in parallel, so we split into two stages to avoid
     many processors sitting idle or repeating the same training process.
+
+    If background_io is set then the next chunk of data is read, and the
+    previous one written, in background threads while the estimator runs.
+
+    The PDFs can be stored compactly with the pdf_storage option: "float16"
+    halves their size, "quantized" saves them as 16-bit integers scaled to
+    the peak of each PDF, in pdf/pdf with the scales in pdf/scale, and
+    "quantiles" saves just n_quantiles quantiles of each PDF, in
+    pdf/quantiles, instead of the full PDF. The CompactPhotozPDFFile
+    class reads any of these back as PDFs.
+
+    The quantized PDFs compress well with the output_compression option,
+    but compression is ignored for files written in parallel under MPI.
+    There they are only half the size of float32 PDFs, the same as float16.
     """
 
     name = "PZRailEstimateSource"
@@ -37,7 +52,7 @@ class PZRailEstimateSource(PipelineStage):
     ]
 
     outputs = [
-        ("source_photoz_pdfs", PhotozPDFFile),
+        ("source_photoz_pdfs", CompactPhotozPDFFile),
     ]
 
     config_options = {
@@ -47,6 +62,9 @@ class PZRailEstimateSource(PipelineStage):
         "convert_unseen": False,
         "undetected_value": 99.0,
         "unobserved_value": -99.0,
+        "background_io": False,
+        "pdf_storage": "float32",  # or "float16", "quantized", or "quantiles"
+        "n_quantiles": 32,
     }
 
     def run(self):
@@ -67,23 +85,53 @@ class PZRailEstimateSource(PipelineStage):
         # it to get the mean z from the PDF
         output, z = self.setup_output_file(estimator)
 
-        # Loop through the chunks of data
-        for s, e, data in self.data_iterator():
-            print(f"Process {self.rank} estimating PZ PDF for rows {s:,} - {e:,}")
-
-            # Convert undetected and unseen values to whatever sentinel
-            # is expected by the algorithm. We currently use inf and nan for these
-            if convert:
-                convert_unseen(data, bands, undet, unobs)
-
-            # Run the pre-trained estimator
-            pz_data = estimator.estimate(data)
-
-            if np.isnan(pz_data["pz_pdf"]).any():
-                raise ValueError("NaN PDFs generated by RAIL algorithm")
-
-            # Save the results
-            self.write_output_chunk(output, s, e, z, pz_data)
+        # Optionally read the next chunk and write out the previous one
+        # in background threads, while the estimator runs on this one.
+        # We only wait for the last write when we have the next one ready.
+        background = self.config["background_io"]
+        it = self.data_iterator()
+        pending_write = None
+        if background:
+            from concurrent.futures import ThreadPoolExecutor
+
+            it = prefetch_iterated(it, 1)
+            writer = ThreadPoolExecutor(max_workers=1)
+
+        try:
+            # Loop through the chunks of data
+            for s, e, data in it:
+                print(f"Process {self.rank} estimating PZ PDF for rows {s:,} - {e:,}")
+
+                # Convert undetected and unseen values to whatever sentinel
+                # is expected by the algorithm. We currently use inf and nan for these
+                if convert:
+                    convert_unseen(data, bands, undet, unobs)
+
+                # Run the pre-trained estimator
+                pz_data = estimator.estimate(data)
+
+                if np.isnan(pz_data["pz_pdf"]).any():
+                    raise ValueError("NaN PDFs generated by RAIL algorithm")
+
+                # Save the results
+                if background:
+                    if pending_write is not None:
+                        pending_write.result()
+                    pending_write = writer.submit(
+                        self.write_output_chunk, output, s, e, z, pz_data
+                    )
+                else:
+                    self.write_output_chunk(output, s, e, z, pz_data)
+        finally:
+            # Even if something went wrong, finish the last write and
+            # stop the reader and writer threads
+            if background:
+                try:
+                    if pending_write is not None:
+                        pending_write.result()
+                finally:
+                    writer.shutdown(wait=True)
+                    it.close()
 
     def load_model(self):
         with self.open_input(self.model_input, wrapper=True) as f:
@@ -135,7 +183,25 @@ class PZRailEstimateSource(PipelineStage):
         # create the spaces in the output
         pdfs = f.create_group("pdf")
         pdfs.create_dataset("zgrid", (nz,))
-        pdfs.create_dataset("pdf", (nobj, nz), dtype="f4")
+
+        storage = self.config["pdf_storage"]
+        pdfs.attrs["storage"] = storage
+        if storage == "float32":
+            pdfs.create_dataset("pdf", (nobj, nz), dtype="f4")
+        elif storage == "float16":
+            pdfs.create_dataset("pdf", (nobj, nz), dtype="f2")
+        elif storage == "quantized":
+            # Compression is dropped if the file is opened for parallel writing
+            self.create_catalog_dataset(pdfs, "pdf", (nobj, nz), "u2")
+            self.create_catalog_dataset(pdfs, "scale", (nobj,), "f4")
+        elif storage == "quantiles":
+            nq = self.config["n_quantiles"]
+            pdfs.create_dataset("quantile_levels", (nq,))
+            pdfs.create_dataset("quantiles", (nobj, nq), dtype="f4")
+            if self.rank == 0:
+                pdfs["quantile_levels"][:] = self.quantile_levels()
+        else:
+            raise ValueError(f"Unknown pdf_storage option {storage}")
 
         modes = f.create_group("point_estimates")
         modes.create_dataset("z_mode", (nobj,), dtype="f4")
@@ -171,11 +237,27 @@ class PZRailEstimateSource(PipelineStage):
         p = pz_data["pz_pdf"]
         mu = (p @ z) / p.sum(axis=1)
 
-        output_file["pdf/pdf"][start:end] = p
+        storage = self.config["pdf_storage"]
+        if storage == "quantiles":
+            q = pdf_quantiles(z, p, self.quantile_levels())
+            output_file["pdf/quantiles"][start:end] = q
+        elif storage == "quantized":
+            q, scale = quantize_pdfs(p)
+            output_file["pdf/pdf"][start:end] = q
+            output_file["pdf/scale"][start:end] = scale
+        else:
+            # h5py converts to float16 if needed
+            output_file["pdf/pdf"][start:end] = p
         output_file["point_estimates/z_mode"][start:end] = pz_data["zmode"]
         output_file["point_estimates/z_mean"][start:end] = mu
 
 
+    def quantile_levels(self):
+        # The mid-points of n equal divisions of probability
+        nq = self.config["n_quantiles"]
+        return (np.arange(nq) + 0.5) / nq
+
+
 class PZRailEstimateLens(PZRailEstimateSource):
     """
     Estimate source redshift PDFs and best-fits using RAIL
@@ -195,7 +277,7 @@ class PZRailEstimateLens(PZRailEstimateSource):
     ]
 
     outputs = [
-        ("lens_photoz_pdfs", PhotozPDFFile),
+        ("lens_photoz_pdfs", CompactPhotozPDFFile),
     ]
 
     config_options = {
@@ -204,6 +286,9 @@ class PZRailEstimateLens(PZRailEstimateSource):
         "convert_unseen": False,
         "undetected_value": 99.0,
         "unobserved_value": -99.0,
+        "background_io": False,
+        "pdf_storage": "float32",  # or "float16", "quantized", or "quantiles"
+        "n_quantiles": 32,
     }
 
     def data_iterator(self):
@@ -243,8 +328,8 @@ class PZRailEstimateSourceFromLens(PipelineStage):
 
     name = "PZRailEstimateSourceFromLens"
 
-    inputs = [("lens_photoz_pdfs", PhotozPDFFile)]
-    outputs = [("source_photoz_pdfs", PhotozPDFFile)]
+    inputs = [("lens_photoz_pdfs", CompactPhotozPDFFile)]
+    outputs = [("source_photoz_pdfs", CompactPhotozPDFFile)]
 
     def run(self):
         shutil.copy(
@@ -263,8 +348,8 @@ class PZRailEstimateLensFromSource(PipelineStage):
 
     name = "PZRailEstimateLensFromSource"
 
-    inputs = [("source_photoz_pdfs", PhotozPDFFile)]
-    outputs = [("lens_photoz_pdfs", PhotozPDFFile)]
+    inputs = [("source_photoz_pdfs", CompactPhotozPDFFile)]
+    outputs = [("lens_photoz_pdfs", CompactPhotozPDFFile)]
 
     def run(self):
         shutil.copy(
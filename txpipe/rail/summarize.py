@@ -2,6 +2,10 @@ from ..base_stage import PipelineStage
 from ..data_types import HDFFile, PickleFile, NOfZFile, PNGFile
 from ..photoz_stack import Stack
 import numpy as np
+import tempfile
+import shutil
+import h5py
+import os
 
 class PZRailSummarize(PipelineStage):
     name = "PZRailSummarize"
@@ -21,6 +25,12 @@ class PZRailSummarize(PipelineStage):
     config_options = {
         "mag_prefix": "photometry/mag_",
         "tomography_name": str,
+        # If set, read the catalogs in chunks split between processes, copying
+        # the magnitudes of objects in the tomographic bins to a temporary file
+        # that RAIL then reads in chunks, instead of every process loading the
+        # complete columns.
+        "streaming": False,
+        "chunk_rows": 100_000,
     }
 
     def run(self):
@@ -47,80 +57,58 @@ class PZRailSummarize(PipelineStage):
 
 
         bands = model["szusecols"]
-        prefix = self.config["mag_prefix"]
-
-        # This is the bit that will not work with realistically sized
-        # data sets. Need the RAIL parallel interface when ready.
-        with self.open_input("photometry_catalog") as f:
-            full_data = {b: f[f"{prefix}{b}"][:] for b in bands}
 
         tomo_name = self.config["tomography_name"]
-        with self.open_input("tomography_catalog") as f:
-            g = f['tomography']
-            nbin = g.attrs[f'nbin_{tomo_name}']
-            bins = g[f'{tomo_name}_bin'][:]
-
-
-        # Generate the configuration for RAIL. Anything set in the
-        # config.yml file will also be put in here by the bit below,
-        # so we don't need to try all possible RAIL options.
-        sub_config = {
-            "model": model,
-            "usecols": bands,
-            "hdf5_groupname": "",
-            "phot_weightcol":"",
-            "output_mode": "none",  # actually anything except "default" will work here
-            "comm": self.comm,
-        }
-
-        # TODO: Make this flexible
-        substage_class = NZDir
-
-        for k, v in self.config.items():
-            if k in substage_class.config_options:
-                sub_config[k] = v
 
+        # Make sure the temporary directory is removed even if RAIL fails
+        tmp_dir = self.make_temp_dir() if self.config["streaming"] else None
+        try:
+            if self.config["streaming"]:
+                nbin, bin_file = self.write_bin_file(bands, tomo_name, tmp_dir)
+                bin_data = None
+            else:
+                nbin, bin_data = self.load_bin_data(bands, tomo_name)
+                bin_file = None
+
+            # Generate the configuration for RAIL. Anything set in the
+            # config.yml file will also be put in here by the bit below,
+            # so we don't need to try all possible RAIL options.
+            sub_config = {
+                "model": model,
+                "usecols": bands,
+                "hdf5_groupname": "",
+                "phot_weightcol":"",
+                "output_mode": "none",  # actually anything except "default" will work here
+                "comm": self.comm,
+            }
+
+            # TODO: Make this flexible
+            substage_class = NZDir
+
+            for k, v in self.config.items():
+                if k in substage_class.config_options:
+                    sub_config[k] = v
+
+
+            # Just do things with the first bin to begin with
+            qp_per_bin = []
+            realizations_per_bin = {}
 
-        # Just do things with the first bin to begin with
-        qp_per_bin = []
-        realizations_per_bin = {}
-
-        for i in range(nbin):
-
-            # Extract the chunk of the data assigned to this tomographic
-            # bin.
-            index = (bins==i)
-            nobj = index.sum()
-            data = {b: full_data[b][index] for b in bands}
-            print(f"Computing n(z) for bin {i}: {nobj} objects")
-
-            # Store this data set. Once this is parallelised will presumably have to delete
-            # it afterwards to avoid running out of memory.
-            data_handle = substage_class.data_store.add_data(f"tomo_bin_{i}", data, TableHandle)
-            substage = substage_class.make_stage(name=f"NZDir_{i}", **sub_config)
-            substage.set_data('input', data_handle)
-            substage.run()
-
+            for i in range(nbin):
+                substage = self.run_nzdir(substage_class, sub_config, i, bin_data, bin_file)
+                if self.rank == 0:
+                    realizations_per_bin[f'bin_{i}'] = substage.get_handle('output').data
+                    bin_qp = substage.get_handle('single_NZ').data
+                    qp_per_bin.append(bin_qp)
+
+            # now we do the 2D case
+            substage = self.run_nzdir(substage_class, sub_config, "2d", bin_data, bin_file)
             if self.rank == 0:
-                realizations_per_bin[f'bin_{i}'] = substage.get_handle('output').data
-                bin_qp = substage.get_handle('single_NZ').data
-                qp_per_bin.append(bin_qp)
-
-        # now we do the 2D case
-        index = bins >= 0
-        nobj = index.sum()
-        data = {b: full_data[b][index] for b in bands}
-        print(f"Computing n(z) for bin {i}: {nobj} objects")
-
-        # Store this data set. Once this is parallelised will presumably have to delete
-        # it afterwards to avoid running out of memory.
-        data_handle = substage_class.data_store.add_data(f"tomo_bin_2d", data, TableHandle)
-        substage = substage_class.make_stage(name=f"NZDir_2d", **sub_config)
-        substage.set_data('input', data_handle)
-        substage.run()
-        if self.rank == 0:
-            realizations_2d = substage.get_handle('output').data
-            qp_2d = substage.get_handle('single_NZ').data
+                realizations_2d = substage.get_handle('output').data
+                qp_2d = substage.get_handle('single_NZ').data
+        finally:
+            if tmp_dir is not None:
+                self.remove_temp_dir(tmp_dir)
 
         if self.rank > 0:
             return
@@ -181,7 +169,178 @@ class PZRailSummarize(PipelineStage):
 
             group.create_dataset("pdfs_2d", data=pdfs_2d)
 
-                
+    def load_bin_data(self, bands, tomo_name):
+        """
+        Load the magnitudes of the objects in each tomographic bin, and
+        in all the bins together, by loading the complete columns.
+        """
+        prefix = self.config["mag_prefix"]
+
+        # This is the bit that will not work with realistically sized
+        # data sets. Use the streaming option for those.
+        with self.open_input("photometry_catalog") as f:
+            full_data = {b: f[f"{prefix}{b}"][:] for b in bands}
+
+        with self.open_input("tomography_catalog") as f:
+            g = f['tomography']
+            nbin = g.attrs[f'nbin_{tomo_name}']
+            bins = g[f'{tomo_name}_bin'][:]
+
+        bin_data = {}
+        for i in range(nbin):
+            index = bins == i
+            bin_data[i] = {b: full_data[b][index] for b in bands}
+
+        index = bins >= 0
+        bin_data["2d"] = {b: full_data[b][index] for b in bands}
+        return nbin, bin_data
+
+    def run_nzdir(self, substage_class, sub_config, key, bin_data, bin_file):
+        """
+        Run NZDir on the objects in one tomographic bin, or all of them
+        with the key "2d", either from the in-memory bin_data or from the
+        bin_file made by write_bin_file.
+        """
+        from rail.core import TableHandle
+
+        if bin_file is None:
+            data = bin_data[key]
+            nobj = len(data[sub_config["usecols"][0]])
+            data_handle = substage_class.data_store.add_data(f"tomo_bin_{key}", data, TableHandle)
+        else:
+            # RAIL reads this file itself, in chunks, splitting them
+            # between the processes.
+            groupname = f"bin_{key}"
+            with h5py.File(bin_file, "r") as f:
+                nobj = f[groupname][sub_config["usecols"][0]].size
+            data_handle = substage_class.data_store.add_data(
+                f"tomo_bin_{key}", None, TableHandle, path=bin_file
+            )
+            sub_config = {
+                **sub_config,
+                "hdf5_groupname": groupname,
+                "chunk_size": self.config["chunk_rows"],
+            }
+
+        print(f"Computing n(z) for bin {key}: {nobj} objects")
+        substage = substage_class.make_stage(name=f"NZDir_{key}", **sub_config)
+        substage.set_data('input', data_handle)
+        substage.run()
+        return substage
+
+    def make_temp_dir(self):
+        # This needs to be visible to all the processes, so we put
+        # it next to the outputs rather than in the system temp dir.
+        if self.rank == 0:
+            outdir = os.path.dirname(os.path.abspath(self.get_output("photoz_stack")))
+            tmp_dir = tempfile.mkdtemp(prefix="tmp_summarize_", dir=outdir)
+        else:
+            tmp_dir = None
+        if self.comm is not None:
+            tmp_dir = self.comm.bcast(tmp_dir)
+        return tmp_dir
+
+    def remove_temp_dir(self, tmp_dir):
+        if self.comm is not None:
+            self.comm.Barrier()
+        if self.rank == 0:
+            shutil.rmtree(tmp_dir)
+
+    def write_bin_file(self, bands, tomo_name, tmp_dir):
+        """
+        Copy the magnitudes of the objects in each tomographic bin, and in
+        all the bins together, to a file in tmp_dir, reading chunks of
+        the catalogs.
+
+        The chunks are split between the processes, which each write the
+        objects they find to a file of their own. The root process then
+        joins these into a single file, which has a group for each bin,
+        bin_0, bin_1, ..., and bin_2d for all of them.  No process holds
+        more than a chunk of data at once.
+
+        Returns
+        -------
+        nbin: int
+            The number of tomographic bins
+
+        bin_file: str
+            The path to the joined file
+        """
+        group, col_prefix = self.config["mag_prefix"].rsplit("/", 1)
+        cols = [f"{col_prefix}{b}" for b in bands]
+        bin_col = f"{tomo_name}_bin"
+        chunk_rows = self.config["chunk_rows"]
+
+        with self.open_input("tomography_catalog") as f:
+            nbin = f['tomography'].attrs[f'nbin_{tomo_name}']
+
+        with self.open_input("photometry_catalog") as f:
+            dtypes = {b: f[f"{group}/{col}"].dtype for b, col in zip(bands, cols)}
+
+        groupnames = [f"bin_{i}" for i in range(nbin)] + ["bin_2d"]
+        rank_files = [os.path.join(tmp_dir, f"rank_{r}.hdf5") for r in range(self.size)]
+
+        # First every process writes its own share
+        with h5py.File(rank_files[self.rank], "w") as f:
+            for g in groupnames:
+                for b in bands:
+                    f.create_dataset(
+                        f"{g}/{b}", (0,), dtype=dtypes[b], maxshape=(None,), chunks=True
+                    )
+
+            it = self.combined_iterators(
+                chunk_rows,
+                "photometry_catalog",
+                group,
+                cols,
+                "tomography_catalog",
+                "tomography",
+                [bin_col],
+            )
+            for s, e, data in it:
+                print(f"Process {self.rank} reading data chunk {s:,} - {e:,}")
+                bins = data[bin_col]
+                selections = [bins == i for i in range(nbin)] + [bins >= 0]
+                for g, index in zip(groupnames, selections):
+                    for b, col in zip(bands, cols):
+                        append_to_dataset(f[f"{g}/{b}"], data[col][index])
+
+        if self.comm is not None:
+            self.comm.Barrier()
+
+        # Then the root process joins them together, a chunk at a time
+        bin_file = os.path.join(tmp_dir, "bins.hdf5")
+        if self.rank == 0:
+            with h5py.File(bin_file, "w") as out:
+                inputs = [h5py.File(r, "r") for r in rank_files]
+                for g in groupnames:
+                    for b in bands:
+                        n = sum(f[f"{g}/{b}"].size for f in inputs)
+                        d = out.create_dataset(f"{g}/{b}", (n,), dtype=dtypes[b])
+                        start = 0
+                        for f in inputs:
+                            col = f[f"{g}/{b}"]
+                            for s in range(0, col.size, chunk_rows):
+                                x = col[s : s + chunk_rows]
+                                d[start : start + x.size] = x
+                                start += x.size
+                for f in inputs:
+                    f.close()
+            for r in rank_files:
+                os.remove(r)
+
+        if self.comm is not None:
+            self.comm.Barrier()
+
+        return nbin, bin_file
+
+
+def append_to_dataset(dataset, data):
+    n = dataset.size
+    dataset.resize((n + data.size,))
+    dataset[n:] = data
+
+
 class PZRealizationsPlot(PipelineStage):
     name = "PZRealizationsPlot"
 
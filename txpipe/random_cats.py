@@ -17,6 +17,21 @@ class TXRandomCat(PipelineStage):
 
     This accounts for the depth being different in each pixel, but probably
     does still need updates, and testing.
+
+    Points are generated for blocks of pixels at a time. Each random number
+    is derived from the seed, the pixel, and the point's index in it, so the
+    output does not depend on the number of processes used. A seed of zero
+    means choose one at random.
+
+    By default points are placed in each pixel by treating it as a flat
+    quadrilateral between its corners. For Healpix maps, setting sampling to
+    "healpix" instead places them exactly inside the curved pixel boundaries,
+    by rejection sampling against sub-pixels healpix_subdivide levels finer.
+    This allows coarser depth maps to be used without distorting the randoms.
+
+    Output is written in batches of chunk_rows. If background_writes is set these
+    are written in a separate thread while the next batch is generated, and if
+    collective_writes is set then under MPI they use collective MPI-IO writes.
     """
     name = "TXRandomCat"
     inputs = [
@@ -33,15 +48,21 @@ class TXRandomCat(PipelineStage):
         "Mstar": 23.0,  # Schecther distribution Mstar parameter
         "alpha": -1.25,  # Schecther distribution alpha parameter
         "chunk_rows": 100_000,
+        "background_writes": False,
+        "collective_writes": False,
+        "seed": 0,
+        "sampling": "quadrilateral",  # or "healpix"
+        "healpix_subdivide": 4,
     }
 
     def run(self):
         import scipy.special
-        import scipy.stats
         import healpy
         import pyccl
         from . import randoms
-        from .utils.hdf_tools import BatchWriter
+        from .randoms import counter_uniforms
+        from .utils.hdf_tools import AsyncBatchWriter, finish_batch_writers
+        from concurrent.futures import ThreadPoolExecutor
 
         # Load the input depth map
         with self.open_input("aux_lens_maps", wrapper=True) as maps_file:
@@ -58,6 +79,12 @@ class TXRandomCat(PipelineStage):
             cosmo = f.to_ccl()
 
 
+        seed = self.config["seed"]
+        if seed == 0:
+            seed = np.random.randint(2**31)
+            if self.comm is not None:
+                seed = self.comm.bcast(seed)
+
         # Cut down to pixels that have any objects in
         pixel = np.where(depth > 0)[0]
         depth = depth[pixel]
@@ -88,7 +115,14 @@ class TXRandomCat(PipelineStage):
 
         # Pixel geometry - area in arcmin^2
         pix_area = scheme.pixel_area(degrees=True) * 60.0 * 60.0
-        vertices = scheme.vertices(pixel)
+        sampling = self.config["sampling"]
+        if sampling == "quadrilateral":
+            vertices = scheme.vertices(pixel)
+        elif sampling == "healpix":
+            if scheme.name != "healpix":
+                raise ValueError("Can only use sampling=healpix with Healpix maps")
+        else:
+            raise ValueError(f"Unknown random sampling method {sampling}")
 
         ##################################################################################
 
@@ -102,9 +136,10 @@ class TXRandomCat(PipelineStage):
         ### When the density changes per redshift bin, this can go into the main Ntomo loop
         numbers = np.zeros((Ntomo, npix), dtype=int)
         if self.rank == 0:
+            rng = np.random.default_rng(seed)
             for j in range(Ntomo):
                 # Poisson distribution about mean
-                numbers[j] = scipy.stats.poisson.rvs(density * pix_area, 1)
+                numbers[j] = rng.poisson(density * pix_area)
 
         # give all processors the same values
         if self.comm is not None:
@@ -133,11 +168,15 @@ class TXRandomCat(PipelineStage):
         # First output is the all of the
         output_file = self.open_output("random_cats", parallel=True)
         group = output_file.create_group("randoms")
-        ra_out = group.create_dataset("ra", (n_total,), dtype=np.float64)
-        dec_out = group.create_dataset("dec", (n_total,), dtype=np.float64)
-        z_out = group.create_dataset("z", (n_total,), dtype=np.float64)
-        chi_out = group.create_dataset("comoving_distance", (n_total,), dtype=np.float64)
-        bin_out = group.create_dataset("bin", (n_total,), dtype=np.int16)
+        ra_out = self.create_catalog_dataset(group, "ra", n_total, np.float64)
+        dec_out = self.create_catalog_dataset(group, "dec", n_total, np.float64)
+        z_out = self.create_catalog_dataset(
+            group, "z", n_total, np.float64, downcast=True
+        )
+        chi_out = self.create_catalog_dataset(
+            group, "comoving_distance", n_total, np.float64, downcast=True
+        )
+        bin_out = self.create_catalog_dataset(group, "bin", n_total, np.int16)
 
         # Second output is specific to an individual bin, so we can just load
         # a single bin as needed
@@ -148,35 +187,50 @@ class TXRandomCat(PipelineStage):
         binned_group.attrs["nbin"] = Ntomo
         for i in range(Ntomo):
             g = binned_group.create_group(f"bin_{i}")
-            g.create_dataset("ra", (bin_counts[i],))
-            g.create_dataset("dec", (bin_counts[i],))
-            g.create_dataset("z", (bin_counts[i],))
-            g.create_dataset("comoving_distance", (bin_counts[i],))
+            for col in ["ra", "dec", "z", "comoving_distance"]:
+                self.create_catalog_dataset(g, col, bin_counts[i], "f4")
             subgroups.append(g)
 
-        pixels_per_proc = npix // self.size
+        # Tabulate the comoving distance over the redshift range
+        # so we can interpolate it for each point.
+        z_table = np.linspace(z_photo_arr.min(), z_photo_arr.max(), 4096)
+        chi_table = pyccl.comoving_radial_distance(cosmo, 1.0 / (1 + z_table))
+
+        nvertex = npix
+        my_nvertex = int(np.ceil(nvertex / self.size))
+        start_vertex = self.rank * my_nvertex
+        end_vertex = min(start_vertex + my_nvertex, nvertex)
+
+        # The two writers below share a single background thread, so that
+        # their writes are made in the same order as they are issued.
+        if self.config["background_writes"]:
+            executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            executor = None
 
         for j in range(Ntomo):
             ### Load pdf of ith lens redshift bin pz
             n_hist = pz_stack[f"n_of_z/lens/bin_{j}"][:]
 
-            ### Make cdf and normalise
+            ### Make cdf and normalise. This is the inverse-CDF table used to
+            ### turn uniform values into redshifts.
             z_cdf = np.cumsum(n_hist)
-            z_cdf_norm = z_cdf / np.float(max(z_cdf))
+            z_cdf_norm = z_cdf / z_cdf.max()
 
             subgroup = subgroups[j]
-            # Generate the random points in each pixel
-            ndone = 0
-
-            nvertex = len(vertices)
-            my_nvertex = int(np.ceil(nvertex / self.size))
-            start_vertex = self.rank * my_nvertex
-            end_vertex = min(start_vertex + my_nvertex, nvertex)
 
             # These two classes batch up chunks of output to be done in large
             # sets, so that whatever the size of the randoms in this bin it will
             # still work.
-            batch1 = BatchWriter(
+            writer_options = {
+                "max_size": self.config["chunk_rows"],
+                "background": self.config["background_writes"],
+                "collective": self.config["collective_writes"],
+                "comm": self.comm,
+                "total_size": numbers[j, start_vertex:end_vertex].sum(),
+                "executor": executor,
+            }
+            batch1 = AsyncBatchWriter(
                 group,
                 {
                     "ra": np.float64,
@@ -186,9 +240,9 @@ class TXRandomCat(PipelineStage):
                     "bin": np.int16,
                 },
                 offset=bin_starts[j] + pix_starts[j, start_vertex],
-                max_size=self.config["chunk_rows"],
+                **writer_options,
             )
-            batch2 = BatchWriter(
+            batch2 = AsyncBatchWriter(
                 subgroup,
                 {
                     "ra": np.float64,
@@ -197,41 +251,66 @@ class TXRandomCat(PipelineStage):
                     "comoving_distance": np.float64,
                 },
                 offset=pix_starts[j, start_vertex],
-                max_size=self.config["chunk_rows"],
+                **writer_options,
             )
 
-            for i in range(start_vertex, end_vertex):
-                vertices_i = vertices[i]
-                if ndone % 1000 == 0:
-                    print(
-                        f"Rank {self.rank} done {ndone:,} of its {pixels_per_proc:,} pixels for bin {j}"
-                    )  # Use the pixel vertices to generate the points
-                ### This likely wont work for curved sky maps since healpy pixels aren't
-                ### fully quadrilateral... not sure how big of a difference (if any) this
-                ### will make
-                N = numbers[j, i]
-                p1, p2, p3, p4 = vertices_i.T
-                P = randoms.random_points_in_quadrilateral(p1, p2, p3, p4, N)
-                # Convert to RA/Dec
-                # This is not healpy-dependent so we just use it as a convenience function
-                ra, dec = healpy.vec2ang(P, lonlat=True)
+            # Split our pixels into blocks with about chunk_rows points in each,
+            # which are generated all at once.
+            my_numbers = numbers[j, start_vertex:end_vertex]
+            block = np.cumsum(my_numbers) // self.config["chunk_rows"]
+            block_ends = np.append(np.flatnonzero(np.diff(block)) + 1, len(my_numbers))
+            block_starts = np.concatenate([[0], block_ends[:-1]])
+
+            for s, e in zip(block_starts, block_ends):
+                print(
+                    f"Rank {self.rank} done {s:,} of its {len(my_numbers):,} pixels for bin {j}"
+                )
+                counts = my_numbers[s:e]
+                pix = pixel[start_vertex + s : start_vertex + e]
+                N = counts.sum()
+                if N == 0:
+                    continue
+
+                # The counters for each point: its pixel and its index within that
+                point_pix = np.repeat(pix, counts)
+                point_index = np.arange(N) - np.repeat(np.cumsum(counts) - counts, counts)
+
+                def uniforms(stream, index=slice(None)):
+                    return counter_uniforms(
+                        seed, j, point_pix[index], point_index[index], stream
+                    )
+
+                if sampling == "healpix":
+                    ra, dec = randoms.random_points_in_healpix_pixels(
+                        nside,
+                        pix,
+                        counts,
+                        nest=scheme.nest,
+                        subdivide=self.config["healpix_subdivide"],
+                        uniforms=lambda stream, index: uniforms(4 + stream, index),
+                    )
+                else:
+                    ### This likely wont work for curved sky maps since healpy pixels aren't
+                    ### fully quadrilateral... not sure how big of a difference (if any) this
+                    ### will make. The healpix sampling mode deals with this.
+                    P = randoms.random_points_in_quadrilaterals(
+                        vertices[start_vertex + s : start_vertex + e],
+                        counts,
+                        uniforms(np.arange(3)[:, np.newaxis]),
+                    )
+                    # Convert to RA/Dec
+                    # This is not healpy-dependent so we just use it as a convenience function
+                    ra, dec = healpy.vec2ang(P, lonlat=True)
 
                 bin_index = np.repeat(j, N)
 
-                ### Create random values [0,1] equal to the number of galaxies per pixel
-                cdf_rand_val = np.random.uniform(0, 1.0, N)
-                ### Interpolate those random values to a redshift value given by the cdf
-                # z_photo_rand = np.interp(cdf_rand_val,z_cdf_norm,z_photo_arr)
-                z_interp_func = scipy.interpolate.interp1d(z_cdf_norm, z_photo_arr)
+                ### Interpolate the last set of random values to a redshift value given by the cdf
                 # Sometimes we don't quite go down to z - deal with that
-                cdf_rand_val = cdf_rand_val.clip(z_cdf_norm.min(), z_cdf_norm.max())
-                z_photo_rand = z_interp_func(cdf_rand_val)
-                distance = pyccl.comoving_radial_distance(
-                    cosmo, 1.0 / (1 + z_photo_rand)
-                )
+                cdf_rand_val = uniforms(3).clip(z_cdf_norm.min(), z_cdf_norm.max())
+                z_photo_rand = np.interp(cdf_rand_val, z_cdf_norm, z_photo_arr)
+                distance = np.interp(z_photo_rand, z_table, chi_table)
 
                 # Save output to the generic non-binned output
-                index = bin_starts[j] + pix_starts[j, i]
                 batch1.write(
                     ra=ra,
                     dec=dec,
@@ -241,13 +320,14 @@ class TXRandomCat(PipelineStage):
                 )
 
                 # Save to the bit that is specific to this bin
-                index = pix_starts[j, i]
                 batch2.write(ra=ra, dec=dec, z=z_photo_rand, comoving_distance=distance)
 
-                ndone += 1
+            # The two writers must be padded out together so that their
+            # collective writes stay in the same order on every process
+            finish_batch_writers(batch1, batch2)
 
-            batch1.finish()
-            batch2.finish()
+        if executor is not None:
+            executor.shutdown()
 
         if self.comm is not None:
             self.comm.Barrier()
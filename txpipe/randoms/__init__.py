@@ -1 +1,7 @@
-from .randoms import random_points_in_triangle, random_points_in_quadrilateral
+from .randoms import (
+    random_points_in_triangle,
+    random_points_in_quadrilateral,
+    random_points_in_quadrilaterals,
+    random_points_in_healpix_pixels,
+    counter_uniforms,
+)
@@ -98,3 +98,208 @@ def random_points_in_quadrilateral(p1, p2, p3, p4, n):
 
     # Group the points and return
     return np.vstack((x1, x2))
+
+
+def _mix64(x):
+    # The splitmix64 finalizer, which scrambles the bits of a 64 bit
+    # integer. It is a bijection, so different inputs give different outputs.
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def counter_uniforms(seed, *counters):
+    """Generate uniform random numbers from integer counters.
+
+    Rather than drawing numbers in sequence from a generator, each
+    value is a hash of the seed and its counters (e.g. a pixel index,
+    the index of a point in the pixel, and which number we want for that
+    point). So the numbers for any object do not depend on which
+    others were generated before it, or by which process.
+
+    Params
+    ------
+    seed: int
+        Overall random seed
+    *counters: int or arrays of int
+        Non-negative counters identifying each value. These are broadcast
+        against each other.
+
+    Returns
+    -------
+    u: array
+        Uniform random values in [0, 1)
+    """
+    golden = np.uint64(0x9E3779B97F4A7C15)
+    with np.errstate(over="ignore"):
+        h = _mix64(np.asarray(seed, dtype=np.uint64) * golden)
+        for c in counters:
+            h = _mix64(h ^ (np.asarray(c, dtype=np.uint64) * golden))
+    # Use the top 53 bits, the precision of a double
+    return (h >> np.uint64(11)) * (1.0 / 2**53)
+
+
+def _triangle_areas(v1, v2):
+    c = np.cross(v1, v2)
+    # 2D vectors have a scalar cross product
+    if c.ndim == v1.ndim - 1:
+        return 0.5 * np.abs(c)
+    return 0.5 * np.linalg.norm(c, axis=-1)
+
+
+def random_points_in_quadrilaterals(vertices, counts, u=None):
+    """Generate random points uniformly distributed in many quadrilaterals
+    at once.
+
+    This is a vectorized version of random_points_in_quadrilateral; the
+    points in each quadrilateral are chosen in the same way.
+
+    Params
+    ------
+    vertices: array
+        nquad * ndim * 4 array of the vertices of the quadrilaterals,
+        as returned by the vertices method of the pixel schemes
+    counts: int array
+        The number of points to generate in each quadrilateral
+    u: array or None
+        3 * n array of uniform random values to use, where n is the total
+        count. If None these are generated with np.random
+
+    Returns
+    -------
+    p: array
+        n * ndim array of points, grouped by quadrilateral
+
+    """
+    counts = np.asarray(counts)
+    n = counts.sum()
+    if u is None:
+        u = np.random.uniform(0.0, 1.0, (3, n))
+
+    p1, p2, p3, p4 = [vertices[:, :, k] for k in range(4)]
+
+    # Fraction of each quadrilateral's area in its first triangle
+    A1 = _triangle_areas(p2 - p1, p3 - p2)
+    A2 = _triangle_areas(p4 - p3, p1 - p4)
+    f1 = A1 / (A1 + A2)
+
+    # Choose the triangle each point falls in. The first triangle is
+    # (p1, p2, p3) and the second (p1, p3, p4).
+    quad = np.repeat(np.arange(len(counts)), counts)
+    first = (u[0] < f1[quad])[:, np.newaxis]
+    origin = p1[quad]
+    v1 = np.where(first, p2[quad], p3[quad]) - origin
+    v2 = np.where(first, p3[quad], p4[quad]) - origin
+
+    # Points that flipped over to being outside the triangle
+    # are flipped back in
+    a1 = u[1].copy()
+    a2 = u[2].copy()
+    w = a1 + a2 > 1
+    a1[w] = 1 - a1[w]
+    a2[w] = 1 - a2[w]
+
+    return origin + a1[:, np.newaxis] * v1 + a2[:, np.newaxis] * v2
+
+
+def random_points_in_healpix_pixels(
+    nside, pixels, counts, nest=False, subdivide=4, uniforms=None, max_tries=100
+):
+    """Generate random points uniformly distributed on the sphere inside
+    healpix pixels.
+
+    Unlike random_points_in_quadrilateral, this accounts for the curved
+    edges of the pixels exactly. Each point is put in a random one of the
+    (equal-area) sub-pixels of its pixel at a finer resolution. A point is
+    drawn uniformly on the sphere in a box around that sub-pixel, and then
+    rejected and re-drawn if it is not actually inside it.
+
+    Params
+    ------
+    nside: int
+        Healpix resolution parameter of the pixels
+    pixels: int array
+        The pixels to generate points in
+    counts: int array
+        The number of points to generate in each pixel
+    nest: bool
+        Whether the pixels are in the nested ordering scheme
+    subdivide: int
+        The sub-pixels are at resolution nside * 2**subdivide
+    uniforms: callable or None
+        A function uniforms(stream, index) returning uniform random values
+        for the points with the given indices, with a different set for each
+        integer stream. If None then np.random is used.
+    max_tries: int
+        Give up if any point has not landed in its sub-pixel after this many
+        attempts
+
+    Returns
+    -------
+    ra, dec: arrays
+        The points, in degrees, grouped by pixel
+
+    """
+    import healpy
+
+    if uniforms is None:
+        uniforms = lambda stream, index: np.random.uniform(0.0, 1.0, len(index))
+
+    pixels = np.asarray(pixels)
+    if not nest:
+        pixels = healpy.ring2nest(nside, pixels)
+
+    n = np.sum(counts)
+    index = np.arange(n)
+
+    # In the nested scheme the sub-pixels of a pixel are numbered consecutively
+    nsub = 4**subdivide
+    nside_sub = nside * 2**subdivide
+    sub_pixel = np.repeat(pixels, counts) * nsub
+    sub_pixel += (uniforms(0, index) * nsub).astype(int).clip(0, nsub - 1)
+
+    # Find a box in z = cos(theta) and phi enclosing each sub-pixel, with
+    # a margin since the edges between the corners can bulge out a little.
+    # Phi is measured relative to the center to avoid wrapping around.
+    theta0, phi0 = healpy.pix2ang(nside_sub, sub_pixel, nest=True)
+    corners = healpy.boundaries(nside_sub, sub_pixel, step=2, nest=True)
+    corner_z = corners[:, 2, :]
+    corner_phi = np.arctan2(corners[:, 1, :], corners[:, 0, :])
+    dphi = (corner_phi - phi0[:, np.newaxis] + np.pi) % (2 * np.pi) - np.pi
+    # Corners at the poles have no meaningful phi
+    dphi[np.abs(corner_z) > 1 - 1e-12] = 0.0
+
+    z_lo = corner_z.min(axis=1)
+    z_hi = corner_z.max(axis=1)
+    phi_lo = dphi.min(axis=1)
+    phi_hi = dphi.max(axis=1)
+    z_margin = 0.1 * (z_hi - z_lo)
+    phi_margin = 0.1 * (phi_hi - phi_lo)
+    z_lo = np.maximum(z_lo - z_margin, -1.0)
+    z_hi = np.minimum(z_hi + z_margin, 1.0)
+    phi_lo -= phi_margin
+    phi_hi += phi_margin
+
+    theta = np.empty(n)
+    phi = np.empty(n)
+    todo = index
+    for attempt in range(max_tries):
+        if todo.size == 0:
+            break
+        # Uniform in z and phi is uniform on the sphere
+        z = z_lo[todo] + uniforms(1 + 2 * attempt, todo) * (z_hi[todo] - z_lo[todo])
+        p = phi_lo[todo] + uniforms(2 + 2 * attempt, todo) * (
+            phi_hi[todo] - phi_lo[todo]
+        )
+        theta[todo] = np.arccos(z)
+        phi[todo] = (phi0[todo] + p) % (2 * np.pi)
+
+        hit = healpy.ang2pix(nside_sub, theta[todo], phi[todo], nest=True)
+        todo = todo[hit != sub_pixel[todo]]
+    else:
+        if todo.size:
+            raise RuntimeError("Random points did not land in their healpix pixels")
+
+    ra = np.degrees(phi)
+    dec = 90.0 - np.degrees(theta)
+    return ra, dec
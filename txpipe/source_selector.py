@@ -110,6 +110,10 @@ class TXSourceSelectorBase(PipelineStage):
     Once these selections are made it constructs
     the quantities needed to calibrate each bin,
     generating a set of Calibrator objects.
+
+    If checkpoint_interval is set then the accumulated statistics
+    are saved every that many chunks, and a stage that is stopped
+    part way through will resume from there when re-run.
     """
 
     name = "TXSourceSelector"
@@ -132,6 +136,7 @@ class TXSourceSelectorBase(PipelineStage):
         "chunk_rows": 10000,
         "source_zbin_edges": [float],
         "random_seed": 42,
+        "checkpoint_interval": 0,
     }
 
     def run(self):
@@ -153,14 +158,23 @@ class TXSourceSelectorBase(PipelineStage):
         shear_catalog_type = read_shear_catalog_type(self)
         bands = self.config["bands"]
 
-        # The output file we will put the tomographic
-        # information into
-        output_file = self.setup_output()
-
-        # The iterator that will loop through the data.
-        # Set it up here so that we can find out if there are any
-        # problems with it before we get run the slow classifier.
-        it = self.data_iterator()
+        # If we are resuming a previous run that was stopped part-way through
+        # then we carry on with the same output file.
+        with self.open_input("shear_catalog", wrapper=True) as f:
+            n = f.get_size()
+        checkpoint = self.open_checkpoint("shear_tomography_catalog", n)
+        if checkpoint is not None and checkpoint.resuming:
+            output_file = self.open_output(
+                "shear_tomography_catalog", parallel=True, resume=True
+            )
+        else:
+            # The output file we will put the tomographic
+            # information into
+            output_file = self.setup_output()
+            # Make sure the file structure is on disc in case we
+            # need to come back to it after being stopped.
+            if checkpoint is not None:
+                output_file.flush()
 
         # Build a classifier used to put objects into tomographic bins
         if not (self.config["input_pz"] or self.config["true_z"]):
@@ -183,6 +197,17 @@ class TXSourceSelectorBase(PipelineStage):
 
         calculators = self.setup_response_calculators(nbin_source)
 
+        # Pick up the statistics from the previous run, if there is one.
+        # The iterator then skips the chunks that it already did.
+        resume_row = 0
+        if checkpoint is not None:
+            resume_row = checkpoint.restore(
+                calculators=calculators, number_density_stats=number_density_stats
+            )
+
+        # The iterator that will loop through the data.
+        it = self.data_iterator(resume_row=resume_row)
+
         # Loop through the input data, processing it chunk by chunk
         for (start, end, shear_data) in it:
             print(f"Process {self.rank} running selection for rows {start:,}-{end:,}")
@@ -214,12 +239,18 @@ class TXSourceSelectorBase(PipelineStage):
             # These will be brought together at the end.
             number_density_stats.add_data(shear_data, tomo_bin)  # check this
 
+            if checkpoint is not None:
+                checkpoint.completed(end, output_file)
+
         # Do the selection bias averaging and output that too.
         self.write_global_values(output_file, calculators, number_density_stats)
 
         # Save and complete
         output_file.close()
 
+        if checkpoint is not None:
+            checkpoint.finish()
+
         # Restore the original warning settings in case we are being called from a library
         np.seterr(**original_warning_settings)
 
@@ -267,7 +298,7 @@ class TXSourceSelectorBase(PipelineStage):
         R = self.compute_per_object_response(data)
 
         for i in range(nbin):
-            sel_00 = calculators[i].add_data(data, i)
+            sel_00 = self.add_bin_data(calculators[i], data, i, R)
             tomo_bin[sel_00] = i
             nsum = sel_00.sum()
             counts[i] = nsum
@@ -280,6 +311,20 @@ class TXSourceSelectorBase(PipelineStage):
 
         return tomo_bin, R, counts
 
+    def add_bin_data(self, calculator, data, i, R):
+        """
+        Select the objects in tomographic bin i and add them to its calculator.
+
+        Subclasses can extend this to record more about the selection
+        in the per-object response R.
+
+        Returns
+        -------
+        sel_00: array
+            The selection of objects in the bin
+        """
+        return calculator.add_data(data, i)
+
     def compute_per_object_response(self, data):
         # The default implementation has no per-object response
         # Some subclasses supply it.
@@ -301,7 +346,7 @@ class TXSourceSelectorBase(PipelineStage):
 
         outfile = self.open_output("shear_tomography_catalog", parallel=True)
         group = outfile.create_group("tomography")
-        group.create_dataset("source_bin", (n,), dtype="i")
+        self.create_catalog_dataset(group, "source_bin", n, "i4")
         group.create_dataset("source_counts", (nbin_source,), dtype="i")
         group.create_dataset("source_counts_2d", (1,), dtype="i")
         group.create_dataset("sigma_e", (nbin_source,), dtype="f")
@@ -340,8 +385,9 @@ class TXSourceSelectorBase(PipelineStage):
         tomo_bin: array of shape (nrow,)
             The bin index for each output object
 
-        R: array of shape (nrow,2,2)
-            Multiplicative bias calibration factor for each object
+        R: array or dict of arrays, or None
+            Per-object calibration values, in whatever form the subclass
+            compute_per_object_response method makes them
 
 
         """
@@ -456,13 +502,22 @@ class TXSourceSelectorMetacal(TXSourceSelectorBase):
     This selector subclass is designed for metacal-type catalogs like those
     used in Dark Energy Survey Y1 and Y3 data releases. In DESC they are
     superseded by MetaDetect, see below.
+
+    If response_columns is set then this also writes the tomographic bin
+    each object would be put in under each of the sheared variants, so that
+    later stages can compute the full response from the tomography catalog
+    without re-reading the sheared shear columns; see MetacalColumnCalculator.
     """
 
     name = "TXSourceSelectorMetacal"
+    config_options = {
+        **TXSourceSelectorBase.config_options,
+        "response_columns": False,
+    }
 
     # The main differences between the classes are to do with how the data is read
     # and what output response values are generated.
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         """
         This iterator returns chunks of data in dictionaries one by one.
 
@@ -484,7 +539,9 @@ class TXSourceSelectorMetacal(TXSourceSelectorBase):
             shear_cols += ["redshift_true"]
 
         chunk_rows = self.config["chunk_rows"]
-        return self.iterate_hdf("shear_catalog", "shear", shear_cols, chunk_rows)
+        return self.iterate_hdf(
+            "shear_catalog", "shear", shear_cols, chunk_rows, resume_row=resume_row
+        )
 
     def setup_output(self):
         """
@@ -504,13 +561,19 @@ class TXSourceSelectorMetacal(TXSourceSelectorBase):
         n = outfile["tomography/source_bin"].size
         nbin_source = outfile["tomography/source_counts"].size
         group = outfile.create_group("response")
-        group.create_dataset("R_gamma", (n, 2, 2), dtype="f")
+        self.create_catalog_dataset(group, "R_gamma", (n, 2, 2), "f4")
         group.create_dataset("R_S", (nbin_source, 2, 2), dtype="f")
         group.create_dataset("R_gamma_mean", (nbin_source, 2, 2), dtype="f")
         group.create_dataset("R_total", (nbin_source, 2, 2), dtype="f")
         group.create_dataset("R_S_2d", (2, 2), dtype="f")
         group.create_dataset("R_gamma_mean_2d", (2, 2), dtype="f")
         group.create_dataset("R_total_2d", (2, 2), dtype="f")
+
+        # The bins each object would be in under each sheared variant.
+        # These are small enough to store as single bytes.
+        if self.config["response_columns"]:
+            for v in ["1p", "1m", "2p", "2m"]:
+                self.create_catalog_dataset(group, f"source_bin_{v}", n, "i1")
         return outfile
 
     def setup_response_calculators(self, nbin_source):
@@ -526,18 +589,40 @@ class TXSourceSelectorMetacal(TXSourceSelectorBase):
         # to the general values that are written in the base class.
         super().write_tomography(outfile, start, end, source_bin, R)
         group = outfile["response"]
-        group["R_gamma"][start:end, :, :] = R
+        for name, col in R.items():
+            group[name][start:end] = col
 
     def compute_per_object_response(self, data):
         delta_gamma = self.config["delta_gamma"]
         n = data["mcal_g1_1p"].size
-        R = np.zeros((n, 2, 2))
+
+        # This is saved as float32 anyway, so we don't need the
+        # extra precision in memory either.
+        R = np.empty((n, 2, 2), dtype=np.float32)
         R[:, 0, 0] = (data["mcal_g1_1p"] - data["mcal_g1_1m"]) / delta_gamma
         R[:, 0, 1] = (data["mcal_g1_2p"] - data["mcal_g1_2m"]) / delta_gamma
         R[:, 1, 0] = (data["mcal_g2_1p"] - data["mcal_g2_1m"]) / delta_gamma
         R[:, 1, 1] = (data["mcal_g2_2p"] - data["mcal_g2_2m"]) / delta_gamma
+        R = {"R_gamma": R}
+
+        # The bins under each sheared variant are filled in by add_bin_data
+        if self.config["response_columns"]:
+            for v in ["1p", "1m", "2p", "2m"]:
+                R[f"source_bin_{v}"] = np.full(n, -1, dtype=np.int8)
         return R
 
+    def add_bin_data(self, calculator, data, i, R):
+        if not self.config["response_columns"]:
+            return super().add_bin_data(calculator, data, i, R)
+
+        # Record the bin each object is in under each sheared variant,
+        # using the selections that the calculator makes anyway.
+        selections = calculator.select_variants(data, i)
+        calculator.add_selections(data, selections)
+        for v, sel in zip(["1p", "1m", "2p", "2m"], selections[1:]):
+            R[f"source_bin_{v}"][sel] = i
+        return selections[0]
+
     def apply_simple_redshift_cut(self, data):
         # If we have the truth pz then we just need to do the binning once,
         # as in the parent class
@@ -601,7 +686,7 @@ class TXSourceSelectorMetadetect(TXSourceSelectorBase):
 
     name = "TXSourceSelectorMetadetect"
 
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         # As above, this is where we work out which columns we need.
         chunk_rows = self.config["chunk_rows"]
         bands = self.config["bands"]
@@ -629,7 +714,12 @@ class TXSourceSelectorMetadetect(TXSourceSelectorBase):
         # This is a parent ceci.PipelineStage method.
         # It returns an iterator we loop through
         it = self.iterate_hdf(
-            "shear_catalog", "shear", shear_cols, chunk_rows, longest=True
+            "shear_catalog",
+            "shear",
+            shear_cols,
+            chunk_rows,
+            longest=True,
+            resume_row=resume_row,
         )
         return rename_iterated(it, renames)
 
@@ -709,7 +799,7 @@ class TXSourceSelectorLensfit(TXSourceSelectorBase):
 
     name = "TXSourceSelectorLensfit"
 
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         chunk_rows = self.config["chunk_rows"]
         bands = self.config["bands"]
         shear_cols = [
@@ -730,7 +820,9 @@ class TXSourceSelectorLensfit(TXSourceSelectorBase):
             shear_cols += ["mean_z"]
         elif self.config["true_z"]:
             shear_cols += ["redshift_true"]
-        return self.iterate_hdf("shear_catalog", "shear", shear_cols, chunk_rows)
+        return self.iterate_hdf(
+            "shear_catalog", "shear", shear_cols, chunk_rows, resume_row=resume_row
+        )
 
     def setup_response_calculators(self, nbin_source):
         calculators = [
@@ -780,7 +872,7 @@ class TXSourceSelectorHSC(TXSourceSelectorBase):
 
     name = "TXSourceSelectorHSC"
 
-    def data_iterator(self):
+    def data_iterator(self, resume_row=0):
         chunk_rows = self.config["chunk_rows"]
         bands = self.config["bands"]
 
@@ -806,7 +898,9 @@ class TXSourceSelectorHSC(TXSourceSelectorBase):
             shear_cols += ["redshift_true"]
 
         # Iterate using parent class method
-        return self.iterate_hdf("shear_catalog", "shear", shear_cols, chunk_rows)
+        return self.iterate_hdf(
+            "shear_catalog", "shear", shear_cols, chunk_rows, resume_row=resume_row
+        )
 
     def setup_output(self):
         # This call to the super-class method defined above sets up most of the output
@@ -818,7 +912,7 @@ class TXSourceSelectorHSC(TXSourceSelectorBase):
         group = outfile.create_group("response")
 
         # There is a single scalar per-object value for this scheme
-        group.create_dataset("R", (n,), dtype="f")
+        self.create_catalog_dataset(group, "R", n, "f4")
 
         # and a set of additive and multiplicative factors.
         # The K and R values are degenerate.
@@ -837,11 +931,9 @@ class TXSourceSelectorHSC(TXSourceSelectorBase):
 
     def compute_per_object_response(self, data):
         w_tot = np.sum(data["weight"])
-        R = np.array(
-            [1.0 - np.sum(data["weight"] * data["sigma_e"]) / w_tot]
-            * len(data["weight"])
-        )
-        return R
+        R = 1.0 - np.sum(data["weight"] * data["sigma_e"]) / w_tot
+        # This is the same for every object in the chunk
+        return np.full(len(data["weight"]), R, dtype=np.float32)
 
     def compute_output_stats(self, calculator, mean, variance):
         R, K, N = calculator.collect(self.comm, allgather=True)
@@ -0,0 +1,41 @@
+from ..base_stage import PipelineStage
+from ..data_types import HDFFile
+import mockmpi
+
+
+class ProvenanceTestStage(PipelineStage):
+    name = "ProvenanceTestStage"
+    inputs = [("some_input", HDFFile)]
+    outputs = []
+    config_options = {"x": 1}
+
+
+def core_provenance(comm):
+    stage = ProvenanceTestStage({"some_input": "does_not_exist.hdf5", "config": None})
+    stage.setup_mpi(comm)
+
+    # Under MPI the root process collects this and shares it
+    if comm is not None:
+        assert stage._cached_provenance is not None
+
+    p1 = stage.gather_provenance()
+    assert p1["input/some_input"] == "UNKNOWN"
+    assert "githead" in p1
+
+    # Config changes are still picked up after the first call
+    stage.config["x"] = 2
+    p2 = stage.gather_provenance()
+    assert p2["config/x"] == "2"
+    assert p2["githead"] == p1["githead"]
+
+    # callers can modify what they get without affecting the cache
+    p2["gitdiff"] = "modified"
+    assert stage.gather_provenance()["gitdiff"] == p1["gitdiff"]
+
+
+def test_provenance_serial():
+    core_provenance(None)
+
+
+def test_provenance_parallel():
+    mockmpi.mock_mpiexec(2, core_provenance)
@@ -1,5 +1,8 @@
-from ..utils.hdf_tools import BatchWriter
+from ..utils import hdf_tools
+from ..utils.hdf_tools import BatchWriter, AsyncBatchWriter, finish_batch_writers
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import mockmpi
 
 
 class MockGroup:
@@ -81,5 +84,99 @@ def test_offset():
     assert "Wrote y from 32 to 37" in g.log
 
 
+def test_async():
+    import h5py
+    import tempfile
+
+    x = np.arange(35, dtype=np.float64)
+    y = np.arange(35, dtype=np.int64)
+
+    for background in [True, False]:
+        g = MockGroup()
+        cols = {"x": np.float64, "y": np.int64}
+        b = AsyncBatchWriter(g, cols, 2, max_size=10, background=background)
+        b.write(x=x, y=y)
+        b.finish()
+
+        assert "Wrote x from 2 to 12" in g.log
+        assert "Wrote y from 12 to 22" in g.log
+        assert "Wrote x from 22 to 32" in g.log
+        assert "Wrote y from 32 to 37" in g.log
+        assert len(g.log) == 8
+
+    # check the double-buffering doesn't mix up the data
+    with tempfile.TemporaryDirectory() as dirname:
+        with h5py.File(f"{dirname}/test.hdf5", "w") as f:
+            f.create_dataset("x", (40,))
+            f.create_dataset("y", (40,), dtype=np.int64)
+            b = AsyncBatchWriter(f, cols, 2, max_size=10)
+            for i in range(7):
+                b.write(x=x[i * 5 : (i + 1) * 5], y=y[i * 5 : (i + 1) * 5])
+            b.finish()
+            assert np.array_equal(f["x"][2:37], x)
+            assert np.array_equal(f["y"][2:37], y)
+
+
+class MockFile:
+    driver = "mpio"
+
+
+class MockCollectiveGroup:
+    # Stands in for a group in a file opened with the mpio driver
+    file = MockFile()
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getitem__(self, col):
+        return f"{self.name}/{col}"
+
+
+def core_paired_collective(comm):
+    # Record the order of the collective writes instead of making them
+    calls = []
+    hdf_tools.collective_write = lambda dataset, start, data: calls.append(
+        (dataset, len(data))
+    )
+
+    # Each process has a different number of rows, needing 2, 3, and 4 batches
+    n = 12 * (comm.rank + 1)
+    x = np.arange(n, dtype=np.float64)
+    cols = {"x": np.float64, "y": np.float64}
+
+    for background in [True, False]:
+        calls.clear()
+        executor = ThreadPoolExecutor(max_workers=1) if background else None
+        options = {
+            "max_size": 10,
+            "background": background,
+            "collective": True,
+            "comm": comm,
+            "total_size": n,
+            "executor": executor,
+        }
+        b1 = AsyncBatchWriter(MockCollectiveGroup("g1"), cols, 0, **options)
+        b2 = AsyncBatchWriter(MockCollectiveGroup("g2"), cols, 0, **options)
+        for i in range(0, n, 6):
+            b1.write(x=x[i : i + 6], y=x[i : i + 6])
+            b2.write(x=x[i : i + 6], y=x[i : i + 6])
+        finish_batch_writers(b1, b2)
+        if executor is not None:
+            executor.shutdown()
+
+        # All the data is written, and every process makes the same
+        # sequence of collective calls
+        for g in ["g1", "g2"]:
+            assert sum(k for d, k in calls if d == f"{g}/x") == n
+        order = [d for d, k in calls]
+        assert len(order) == 4 * 4
+        all_orders = comm.allgather(order)
+        assert all(o == all_orders[0] for o in all_orders)
+
+
+def test_paired_collective():
+    mockmpi.mock_mpiexec(3, core_paired_collective)
+
+
 if __name__ == "__main__":
     test_offset()
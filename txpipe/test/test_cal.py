@@ -1,7 +1,9 @@
 from ..utils.calibration_tools import (
     MeanShearInBins,
     MetacalCalculator,
+    MetacalColumnCalculator,
     MetaDetectCalculator,
+    _DataWrapper,
 )
 from ..utils import MetaCalibrator, LensfitCalibrator, NullCalibrator
 import numpy as np
@@ -389,6 +391,115 @@ def test_null_mean():
     assert type(g2) == np.ndarray
 
 
+
+def test_metacal_inplace():
+    # stacked, in-place version, with and without the mean
+    R = np.array([[2, 3], [4, 5]])
+    S = np.zeros_like(R)
+    mu = [0.1, 0.2]
+    g1 = np.random.normal(size=10)
+    g2 = np.random.normal(size=10)
+    cal = MetaCalibrator(R, S, mu, mu_is_calibrated=True)
+
+    for dtype in [np.float32, np.float64]:
+        g = (R @ [g1 + mu[0], g2 + mu[1]]).astype(dtype)
+        g_ = cal.apply_inplace(g)
+        assert g_ is g
+        assert g.dtype == dtype
+        assert np.allclose(g[0], g1, atol=1e-5)
+        assert np.allclose(g[1], g2, atol=1e-5)
+
+        g = (R @ [g1, g2]).astype(dtype)
+        cal.apply_inplace(g, subtract_mean=False)
+        assert np.allclose(g[0], g1, atol=1e-5)
+        assert np.allclose(g[1], g2, atol=1e-5)
+
+
+def test_null_inplace():
+    mu = [0.05, 0.06]
+    cal = NullCalibrator(mu)
+    g_obs = np.random.normal(size=(2, 10))
+
+    g = g_obs.copy()
+    cal.apply_inplace(g)
+    assert np.allclose(g, g_obs)
+
+    cal.apply_inplace(g, subtract_mean=True)
+    assert np.allclose(g[0], g_obs[0] - mu[0])
+    assert np.allclose(g[1], g_obs[1] - mu[1])
+
+
+def test_metacal_column_calculator():
+    # The calculator using the per-object columns saved by the selector
+    # should give the same result as the one using the variants directly
+    delta_gamma = 0.02
+    N = 1000
+    nbin = 3
+    data = {
+        "mcal_g1": np.random.normal(0, 0.2, size=N),
+        "mcal_g2": np.random.normal(0, 0.2, size=N),
+        "weight": np.random.uniform(0.5, 1.5, size=N),
+        "zbin": np.random.randint(-1, nbin, size=N),
+    }
+    for v in ["_1p", "_1m", "_2p", "_2m"]:
+        data[f"mcal_g1{v}"] = data["mcal_g1"] + np.random.normal(0, 0.01, size=N)
+        data[f"mcal_g2{v}"] = data["mcal_g2"] + np.random.normal(0, 0.01, size=N)
+        data[f"s2n{v}"] = np.random.uniform(0, 20, size=N)
+    data["s2n"] = np.random.uniform(0, 20, size=N)
+
+    def select(d, i=None):
+        sel = d["s2n"] > 10
+        if i is None:
+            return sel & (d["zbin"] >= 0)
+        return sel & (d["zbin"] == i)
+
+    def bins(d):
+        b = np.full(N, -1, dtype=np.int8)
+        for i in range(nbin):
+            b[select(d, i)] = i
+        return b
+
+    columns = {
+        "mcal_g1": data["mcal_g1"],
+        "mcal_g2": data["mcal_g2"],
+        "weight": data["weight"],
+        "source_bin": bins(_DataWrapper(data)),
+        "R_gamma": np.zeros((N, 2, 2), dtype=np.float32),
+    }
+    for v in ["1p", "1m", "2p", "2m"]:
+        columns[f"source_bin_{v}"] = bins(_DataWrapper(data, f"_{v}"))
+    for i, c in enumerate(["1", "2"]):
+        for j, s in enumerate(["1", "2"]):
+            columns["R_gamma"][:, i, j] = (
+                data[f"mcal_g{c}_{s}p"] - data[f"mcal_g{c}_{s}m"]
+            ) / delta_gamma
+
+    # The column calculator just needs to select on the bin; the
+    # variant bins are picked up automatically
+    def select_bin(d, i=None):
+        if i is None:
+            return d["source_bin"] >= 0
+        return d["source_bin"] == i
+
+    for i in [0, 1, 2, None]:
+        cal1 = MetacalCalculator(select, delta_gamma)
+        cal2 = MetacalColumnCalculator(select_bin, delta_gamma, variant_bins=True)
+        # Without the variant bins the cut is the same for every variant
+        cal3 = MetacalColumnCalculator(select_bin, delta_gamma)
+        args = () if i is None else (i,)
+        cal1.add_data(data, *args)
+        cal2.add_data(columns, *args)
+        cal3.add_data(columns, *args)
+        R1, S1, n1 = cal1.collect()
+        R2, S2, n2 = cal2.collect()
+        R3, S3, n3 = cal3.collect()
+        assert n1 == n2 == n3
+        assert np.allclose(R1, R2, rtol=1e-4)
+        assert np.allclose(S1, S2)
+        assert np.allclose(R3, R2)
+        assert np.allclose(S3, 0)
+
+
 if __name__ == "__main__":
     test_metacalibrator_serial()
     test_metacalibrator_parallel()
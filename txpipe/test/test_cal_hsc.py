@@ -205,6 +205,24 @@ def test_hsc_array():
     assert type(g2) == np.ndarray
 
 
+
+def test_hsc_inplace():
+    R = np.array([0.9])
+    K = np.array([0.11])
+    cal = HSCCalibrator(R, K)
+    g1 = np.random.normal(size=10)
+    g2 = np.random.normal(size=10)
+    c1 = 0.1 * g1
+    c2 = 0.1 * g2
+    g1_obs = (g1 * (1 + K) + c1) * (2 * R)
+    g2_obs = (g2 * (1 + K) + c2) * (2 * R)
+    g = np.array([g1_obs, g2_obs])
+    cal.apply_inplace(g, c1, c2)
+
+    assert np.allclose(g[0], g1)
+    assert np.allclose(g[1], g2)
+
+
 if __name__ == "__main__":
     test_hsccalibrator_serial()
     test_hsc_parallel()
@@ -203,6 +203,21 @@ def test_null():
     assert type(g2) == np.ndarray
 
 
+
+def test_lensfit_inplace():
+    K = np.array([0.9])
+    C = np.array([0.11, 0.22])
+    cal = LensfitCalibrator(K, C)
+    g1 = np.random.normal(size=10)
+    g2 = np.random.normal(size=10)
+    g = np.array([g1 * (1 + K[0]) + C[0], g2 * (1 + K[0]) + C[1]], dtype=np.float32)
+    cal.apply_inplace(g)
+
+    assert g.dtype == np.float32
+    assert np.allclose(g[0], g1, atol=1e-5)
+    assert np.allclose(g[1], g2, atol=1e-5)
+
+
 if __name__ == "__main__":
     test_lensfit_serial()
     test_lensfit_parallel()
@@ -61,3 +61,59 @@ def test_unsupported():
         with pytest.raises(UnsupportedOperation):
             p.write_provenance()
         p.close()
+
+
+def test_parquet_iteration():
+    pytest.importorskip("pyarrow")
+    import numpy as np
+    import pyarrow
+    import pyarrow.parquet
+    from ..base_stage import PipelineStage
+    from ..data_types import ShearCatalog, ParquetFile
+
+    class ParquetTestStage(PipelineStage):
+        name = "ParquetTestStage"
+        inputs = [("shear_catalog", ShearCatalog)]
+        outputs = []
+        config_options = {}
+
+    n = 100
+    table = pyarrow.table({"ra": np.arange(n, dtype=float), "id": np.arange(n)})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cat.pq")
+        pyarrow.parquet.write_table(table, path, row_group_size=30)
+
+        f = ParquetFile(path, "r")
+        assert f.get_size() == n
+        assert f.row_group_ranges() == [(0, 30), (30, 60), (60, 90), (90, 100)]
+
+        stage = ParquetTestStage({"shear_catalog": path, "config": None})
+
+        # the same chunks as an HDF5 file would give
+        chunks = list(stage.iterate_hdf("shear_catalog", "shear", ["ra", "id"], 25))
+        assert [(s, e) for s, e, _ in chunks] == [(0, 25), (25, 50), (50, 75), (75, 100)]
+        for s, e, data in chunks:
+            assert np.array_equal(data["ra"], np.arange(s, e))
+            assert np.array_equal(data["id"], np.arange(s, e))
+
+        # chunks split at row groups
+        chunks = list(stage.iterate_parquet("shear_catalog", ["id"], 25))
+        assert [(s, e) for s, e, _ in chunks] == [
+            (0, 25),
+            (25, 30),
+            (30, 55),
+            (55, 60),
+            (60, 85),
+            (85, 90),
+            (90, 100),
+        ]
+        for s, e, data in chunks:
+            assert list(data.keys()) == ["id"]
+            assert np.array_equal(data["id"], np.arange(s, e))
+
+        # combined_iterators uses these when there is only one input
+        chunks = list(stage.combined_iterators(25, "shear_catalog", "shear", ["id"]))
+        assert [(s, e) for s, e, _ in chunks][:3] == [(0, 25), (25, 30), (30, 55)]
+        for s, e, data in chunks:
+            assert np.array_equal(data["id"], np.arange(s, e))
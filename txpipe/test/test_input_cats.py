@@ -0,0 +1,111 @@
+from ..input_cats import TXGaussianSimsMock
+import numpy as np
+import tempfile
+import h5py
+import os
+
+
+class ChunkedGaussianSimsMock(TXGaussianSimsMock):
+    name = "ChunkedGaussianSimsMock"
+
+    # Split the catalog into several small chunks, so that the
+    # per-chunk random seeds are tested
+    def data_iterator(self, cat):
+        for data in super().data_iterator(cat):
+            n = len(data["ra"])
+            for s in range(0, n, 500):
+                yield {k: v[s : s + 500] for k, v in data.items()}
+
+
+def test_exact_sizing():
+    n = 2000
+    rng = np.random.default_rng(5)
+    cat = np.array(
+        [
+            rng.uniform(0, 10, n),  # ra
+            rng.uniform(-10, 0, n),  # dec
+            rng.normal(0, 0.01, n),  # g1
+            rng.normal(0, 0.01, n),  # g2
+            rng.uniform(0.1, 2.0, n),  # z
+        ]
+        # u, g, r, i, z, y magnitudes, some of them too faint to detect
+        + [rng.uniform(24, 34, n) for b in range(6)]
+        + [
+            rng.normal(0, 0.2, n),  # e1
+            rng.normal(0, 0.2, n),  # e2
+            rng.uniform(0.3, 1.0, n),  # size
+            np.arange(n),  # galaxy_id
+        ]
+    )
+
+    with tempfile.TemporaryDirectory() as dirname:
+        cat_file = os.path.join(dirname, "cat.npy")
+        np.save(cat_file, cat)
+        stage = ChunkedGaussianSimsMock(
+            {
+                "response_model": "unused.hdf5",
+                "shear_catalog": os.path.join(dirname, "shear_catalog.hdf5"),
+                "photometry_catalog": os.path.join(dirname, "photometry_catalog.hdf5"),
+                "config": None,
+                "cat_name": cat_file,
+                "snr_limit": 4.0,
+                "max_size": 1800,
+                "extra_cols": "redshift_true",
+                "exact_sizing": True,
+            }
+        )
+
+        # Record the objects selected in each pass
+        selected = []
+        counted = []
+        select = stage.select_and_make_photometry
+        count = stage.count_output_rows
+
+        def recording_select(data, N, target_size):
+            photo = select(data, N, target_size)
+            selected.append(photo["id"].copy())
+            return photo
+
+        def recording_count(*args):
+            counted.append(count(*args))
+            return counted[-1]
+
+        stage.select_and_make_photometry = recording_select
+        stage.count_output_rows = recording_count
+        np.random.seed(10)
+        stage.run()
+        stage.finalize()
+
+        with h5py.File(os.path.join(dirname, "photometry_catalog.hdf5")) as f:
+            ids = f["photometry/id"][:]
+
+    # Four chunks in each pass
+    assert len(selected) == 8
+    count_ids = np.concatenate(selected[:4])
+    main_ids = np.concatenate(selected[4:])
+
+    # Some objects are cut, and the two passes select the same ones
+    assert 0 < counted[0] < 1800
+    assert np.array_equal(count_ids, main_ids)
+
+    # The output is exactly the counted size, and contains all of them
+    assert len(ids) == counted[0]
+    assert np.array_equal(ids, main_ids)
+
+
+def test_seed_chunk():
+    import types
+
+    # Chunks on different processes get different random streams,
+    # and the same chunk and process always gets the same one
+    draws = {}
+    for rank in [0, 1]:
+        stage = types.SimpleNamespace(rank=rank)
+        for i in [0, 1]:
+            TXGaussianSimsMock.seed_chunk(stage, 1234, i)
+            draws[rank, i] = np.random.uniform(size=10)
+
+    TXGaussianSimsMock.seed_chunk(types.SimpleNamespace(rank=1), 1234, 0)
+    assert np.array_equal(np.random.uniform(size=10), draws[1, 0])
+    assert not np.allclose(draws[0, 0], draws[1, 0])
+    assert not np.allclose(draws[0, 0], draws[0, 1])
@@ -0,0 +1,118 @@
+from ..lens_selector import TXBaseLensSelector, boss_lens_bin
+import numpy as np
+import pytest
+import tempfile
+import types
+import os
+
+
+def test_boss_lens_bin():
+    n = 100_000
+    nbin = 4
+    config = TXBaseLensSelector.config_options.copy()
+    config["lens_zbin_edges"] = [0.1, 0.3, 0.5, 0.7, 0.9]
+
+    # magnitudes spread around the cut values, so all the cuts matter
+    mag_i = np.random.uniform(16.0, 21.0, size=n)
+    mag_r = mag_i + np.random.uniform(-0.5, 2.5, size=n)
+    mag_g = mag_r + np.random.uniform(-0.5, 3.0, size=n)
+    phot_data = {"mag_g": mag_g, "mag_r": mag_r, "mag_i": mag_i}
+    pz_data = {"zbin": np.random.randint(-1, nbin, size=n)}
+
+    # Compare to the original, unfused selection
+    stage = types.SimpleNamespace(config=config)
+    lens_gals = TXBaseLensSelector.select_lens(stage, phot_data)
+    expected, expected_counts = TXBaseLensSelector.calculate_tomography(
+        stage, pz_data, phot_data, lens_gals
+    )
+    assert 0 < (expected >= 0).sum() < (pz_data["zbin"] >= 0).sum()
+
+    lens_bin, counts = boss_lens_bin(
+        mag_g, mag_r, mag_i, pz_data["zbin"], nbin, config, block_rows=7777
+    )
+
+    # The fused version works in float32, so objects right on the edge
+    # of a cut can very occasionally differ
+    assert (lens_bin != expected).sum() < 1e-4 * n
+    assert np.array_equal(counts, np.bincount(lens_bin + 1, minlength=nbin + 1)[1:])
+    assert np.abs(counts - expected_counts).sum() < 1e-4 * n
+
+
+class MagLimitLensSelector(TXBaseLensSelector):
+    name = "MagLimitLensSelector"
+
+    def select_lens(self, phot_data):
+        return (phot_data["mag_i"] < 19.0).astype(np.int8)
+
+
+def test_select_lens_bins_override():
+    n = 1000
+    nbin = 2
+    mag_i = np.random.uniform(16.0, 21.0, size=n)
+    phot_data = {"mag_g": mag_i + 2.0, "mag_r": mag_i + 1.0, "mag_i": mag_i}
+    pz_data = {"zbin": np.random.randint(-1, nbin, size=n)}
+
+    # Subclasses with their own cuts should get those, not the fused BOSS ones
+    stage = object.__new__(MagLimitLensSelector)
+    stage._configs = {
+        **TXBaseLensSelector.config_options,
+        "lens_zbin_edges": [0.1, 0.5, 0.9],
+    }
+    lens_bin, counts = stage.select_lens_bins(pz_data, phot_data)
+    expected = np.where(mag_i < 19.0, pz_data["zbin"], -1)
+    assert np.array_equal(lens_bin, expected)
+    assert np.array_equal(counts, np.bincount(expected + 1, minlength=nbin + 1)[1:])
+
+
+def run_truth_selector(dirname, phot_file, name):
+    from ..lens_selector import TXTruthLensSelector
+    import h5py
+
+    output_file = os.path.join(dirname, f"{name}.hdf5")
+    stage = TXTruthLensSelector(
+        {
+            "photometry_catalog": phot_file,
+            "lens_tomography_catalog": output_file,
+            "config": None,
+            "lens_zbin_edges": [0.1, 0.5, 0.9],
+            "chunk_rows": 300,
+        }
+    )
+    stage.run()
+    stage.finalize()
+    with h5py.File(output_file) as f:
+        return f["tomography/lens_bin"][:], f["tomography/lens_counts"][:]
+
+
+def test_truth_selector_parquet():
+    pytest.importorskip("pyarrow")
+    import pyarrow
+    import pyarrow.parquet
+    import h5py
+
+    n = 1000
+    rng = np.random.default_rng(1)
+    mag_i = rng.uniform(16.0, 21.0, size=n)
+    cols = {
+        "ra": rng.uniform(0, 10, size=n),
+        "mag_i": mag_i,
+        "mag_r": mag_i + rng.uniform(-0.5, 2.5, size=n),
+        "mag_g": mag_i + rng.uniform(0.0, 5.0, size=n),
+        "redshift_true": rng.uniform(0.0, 1.0, size=n),
+    }
+
+    with tempfile.TemporaryDirectory() as dirname:
+        hdf_file = os.path.join(dirname, "photometry_catalog.hdf5")
+        pq_file = os.path.join(dirname, "photometry_catalog.pq")
+        with h5py.File(hdf_file, "w") as f:
+            for name, col in cols.items():
+                f[f"photometry/{name}"] = col
+        pyarrow.parquet.write_table(pyarrow.table(cols), pq_file, row_group_size=250)
+
+        # The stage should give the same results from either format
+        bins1, counts1 = run_truth_selector(dirname, hdf_file, "lens_hdf")
+        bins2, counts2 = run_truth_selector(dirname, pq_file, "lens_pq")
+
+    assert (bins1 >= 0).any()
+    assert np.array_equal(bins1, bins2)
+    assert np.array_equal(counts1, counts2)
@@ -0,0 +1,137 @@
+from ..utils.pdfs import pdf_quantiles, pdfs_from_quantiles, quantize_pdfs
+from ..photoz_stack import TXPhotozSourceStack
+from ..photoz import lognormal_pdfs
+import numpy as np
+import tempfile
+import types
+import h5py
+import os
+
+
+def test_pdf_quantiles():
+    import scipy.stats
+
+    z = np.linspace(0.0, 3.0, 301)
+    mu = np.random.uniform(0.5, 1.5, size=100)
+    sigma = 0.1
+    pdfs = np.exp(-0.5 * ((z - mu[:, np.newaxis]) / sigma) ** 2)
+    levels = (np.arange(20) + 0.5) / 20
+
+    q = pdf_quantiles(z, pdfs, levels)
+    expected = mu[:, np.newaxis] + sigma * scipy.stats.norm.ppf(levels)
+    assert q.shape == (100, 20)
+    assert np.allclose(q, expected, atol=1e-3)
+
+
+def test_pdf_quantiles_bad_rows():
+    z = np.linspace(0.0, 3.0, 301)
+    dz = z[1] - z[0]
+    mu = np.random.uniform(0.5, 1.5, size=10)
+    sigma = 0.1
+    pdfs = np.exp(-0.5 * ((z - mu[:, np.newaxis]) / sigma) ** 2)
+    levels = (np.arange(20) + 0.5) / 20
+    expected = pdf_quantiles(z, pdfs, levels)
+
+    # Empty and non-finite PDFs, including ones just before good rows
+    pdfs[2] = 0.0
+    pdfs[5, 100] = np.nan
+    pdfs[6, 50] = np.inf
+    bad = [2, 5, 6]
+    good = [i for i in range(10) if i not in bad]
+
+    q = pdf_quantiles(z, pdfs, levels)
+    assert np.isnan(q[bad]).all()
+    assert np.allclose(q[good], expected[good])
+
+    # The bad rows should have no probability when rebuilt,
+    # and not affect the others
+    rebuilt = pdfs_from_quantiles(z, q, levels)
+    assert np.all(rebuilt[bad] == 0)
+    assert np.allclose(rebuilt[good], pdfs_from_quantiles(z, expected, levels)[good])
+    assert np.allclose(rebuilt[good].sum(axis=1) * dz, 1.0, atol=1e-3)
+
+
+def test_compact_pdfs():
+    from ..data_types import CompactPhotozPDFFile
+
+    z = np.linspace(0.0, 3.0, 301)
+    dz = z[1] - z[0]
+    mu = np.random.uniform(0.5, 1.5, size=1000)
+    sigma = 0.1
+    pdfs = np.exp(-0.5 * ((z - mu[:, np.newaxis]) / sigma) ** 2)
+    pdfs /= pdfs.sum(axis=1)[:, np.newaxis] * dz
+    nz = pdfs.mean(axis=0)
+
+    # The quantized PDFs should be almost exact, and the stacked
+    # n(z) from the quantiles should be within a couple of percent of the peak
+    q, scale = quantize_pdfs(pdfs)
+    levels = (np.arange(32) + 0.5) / 32
+    quantiles = pdf_quantiles(z, pdfs, levels)
+    rebuilt = pdfs_from_quantiles(z, quantiles, levels)
+    assert np.allclose(rebuilt.sum(axis=1) * dz, 1.0, atol=1e-3)
+    assert np.abs(rebuilt.mean(axis=0) - nz).max() < 0.02 * nz.max()
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "pdfs.hdf5")
+        with h5py.File(filename, "w") as f:
+            g = f.create_group("pdf")
+            g.attrs["storage"] = "quantized"
+            g.create_dataset("zgrid", data=z)
+            g.create_dataset("pdf", data=q)
+            g.create_dataset("scale", data=scale)
+
+        f = CompactPhotozPDFFile(filename, "r")
+        assert np.allclose(f.read_zgrid(), z)
+        decoded = f.read_pdfs(100, 200)
+        f.close()
+
+    assert decoded.dtype == np.float32
+    assert np.abs(decoded - pdfs[100:200]).max() < 1e-4 * pdfs.max()
+
+
+def test_quantize_negative_pdfs():
+    pdfs = np.array([[0.0, 1.0, 2.0, -0.5], [-1.0, -2.0, -1.0, -0.1]])
+    q, scale = quantize_pdfs(pdfs)
+    assert np.all(q[0] == [0, 32768, 65535, 0])
+    assert np.all(q[1] == 0)
+    assert scale[1] == 0
+
+
+def test_has_compact_pdfs():
+    with tempfile.TemporaryDirectory() as dirname:
+        files = {
+            "rail": os.path.join(dirname, "rail.hdf5"),
+            "random": os.path.join(dirname, "random.hdf5"),
+            "qp": os.path.join(dirname, "qp.hdf5"),
+        }
+        # The RAIL estimation layout
+        with h5py.File(files["rail"], "w") as f:
+            f["pdf/zgrid"] = np.linspace(0, 3, 10)
+            f["pdf/pdf"] = np.ones((5, 10), dtype=np.uint16)
+        # A "pdf" group in the layout that TXRandomPhotozPDF writes
+        with h5py.File(files["random"], "w") as f:
+            f["pdf/z"] = np.linspace(0, 3, 10)
+            f["pdf/pdf"] = np.ones((5, 10))
+        # The qp layout
+        with h5py.File(files["qp"], "w") as f:
+            f["meta/xvals"] = np.linspace(0, 3, 10)
+            f["data/yvals"] = np.ones((5, 10))
+
+        stage = types.SimpleNamespace(open_input=lambda tag: h5py.File(files[tag], "r"))
+        assert TXPhotozSourceStack.has_compact_pdfs(stage, "rail")
+        assert not TXPhotozSourceStack.has_compact_pdfs(stage, "random")
+        assert not TXPhotozSourceStack.has_compact_pdfs(stage, "qp")
+
+
+def test_lognormal_pdfs():
+    import scipy.stats
+
+    z = np.linspace(0.0, 3.0, 301)
+    medians = np.random.uniform(0.2, 1.0, size=100)
+    sigmas = 0.05 * (1 + medians)
+    pdfs = np.empty((100, 301), dtype="f4")
+    lognormal_pdfs(z, medians, sigmas, pdfs)
+
+    for i in range(100):
+        expected = scipy.stats.lognorm.pdf(z, s=sigmas[i], scale=medians[i])
+        assert np.allclose(pdfs[i], expected, rtol=1e-4, atol=1e-30)
@@ -0,0 +1,115 @@
+from ..rail.summarize import PZRailSummarize
+import numpy as np
+import mockmpi
+import tempfile
+import h5py
+import os
+import pytest
+
+
+def core_summarize_streaming(comm, dirname):
+    n = 1000
+    nbin = 3
+    rng = np.random.default_rng(10)
+    mags = rng.uniform(20, 25, size=(2, n))
+    bins = rng.integers(-1, nbin, size=n)
+
+    phot_file = os.path.join(dirname, "photometry_catalog.hdf5")
+    tomo_file = os.path.join(dirname, "tomography_catalog.hdf5")
+    if comm is None or comm.rank == 0:
+        with h5py.File(phot_file, "w") as f:
+            f["photometry/mag_g"] = mags[0]
+            f["photometry/mag_r"] = mags[1]
+        with h5py.File(tomo_file, "w") as f:
+            g = f.create_group("tomography")
+            g.attrs["nbin_lens"] = nbin
+            g["lens_bin"] = bins
+    if comm is not None:
+        comm.Barrier()
+
+    stage = PZRailSummarize(
+        {
+            "photometry_catalog": phot_file,
+            "tomography_catalog": tomo_file,
+            "model": "unused.pkl",
+            "photoz_stack": os.path.join(dirname, "photoz_stack.hdf5"),
+            "config": None,
+            "tomography_name": "lens",
+            "chunk_rows": 100,
+        }
+    )
+    stage.setup_mpi(comm)
+    nbin1, full = stage.load_bin_data(["g", "r"], "lens")
+
+    tmp_dir = stage.make_temp_dir()
+    assert os.path.dirname(tmp_dir) == dirname
+    nbin2, bin_file = stage.write_bin_file(["g", "r"], "lens", tmp_dir)
+    assert nbin1 == nbin2 == nbin
+
+    # The shares from all the processes are joined into the one file
+    # that every process can read
+    with h5py.File(bin_file, "r") as f:
+        for key in list(range(nbin)) + ["2d"]:
+            for b in ["g", "r"]:
+                streamed = f[f"bin_{key}/{b}"][:]
+                assert np.allclose(np.sort(streamed), np.sort(full[key][b]))
+
+    stage.remove_temp_dir(tmp_dir)
+    if comm is not None:
+        comm.Barrier()
+    assert not os.path.exists(tmp_dir)
+
+
+def test_summarize_streaming_serial():
+    with tempfile.TemporaryDirectory() as dirname:
+        core_summarize_streaming(None, dirname)
+
+
+def test_summarize_streaming_parallel():
+    with tempfile.TemporaryDirectory() as dirname:
+        mockmpi.mock_mpiexec(2, core_summarize_streaming, dirname)
+
+
+def test_summarize_streaming_handoff():
+    # In streaming mode NZDir should be given the path of the bin file,
+    # and read it itself, rather than being given the data.
+    rail_core = pytest.importorskip("rail.core")
+
+    class FakeNZDir:
+        data_store = rail_core.DataStore()
+        config_options = {}
+
+        @classmethod
+        def make_stage(cls, name, **config):
+            stage = cls()
+            stage.config = config
+            return stage
+
+        def set_data(self, tag, handle):
+            self.handle = handle
+
+        def run(self):
+            pass
+
+    with tempfile.TemporaryDirectory() as dirname:
+        bin_file = os.path.join(dirname, "bins.hdf5")
+        with h5py.File(bin_file, "w") as f:
+            f["bin_0/g"] = np.arange(10.0)
+
+        stage = PZRailSummarize(
+            {
+                "photometry_catalog": "unused.hdf5",
+                "tomography_catalog": "unused.hdf5",
+                "model": "unused.pkl",
+                "config": None,
+                "tomography_name": "lens",
+                "chunk_rows": 100,
+            }
+        )
+        sub_config = {"usecols": ["g"], "hdf5_groupname": ""}
+        substage = stage.run_nzdir(FakeNZDir, sub_config, 0, None, bin_file)
+
+        assert substage.handle.path == bin_file
+        assert substage.handle.data is None
+        assert substage.config["hdf5_groupname"] == "bin_0"
+        assert substage.config["chunk_size"] == 100
@@ -0,0 +1,38 @@
+from ..randoms import (
+    counter_uniforms,
+    random_points_in_quadrilaterals,
+    random_points_in_healpix_pixels,
+)
+import numpy as np
+
+
+def test_counter_randoms():
+    # Values depend only on their counters, not on what else is generated
+    u = counter_uniforms(1234, 7, np.arange(100_000))
+    assert np.allclose(counter_uniforms(1234, 7, np.arange(50_000, 100_000)), u[50_000:])
+    assert not np.allclose(counter_uniforms(1235, 7, np.arange(10)), u[:10])
+    assert (u >= 0).all() and (u < 1).all()
+    assert abs(u.mean() - 0.5) < 0.01
+
+    # Two unit squares in the plane
+    vertices = np.zeros((2, 2, 4))
+    vertices[0] = [[0.0, 1.0, 1.0, 0.0], [0.0, 0.0, 1.0, 1.0]]
+    vertices[1] = vertices[0] + 5
+    p = random_points_in_quadrilaterals(vertices, [10, 10_000])
+    assert p.shape == (10_010, 2)
+    assert (p[:10] >= 0).all() and (p[:10] <= 1).all()
+    assert (p[10:] >= 5).all() and (p[10:] <= 6).all()
+    assert np.allclose(p[10:].mean(axis=0), 5.5, atol=0.02)
+
+
+def test_random_points_in_healpix_pixels():
+    import healpy
+
+    # Include pixels at the poles and the edges of the polar caps
+    for nest in [False, True]:
+        nside = 4
+        pixels = np.arange(healpy.nside2npix(nside))
+        counts = np.full(pixels.size, 50)
+        ra, dec = random_points_in_healpix_pixels(nside, pixels, counts, nest=nest)
+        hit = healpy.ang2pix(nside, ra, dec, lonlat=True, nest=nest)
+        assert np.all(hit == np.repeat(pixels, counts))
@@ -1,4 +1,4 @@
-from ..utils import Splitter, DynamicSplitter
+from ..utils import Splitter, DynamicSplitter, chunk_bin_offsets
 import numpy as np
 import tempfile
 import os
@@ -103,3 +103,130 @@ def test_dynamic_splitter():
             assert g[f"subset_{b}/x"].dtype == np.float64
             assert g[f"subset_{b}/y"].dtype == np.float64
             assert g[f"subset_{b}/z"].dtype == np.int32
+
+
+def test_splitter_chunk_offsets():
+    import h5py
+
+    cols = ["x"]
+    name = "subset"
+
+    # make fake data, including some objects in no bin
+    nbin = 4
+    n = 100
+    chunk_rows = 12
+    bins = np.random.randint(-1, nbin, n)
+    x = np.random.normal(size=n)
+    n_chunk = (n + chunk_rows - 1) // chunk_rows
+
+    counts = {b: (bins == b).sum() for b in range(nbin)}
+    counts["all"] = (bins >= 0).sum()
+
+    chunks = [(i, bins[i * chunk_rows : (i + 1) * chunk_rows]) for i in range(n_chunk)]
+    offsets = chunk_bin_offsets(chunks, nbin, n_chunk)
+    assert offsets.shape == (n_chunk, nbin + 1)
+    assert (offsets[0] == 0).all()
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "tmp.hdf5")
+
+        f = h5py.File(filename, "w")
+        g = f.create_group("ggg")
+        splitter = Splitter(g, name, cols, counts)
+
+        # Write the chunks in a scrambled order, as different
+        # processes would, using the offsets to place them
+        for i in np.random.permutation(n_chunk):
+            s = i * chunk_rows
+            e = s + chunk_rows
+            for j, b in enumerate(list(range(nbin)) + ["all"]):
+                if b == "all":
+                    w = np.where(bins[s:e] >= 0)
+                else:
+                    w = np.where(bins[s:e] == b)
+                splitter.write_bin({"x": x[s:e][w]}, b, start=offsets[i, j])
+        splitter.finish()
+
+        # The order should be the same as a serial split
+        for b in range(nbin):
+            assert np.allclose(g[f"subset_{b}/x"][:], x[bins == b])
+        assert np.allclose(g["subset_all/x"][:], x[bins >= 0])
+
+
+def test_buffered_splitter():
+    import h5py
+
+    cols = ["x", "z"]
+    dtypes = {"z": np.int32}
+    name = "subset"
+
+    nbin = 3
+    bins = np.random.randint(0, nbin, 1000)
+    x = np.random.normal(size=1000)
+    z = np.random.randint(0, 1000, size=1000)
+    counts = {b: (bins == b).sum() for b in range(nbin)}
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "tmp.hdf5")
+
+        f = h5py.File(filename, "w")
+        g = f.create_group("ggg")
+
+        # room for 20 rows of 12 bytes per bin
+        splitter = Splitter(g, name, cols, counts, dtypes=dtypes, buffer_bytes=720)
+        assert splitter.buffer_rows == 20
+
+        for i in range(100):
+            s = i * 10
+            e = s + 10
+            for b in range(nbin):
+                w = np.where(bins[s:e] == b)
+                data = {"x": x[s:e][w], "z": z[s:e][w]}
+                splitter.write_bin(data, b)
+                # we should never have more than the buffer size pending
+                assert splitter.buffer_count[b] <= splitter.buffer_rows
+
+        # flushes the remaining data
+        splitter.finish()
+
+        for b in range(nbin):
+            assert splitter.buffer_count[b] == 0
+            assert np.allclose(g[f"subset_{b}/x"][:], x[bins == b])
+            assert np.all(g[f"subset_{b}/z"][:] == z[bins == b])
+
+
+def test_buffered_dynamic_splitter_capacity():
+    import h5py
+
+    cols = ["x"]
+    name = "subset"
+
+    bins = np.random.randint(0, 2, 1000)
+    x = np.random.normal(size=1000)
+    counts = {b: 5 for b in range(2)}
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "tmp.hdf5")
+
+        f = h5py.File(filename, "w")
+        g = f.create_group("ggg")
+
+        splitter = DynamicSplitter(
+            g, name, cols, counts, buffer_bytes=1600, capacity=1000
+        )
+
+        for i in range(100):
+            s = i * 10
+            e = s + 10
+            for b in range(2):
+                w = np.where(bins[s:e] == b)
+                splitter.write_bin({"x": x[s:e][w]}, b)
+
+        # The first resize should have gone straight to the capacity
+        for b in range(2):
+            assert splitter.bin_sizes[b] == 1000
+        splitter.finish()
+
+        for b in range(2):
+            assert g[f"subset_{b}/x"].size == np.count_nonzero(bins == b)
+            assert np.allclose(g[f"subset_{b}/x"][:], x[bins == b])
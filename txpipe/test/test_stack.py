@@ -0,0 +1,43 @@
+from ..photoz_stack import Stack
+import numpy as np
+
+
+def test_add_pdfs():
+    nobj = 1000
+    nbin = 4
+    z = np.linspace(0.0, 2.0, 51)
+    bins = np.random.randint(-1, nbin, size=nobj)
+    pdfs = np.random.uniform(size=(nobj, z.size))
+    weights = np.random.uniform(size=nobj)
+
+    for dtype in [np.float64, np.float32]:
+        stack = Stack("test", z, nbin)
+        weighted = Stack("test", z, nbin)
+        stack.add_pdfs(bins, pdfs.astype(dtype))
+        weighted.add_pdfs(bins, pdfs.astype(dtype), weights)
+
+        for b in range(nbin):
+            w = bins == b
+            assert stack.counts[b] == w.sum()
+            assert np.allclose(stack.stack[b], pdfs[w].sum(axis=0), rtol=1e-5)
+            assert np.isclose(weighted.counts[b], weights[w].sum())
+            expected = (pdfs[w] * weights[w, np.newaxis]).sum(axis=0)
+            assert np.allclose(weighted.stack[b], expected, rtol=1e-5)
+
+
+def test_add_delta_function():
+    nobj = 10000
+    nbin = 3
+    z = np.linspace(0.0, 2.0, 41)
+    bins = np.random.randint(-1, nbin, size=nobj)
+    # include some objects outside the redshift range
+    redshift = np.random.uniform(-0.1, 2.1, size=nobj)
+
+    stack = Stack("test", z, nbin)
+    stack.add_delta_function(bins, redshift)
+
+    for b in range(nbin):
+        h, _ = np.histogram(redshift[bins == b], bins=z)
+        assert np.array_equal(stack.stack[b, :-1], h)
+        assert stack.stack[b, -1] == 0
+        assert stack.counts[b] == h.sum()
@@ -0,0 +1,73 @@
+from ..twopoint import TXTwoPoint
+import mockmpi
+import tempfile
+import h5py
+import os
+
+
+def core_patch_dir(comm, dirname):
+    cat_file = os.path.join(dirname, "binned_lens_catalog.hdf5")
+    ran_file = os.path.join(dirname, "binned_random_catalog.hdf5")
+    if comm is None or comm.rank == 0:
+        with h5py.File(cat_file, "w") as f:
+            f.create_group("provenance").attrs["uuid"] = "abc123"
+        # This one has no ID, so we fall back to the path and time
+        with h5py.File(ran_file, "w") as f:
+            f.create_group("randoms")
+    if comm is not None:
+        comm.Barrier()
+
+    # The other inputs don't exist, and aren't needed for this
+    inputs = {tag: os.path.join(dirname, tag) for tag in TXTwoPoint.input_tags()}
+    inputs["binned_lens_catalog"] = cat_file
+    inputs["binned_random_catalog"] = ran_file
+    stage = TXTwoPoint(
+        {
+            **inputs,
+            "config": None,
+            "patch_dir": os.path.join(dirname, "patches"),
+            "share_patch_files": True,
+        }
+    )
+    stage.setup_mpi(comm)
+
+    # The input IDs are read once, on the root process under MPI,
+    # and not again for each patch directory
+    opened = []
+    open_input = stage.open_input
+
+    def counting_open_input(tag, **kwargs):
+        opened.append(tag)
+        return open_input(tag, **kwargs)
+
+    stage.open_input = counting_open_input
+
+    d1 = stage.get_patch_dir("binned_lens_catalog", 1)
+    if comm is not None:
+        assert opened == []
+    opened.clear()
+
+    d2 = stage.get_patch_dir("binned_lens_catalog", 2)
+    assert stage.get_patch_dir("binned_lens_catalog", 1) is d1
+    assert d1.parent == d2.parent
+    assert d1.parent.name == "binned_lens_catalog_abc123"
+    assert d1.is_dir()
+
+    d3 = stage.get_patch_dir("binned_random_catalog", 1)
+    assert len(d3.parent.name) == len("binned_random_catalog_") + 16
+    assert opened == []
+
+    # Every process must use the same directories
+    if comm is not None:
+        names = comm.allgather(d3.parent.name)
+        assert all(name == names[0] for name in names)
+
+
+def test_patch_dir_serial():
+    with tempfile.TemporaryDirectory() as dirname:
+        core_patch_dir(None, dirname)
+
+
+def test_patch_dir_parallel():
+    with tempfile.TemporaryDirectory() as dirname:
+        mockmpi.mock_mpiexec(2, core_patch_dir, dirname)
@@ -1,5 +1,12 @@
-from ..utils.misc import unique_list, hex_escape
+from ..utils.misc import unique_list, hex_escape, prefetch_iterated, grouped_histogram
+from ..utils.checkpoint import Checkpointer
+from ..utils.column_cache import ColumnCache
+from ..utils import LensNumberDensityStats
+from ..base_stage import PipelineStage
 import numpy as np
+import mockmpi
+import tempfile
+import os
 
 
 def test_escape():
@@ -23,3 +30,352 @@ def test_unique_list():
 
     x = [-1, "cat", -1, "cat", "dog"]
     assert unique_list(x) == [-1, "cat", "dog"]
+
+
+def test_checkpoint():
+    with tempfile.TemporaryDirectory() as dirname:
+        output_path = os.path.join(dirname, "output.hdf5")
+        key = {"nprocess": 1, "config": "abc"}
+
+        # No checkpoint or output yet
+        checkpoint = Checkpointer(output_path, 2, key)
+        assert not checkpoint.resuming
+        stats = LensNumberDensityStats(3)
+        assert checkpoint.restore(stats=stats) == 0
+
+        # Saves after every two chunks
+        for end in [10, 20, 30]:
+            stats.add_data(np.array([0, 1, 1, -1, 2]))
+            checkpoint.completed(end)
+
+        # A new run resumes only once the output file exists
+        assert not Checkpointer(output_path, 2, key).resuming
+        open(output_path, "w").close()
+
+        checkpoint = Checkpointer(output_path, 2, key)
+        assert checkpoint.resuming
+        stats2 = LensNumberDensityStats(3)
+        assert checkpoint.restore(stats=stats2) == 20
+        assert np.allclose(stats2.lens_counts, [2, 4, 2])
+        assert stats2.lens_counts_2d == 8
+
+        # A different set-up does not resume
+        assert not Checkpointer(output_path, 2, {"nprocess": 2}).resuming
+
+        checkpoint.finish()
+        assert not Checkpointer(output_path, 2, key).resuming
+
+
+class FakeOutputFile:
+    def __init__(self):
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+def core_checkpoint_parallel(comm, dirname):
+    output_path = os.path.join(dirname, "output.hdf5")
+    key = {"nprocess": comm.size}
+
+    # Seven chunks over three processes: rank 0 gets three, the others two
+    n_chunks = 7
+    my_chunks = list(range(comm.rank, n_chunks, comm.size))
+
+    try:
+        Checkpointer(output_path, 1, key, rank=comm.rank, comm=comm)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("n_chunks should be needed under MPI")
+
+    checkpoint = Checkpointer(
+        output_path, 1, key, rank=comm.rank, comm=comm, n_chunks=n_chunks
+    )
+    assert not checkpoint.resuming
+    stats = LensNumberDensityStats(3)
+    checkpoint.restore(stats=stats)
+
+    # Everyone flushes and saves after the first two chunks, and nobody
+    # saves after the third, which only rank 0 has.
+    output_file = FakeOutputFile()
+    for i in my_chunks:
+        stats.add_data(np.array([0, 1, 2]))
+        checkpoint.completed((i + 1) * 10, output_file)
+    assert output_file.flushes == 2
+
+    if comm.rank == 0:
+        open(output_path, "w").close()
+    comm.Barrier()
+
+    checkpoint = Checkpointer(
+        output_path, 1, key, rank=comm.rank, comm=comm, n_chunks=n_chunks
+    )
+    assert checkpoint.resuming
+    stats2 = LensNumberDensityStats(3)
+    assert checkpoint.restore(stats=stats2) == (my_chunks[1] + 1) * 10
+    assert np.allclose(stats2.lens_counts, [2, 2, 2])
+
+    # If one process has a later checkpoint then nobody resumes
+    if comm.rank == 1:
+        checkpoint.chunks_done += 1
+        checkpoint.save(70)
+    comm.Barrier()
+    checkpoint = Checkpointer(
+        output_path, 1, key, rank=comm.rank, comm=comm, n_chunks=n_chunks
+    )
+    assert not checkpoint.resuming
+
+
+def test_checkpoint_parallel():
+    with tempfile.TemporaryDirectory() as dirname:
+        mockmpi.mock_mpiexec(3, core_checkpoint_parallel, dirname)
+
+
+def test_prefetch_iterated():
+    # items come out in order, whatever the depth
+    for depth in [0, 1, 3, 100]:
+        assert list(prefetch_iterated(iter(range(20)), depth)) == list(range(20))
+
+    # errors in the iterator get to the caller
+    def broken():
+        yield 1
+        raise ValueError("broken")
+
+    it = prefetch_iterated(broken(), 2)
+    assert next(it) == 1
+    try:
+        next(it)
+    except ValueError as error:
+        assert str(error) == "broken"
+    else:
+        raise AssertionError("error not raised")
+
+    # stopping early should not leave the reader thread hanging,
+    # and should close the wrapped generator
+    closed = []
+
+    def numbers():
+        try:
+            yield from range(1000)
+        finally:
+            closed.append(True)
+
+    for depth in [0, 2]:
+        closed.clear()
+        it = prefetch_iterated(numbers(), depth)
+        assert next(it) == 0
+        it.close()
+        assert closed == [True]
+        assert it.thread is None or not it.thread.is_alive()
+        assert list(it) == []
+
+    # including if the thread was never started
+    it = prefetch_iterated(iter(range(10)), 2)
+    it.close()
+    assert it.thread is None
+
+
+def test_column_cache():
+    import h5py
+
+    with tempfile.TemporaryDirectory() as dirname:
+        x = np.arange(1000, dtype=np.float64)
+        y = np.arange(1000, dtype=np.int32)
+        with h5py.File(f"{dirname}/cat.hdf5", "w") as f:
+            f["cat/x"] = x
+            f["cat/y"] = y
+
+        # room for only one of the two columns
+        cache = ColumnCache(f"{dirname}/cache", 9000)
+        with h5py.File(f"{dirname}/cat.hdf5", "r") as f:
+            cx = cache.column("abc", "cat", "x", f["cat/x"], block_rows=300)
+            assert np.array_equal(cx, x)
+            assert os.path.exists(cache.path("abc", "cat", "x"))
+
+            # adding y should evict x
+            cy = cache.column("abc", "cat", "y", f["cat/y"])
+            assert np.array_equal(cy, y)
+            assert cy.dtype == y.dtype
+            assert not os.path.exists(cache.path("abc", "cat", "x"))
+
+            # but the existing map of it still works
+            assert np.array_equal(cx[10:20], x[10:20])
+
+        # once cached we don't need the file any more
+        cy = cache.column("abc", "cat", "y", None)
+        assert np.array_equal(cy, y)
+
+
+def core_column_cache(comm, dirname):
+    import h5py
+
+    cache = ColumnCache(f"{dirname}/cache", 100_000, comm=comm)
+
+    # Only the root process should copy columns into the cache
+    if comm.rank > 0:
+
+        def export(*args):
+            raise AssertionError("Column exported by non-root process")
+
+        cache.export = export
+
+    with h5py.File(f"{dirname}/cat.hdf5", "r") as f:
+        cx = cache.column("abc", "cat", "x", f["cat/x"])
+        cy = cache.column("abc", "cat", "y", f["cat/y"])
+    assert np.array_equal(cx, np.arange(1000))
+    assert np.array_equal(cy, np.arange(1000))
+
+
+def test_column_cache_parallel():
+    import h5py
+
+    with tempfile.TemporaryDirectory() as dirname:
+        with h5py.File(f"{dirname}/cat.hdf5", "w") as f:
+            f["cat/x"] = np.arange(1000, dtype=np.float64)
+            f["cat/y"] = np.arange(1000, dtype=np.int32)
+        mockmpi.mock_mpiexec(3, core_column_cache, dirname)
+
+
+def test_create_catalog_dataset():
+    import h5py
+    from ..utils.hdf_tools import create_catalog_dataset
+
+    with tempfile.TemporaryDirectory() as dirname:
+        with h5py.File(f"{dirname}/cat.hdf5", "w") as f:
+            d = create_catalog_dataset(f, "x", 1000, "f8", chunk_rows=300)
+            assert d.chunks == (300,)
+            assert d.dtype == np.float64
+            assert d.compression is None
+
+            # chunks can't be bigger than the data
+            d = create_catalog_dataset(f, "R", (100, 2, 2), "f4", chunk_rows=300)
+            assert d.chunks == (100, 2, 2)
+
+            d = create_catalog_dataset(
+                f, "mag", 1000, "f8", compression="gzip:6", downcast=True
+            )
+            assert d.dtype == np.float32
+            assert d.compression == "gzip"
+            assert d.compression_opts == 6
+            assert d.shuffle
+
+            # integers are never downcast
+            d = create_catalog_dataset(f, "id", 1000, "i8", compression="lzf", downcast=True)
+            assert d.dtype == np.int64
+            assert d.compression == "lzf"
+
+
+def test_stage_registry():
+    import txpipe
+    import ceci
+
+    # Looking up a stage should import its module on demand
+    stage = ceci.PipelineStage.get_stage("TXRandomCat")
+    assert stage.__module__ == "txpipe.random_cats"
+    assert txpipe.TXRandomCat is stage
+
+    # Every stage that TXPipe defines should be listed in the registry,
+    # with the right module, so it can be found without importing everything.
+    # The stages made in the tests themselves don't need to be.
+    txpipe.load_all_stages()
+    for name, (cls, _) in ceci.PipelineStage.pipeline_stages.items():
+        module = cls.__module__
+        if not module.startswith("txpipe.") or module.startswith("txpipe.test."):
+            continue
+        if name == PipelineStage.name:
+            continue
+        assert txpipe.STAGE_MODULES[name] == cls.__module__[len("txpipe") :]
+
+
+def test_parse_import_times():
+    from ..utils.timer import parse_import_times
+
+    text = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      1500 |       2000 | txpipe
+"""
+    timings = parse_import_times(text)
+    assert timings == [("_io", 120, 120), ("txpipe", 1500, 2000)]
+
+
+def test_grouped_histogram():
+    edges = np.linspace(0.0, 1.0, 11)
+    values = np.random.uniform(-0.2, 1.2, size=1000)
+    values[:3] = [0.0, 1.0, 0.5]
+    groups = np.random.randint(0, 4, size=1000)
+    weights = np.random.uniform(size=1000)
+
+    counts = grouped_histogram(values, groups, 4, edges)
+    weighted = grouped_histogram(values, groups, 4, edges, weights=weights)
+    for g in range(4):
+        w = groups == g
+        expected, _ = np.histogram(values[w], bins=edges)
+        assert np.all(counts[g] == expected)
+        expected, _ = np.histogram(values[w], bins=edges, weights=weights[w])
+        assert np.allclose(weighted[g], expected)
+
+
+def load_h5show():
+    import importlib.util
+
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "bin", "h5show.py")
+    spec = importlib.util.spec_from_file_location("h5show", path)
+    h5show = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(h5show)
+    return h5show
+
+
+def test_h5show_layout():
+    import h5py
+
+    h5show = load_h5show()
+    n = 10_000
+    c = 1000
+
+    with tempfile.TemporaryDirectory() as dirname:
+        with h5py.File(f"{dirname}/cat.hdf5", "w") as f:
+            f.create_dataset(
+                "chunked",
+                data=np.zeros(n),
+                chunks=(c,),
+                compression="gzip",
+                compression_opts=4,
+                shuffle=True,
+            )
+            f["contiguous"] = np.arange(n, dtype=np.float64)
+
+        with h5py.File(f"{dirname}/cat.hdf5", "r") as f:
+            chunked = f["chunked"]
+            contiguous = f["contiguous"]
+
+            text = h5show.describe_layout(chunked)
+            assert text.startswith("chunks=(1000,) gzip(4)+shuffle logical=78.1 KB")
+            # zeros compress very well
+            ratio = float(text.split("ratio=")[1])
+            assert ratio > 10
+
+            text = h5show.describe_layout(contiguous)
+            assert text == (
+                "contiguous uncompressed logical=78.1 KB stored=78.1 KB ratio=1.00"
+            )
+            assert h5show.chunks_per_read(contiguous, 1000) is None
+
+            for chunk_rows in [500, 700, 1000, 1500, 2000, 2500, 3000]:
+                # The most chunks touched by any block, worked out directly
+                expected = max(
+                    (min(s + chunk_rows, n) - 1) // c - s // c + 1
+                    for s in range(0, n, chunk_rows)
+                )
+                assert h5show.chunks_per_read(chunked, chunk_rows) == expected
+
+            # aligned reads touch the fewest chunks, misaligned ones one more
+            assert h5show.chunks_per_read(chunked, 1000) == 1
+            assert h5show.chunks_per_read(chunked, 2000) == 2
+            assert h5show.chunks_per_read(chunked, 1500) == 2
+            assert h5show.chunks_per_read(chunked, 2500) == 3
+
+            # only up to max_chunks blocks are read
+            rate, nbytes = h5show.benchmark_read(contiguous, 1000, 3)
+            assert rate > 0
+            assert nbytes == 3 * 1000 * 8
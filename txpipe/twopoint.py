@@ -12,6 +12,7 @@ import collections
 import sys
 import os
 import pathlib
+import hashlib
 from time import perf_counter
 import gc
 from .utils import choose_pixelization
@@ -74,6 +75,9 @@ class TXTwoPoint(PipelineStage):
         "metric": "Euclidean",
     }
 
+    # Cache of the patch directories made for each input and bin
+    _patch_dirs = None
+
     def run(self):
         """
         Run the analysis for this stage.
@@ -570,6 +574,28 @@ class TXTwoPoint(PipelineStage):
         if self.comm is not None:
             self.comm.Barrier()
 
+    def get_input_identifier(self, input_tag):
+        """
+        Get a unique ID for an input file, from its provenance or
+        failing that its path and creation time.
+
+        This uses the input provenance that the stage collects once,
+        on the root process under MPI, rather than re-opening the file.
+        """
+        if self._cached_provenance is None:
+            self._cached_provenance = self._input_and_git_provenance()
+        uuid = self._cached_provenance[f"input/{input_tag}"]
+
+        # We expect the input files to be generated within a pipeline and so always
+        # have input files to have a unique ID.  But if for some reason it doesn't
+        # have one we handle that too. The built-in hash is salted differently
+        # in each process, so we use hashlib to get the same name on all of them.
+        if uuid == "UNKNOWN":
+            pth = pathlib.Path(self.get_input(input_tag)).resolve()
+            ctime = os.stat(pth).st_ctime
+            return hashlib.md5(f"{pth}{ctime}".encode()).hexdigest()[:16]
+        return uuid
+
     def get_patch_dir(self, input_tag, b):
         """
         Select a patch directory for the file  with the given input tag
@@ -578,6 +604,8 @@ class TXTwoPoint(PipelineStage):
         To ensure that if you change the catalog the patch dir will also
         change, the directory path includes the unique ID of the input file.
 
+        Directories are cached, so this is cheap to call repeatedly.
+
         Parameters
         ----------
         input_tag: str
@@ -590,24 +618,18 @@ class TXTwoPoint(PipelineStage):
         -------
         str: a directory, which has been created if it did not exist already.
         """
+        if self._patch_dirs is None:
+            self._patch_dirs = {}
+
+        key = (input_tag, str(b))
+        patch_dir = self._patch_dirs.get(key)
+        if patch_dir is not None:
+            return patch_dir
+
         # start from a user-specified base directory
         patch_base = self.config["patch_dir"]
 
-        # append the unique identifier for the parent catalog file
-        with self.open_input(input_tag, wrapper=True) as f:
-            p = f.read_provenance()
-            uuid = p["uuid"]
-            pth = pathlib.Path(f.path).resolve()
-            ctime = os.stat(pth).st_ctime
-
-        # We expect the input files to be generated within a pipeline and so always
-        # have input files to have a unique ID.  But if for some reason it doesn't
-        # have one we handle that too.
-        if uuid == "UNKNOWN":
-            ident = hash(f"{pth}{ctime}").to_bytes(8, "big", signed=True).hex()
-            name = f"{input_tag}_{ident}"
-        else:
-            name = f"{input_tag}_{uuid}"
+        name = f"{input_tag}_{self.get_input_identifier(input_tag)}"
 
         # Include a tag for the current stage name, so that
         # if we are running several subclasses at the same time
@@ -621,6 +643,7 @@ class TXTwoPoint(PipelineStage):
 
         # Make the directory and return it
         pathlib.Path(patch_dir).mkdir(exist_ok=True, parents=True)
+        self._patch_dirs[key] = patch_dir
         return patch_dir
 
     def get_shear_catalog(self, i):
@@ -32,6 +32,7 @@ class TXStarCatalogSplitter(PipelineStage):
     config_options = {
         "chunk_rows": 100_000,
         "initial_size": 100_000,
+        "buffer_bytes": 100_000_000,
     }
 
     def run(self):
@@ -49,7 +50,19 @@ class TXStarCatalogSplitter(PipelineStage):
             "dim": self.config["initial_size"],
         }
 
-        splitter = DynamicSplitter(group, "bin", cols, bins)
+        # Neither bin can be bigger than the complete catalog, so
+        # we use that as the size to expand to if we need to.
+        with self.open_input("star_catalog") as f:
+            capacity = f["stars/ra"].size
+
+        splitter = DynamicSplitter(
+            group,
+            "bin",
+            cols,
+            bins,
+            buffer_bytes=self.config["buffer_bytes"],
+            capacity=capacity,
+        )
 
         # Also read the r band mag.  We don't save it as we don't
         # need it later (?) but we do use it for the split
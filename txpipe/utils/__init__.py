@@ -1,8 +1,15 @@
 from .pixel_schemes import choose_pixelization, HealpixScheme, GnomonicPixelScheme
 from .number_density_stats import SourceNumberDensityStats, LensNumberDensityStats
-from .misc import array_hash, unique_list, hex_escape, rename_iterated
+from .misc import (
+    array_hash,
+    unique_list,
+    hex_escape,
+    rename_iterated,
+    prefetch_iterated,
+    grouped_histogram,
+)
 from .healpix import dilated_healpix_map
-from .splitters import Splitter, DynamicSplitter
+from .splitters import Splitter, DynamicSplitter, chunk_bin_offsets
 from .calibrators import (
     Calibrator,
     NullCalibrator,
@@ -198,30 +198,56 @@ class MetacalCalculator:
             Keyword arguments to be passed to the selection function
 
         """
-        # These all wrap the catalog such that lookups find the variant
-        # column if available.
+        selections = self.select_variants(data, *args, **kwargs)
+        self.add_selections(data, selections)
+
+        # The user of this class may need the base selection, so return it
+        return selections[0]
+
+    def select_variants(self, data, *args, **kwargs):
+        """Select objects from a chunk of data under the baseline and each
+        of the sheared variants, without tallying their responses.
+
+        Parameters
+        ----------
+        data: dict
+            Dictionary of data columns to select on
+        *args
+            Positional arguments to be passed to the selection function
+        **kwargs
+            Keyword arguments to be passed to the selection function
+
+        Returns
+        -------
+        selections: tuple
+            The selections for the 00, 1p, 1m, 2p, and 2m variants
+        """
+        # Each selection is made on the catalog wrapped such that lookups
+        # find the variant column if available.
         # For example, if I look up data_1p["x"] then it will check if
         # data["x_1p"] exists and return that if so.  Otherwise it will
-        # fall back to "x"
-        data_00 = _DataWrapper(data, "")
-        data_1p = _DataWrapper(data, "_1p")
-        data_1m = _DataWrapper(data, "_1m")
-        data_2p = _DataWrapper(data, "_2p")
-        data_2m = _DataWrapper(data, "_2m")
-
-        # These are the selections from this chunk of data
-        # that we would make under different shears, the baseline
-        # and all the others.  self.selector is a function that the user
+        # fall back to "x".  self.selector is a function that the user
         # supplied in init, not a method
-        sel_00 = self.selector(data_00, *args, **kwargs)
-        sel_1p = self.selector(data_1p, *args, **kwargs)
-        sel_1m = self.selector(data_1m, *args, **kwargs)
-        sel_2p = self.selector(data_2p, *args, **kwargs)
-        sel_2m = self.selector(data_2m, *args, **kwargs)
-
-        g1 = data_00["mcal_g1"]
-        g2 = data_00["mcal_g2"]
-        weight = data_00["weight"]
+        return tuple(
+            self.selector(_DataWrapper(data, suffix), *args, **kwargs)
+            for suffix in ["", "_1p", "_1m", "_2p", "_2m"]
+        )
+
+    def add_selections(self, data, selections):
+        """Tally the responses of objects selected with select_variants
+
+        Parameters
+        ----------
+        data: dict
+            Dictionary of data columns, as passed to select_variants
+        selections: tuple
+            The selections for the 00, 1p, 1m, 2p, and 2m variants
+        """
+        sel_00, sel_1p, sel_1m, sel_2p, sel_2m = selections
+
+        g1 = data["mcal_g1"]
+        g2 = data["mcal_g2"]
+        weight = data["weight"]
         n = g1[sel_00].size
 
         # Record the count for this chunk, for summation later
@@ -231,10 +257,7 @@ class MetacalCalculator:
         # We have four components, and want the weighted mean of each, which we use
         # the ParallelMean class to get
         w00 = weight[sel_00]
-        R00 = data_1p["mcal_g1"][sel_00] - data_1m["mcal_g1"][sel_00]
-        R01 = data_2p["mcal_g1"][sel_00] - data_2m["mcal_g1"][sel_00]
-        R10 = data_1p["mcal_g2"][sel_00] - data_1m["mcal_g2"][sel_00]
-        R11 = data_2p["mcal_g2"][sel_00] - data_2m["mcal_g2"][sel_00]
+        R00, R01, R10, R11 = self.estimator_response(data, sel_00)
 
         # TODO: if there is a weight per variant would we use that here?
         # Not currently used though.
@@ -260,8 +283,18 @@ class MetacalCalculator:
         self.sel_bias_means.add_data(6, g2[sel_2p], weight[sel_2p])
         self.sel_bias_means.add_data(7, g2[sel_2m], weight[sel_2m])
 
-        # The user of this class may need the base selection, so return it
-        return sel_00
+    def estimator_response(self, data, sel):
+        # The differences between the shears measured on the
+        # sheared variants, not yet divided by delta_gamma
+        data_1p = _DataWrapper(data, "_1p")
+        data_1m = _DataWrapper(data, "_1m")
+        data_2p = _DataWrapper(data, "_2p")
+        data_2m = _DataWrapper(data, "_2m")
+        R00 = data_1p["mcal_g1"][sel] - data_1m["mcal_g1"][sel]
+        R01 = data_2p["mcal_g1"][sel] - data_2m["mcal_g1"][sel]
+        R10 = data_1p["mcal_g2"][sel] - data_1m["mcal_g2"][sel]
+        R11 = data_2p["mcal_g2"][sel] - data_2m["mcal_g2"][sel]
+        return R00, R01, R10, R11
 
     def collect(self, comm=None, allgather=False):
         """
@@ -314,6 +347,50 @@ class MetacalCalculator:
         return R_mean, S_mean, count
 
 
+class MetacalColumnCalculator(MetacalCalculator):
+    """
+    A version of the MetacalCalculator that takes the estimator response
+    from the per-object R_gamma column written by the source selector,
+    instead of from the sheared variants of the mcal_g1 and mcal_g2 columns.
+
+    When its response_columns option is set, the metacal source selector
+    also writes the tomographic bin each object would be in under each
+    sheared variant, as source_bin_1p, etc.  If variant_bins is set and these
+    are in the data then a selection function that cuts on source_bin uses
+    them for the variants, so the selection response includes the tomographic
+    selection.  Otherwise they are ignored, and a cut on source_bin is the
+    same for every variant, as it is for the MetacalCalculator.
+
+    Stages downstream of the selector can use this to avoid reading
+    the eight sheared shear columns.
+    """
+
+    def __init__(self, selector, delta_gamma, variant_bins=False):
+        """
+        Parameters
+        ----------
+        selector: function
+            Function that selects objects
+        delta_gamma: float
+            The difference in applied g between 1p and 1m metacal variants
+        variant_bins: bool
+            Whether to use the source_bin_1p etc. columns for the variants
+        """
+        super().__init__(selector, delta_gamma)
+        self.variant_bins = variant_bins
+
+    def select_variants(self, data, *args, **kwargs):
+        if not self.variant_bins:
+            data = {k: v for k, v in data.items() if not k.startswith("source_bin_")}
+        return super().select_variants(data, *args, **kwargs)
+
+    def estimator_response(self, data, sel):
+        # The saved response is already divided by delta_gamma, but the collect
+        # method expects the raw differences, as in the parent class.
+        R = data["R_gamma"][sel] * self.delta_gamma
+        return R[:, 0, 0], R[:, 0, 1], R[:, 1, 0], R[:, 1, 1]
+
+
 class MetaDetectCalculator:
     """ """
 
@@ -652,6 +729,7 @@ class MeanShearInBins:
         delta_gamma,
         cut_source_bin=False,
         shear_catalog_type="metacal",
+        response_columns=False,
     ):
         self.x_name = x_name
         self.limits = limits
@@ -666,8 +744,11 @@ class MeanShearInBins:
         self.x = ParallelMean(self.size)
 
         if shear_catalog_type == "metacal":
+            # Use the per-object responses from the tomography catalog, if
+            # they are in the data, instead of the sheared shear columns
+            calc = MetacalColumnCalculator if response_columns else MetacalCalculator
             self.calibrators = [
-                MetacalCalculator(self.selector, delta_gamma) for i in range(self.size)
+                calc(self.selector, delta_gamma) for i in range(self.size)
             ]
         elif shear_catalog_type == "metadetect":
             self.calibrators = [
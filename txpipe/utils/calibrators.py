@@ -2,6 +2,39 @@ import numpy as np
 import warnings
 
 
+def _check_stacked_shear(g):
+    # The in-place methods below need a single stacked float array
+    # so that they can overwrite it.
+    if g.ndim != 2 or g.shape[0] != 2:
+        raise ValueError(f"Stacked shears should have shape (2, n), not {g.shape}")
+    if g.dtype.kind != "f":
+        raise TypeError(f"Stacked shears must be float32 or float64, not {g.dtype}")
+
+
+def _matmul_inplace(M, g, block_size=1_000_000):
+    """
+    Multiply a stacked (2, n) shear array by a 2x2 matrix in place.
+
+    numpy copies the input to a temporary array when the input and output
+    of matmul overlap, so we go through in blocks to limit how much extra
+    memory that uses.
+
+    Parameters
+    ----------
+    M: array
+        2x2 matrix
+    g: array
+        Shape (2, n) float array, overwritten with M @ g
+    block_size: int
+        Number of objects to multiply at once
+    """
+    M = np.asarray(M, dtype=g.dtype)
+    n = g.shape[1]
+    for s in range(0, n, block_size):
+        e = min(s + block_size, n)
+        np.matmul(M, g[:, s:e], out=g[:, s:e])
+
+
 class Calibrator:
     """
     Base class for classes which calibrate shear measurements.
@@ -18,6 +51,9 @@ class Calibrator:
     def apply(self, g1, g2):
         raise NotImplementedError("Use a subclass of Calibrator not the base")
 
+    def apply_inplace(self, g):
+        raise NotImplementedError("Use a subclass of Calibrator not the base")
+
     @classmethod
     def load(cls, tomo_file, null=False):
         """
@@ -106,6 +142,33 @@ class NullCalibrator:
             # we return copies here
             return g1.copy(), g2.copy()
 
+    def apply_inplace(self, g, subtract_mean=False):
+        """
+        "Calibrate" a stacked array of shears in place.
+
+        As this is a null calibrator this does nothing unless
+        the mean is to be subtracted.
+
+        Parameters
+        ----------
+        g: array
+            Shape (2, n) float32 or float64 array of the two shear components.
+            Overwritten with the calibrated values.
+
+        subtract_mean: bool
+            whether to subtract mean shear (default False)
+
+        Returns
+        -------
+        g: array
+            The same array
+        """
+        _check_stacked_shear(g)
+        if subtract_mean:
+            g[0] -= self.mu1
+            g[1] -= self.mu2
+        return g
+
     @classmethod
     def load(cls, tomo_file):
         """
@@ -180,6 +243,35 @@ class MetaCalibrator(Calibrator):
             g1, g2 = self.Rinv @ [g1, g2] - self.mu[:, np.newaxis]
         return g1, g2
 
+    def apply_inplace(self, g, subtract_mean=True):
+        """
+        Calibrate a stacked array of shears in place using the
+        response matrix and mean shear subtraction.
+
+        This avoids making any copies of the full array, so
+        uses much less memory than the apply method.
+
+        Parameters
+        ----------
+        g: array
+            Shape (2, n) float32 or float64 array of the two shear components.
+            Overwritten with the calibrated values.
+
+        subtract_mean: bool
+            whether to subtract mean shear (default True)
+
+        Returns
+        -------
+        g: array
+            The same array
+        """
+        _check_stacked_shear(g)
+        _matmul_inplace(self.Rinv, g)
+        if subtract_mean:
+            g[0] -= self.mu[0]
+            g[1] -= self.mu[1]
+        return g
+
     @classmethod
     def load(cls, tomo_file):
         """
@@ -374,6 +466,33 @@ class LensfitCalibrator(Calibrator):
             g2 = g2 / (1 + self.K)
         return g1, g2
 
+    def apply_inplace(self, g, subtract_mean=True):
+        """
+        Calibrate a stacked array of shears in place.
+
+        See the apply method for details.
+
+        Parameters
+        ----------
+        g: array
+            Shape (2, n) float32 or float64 array of the two shear components.
+            Overwritten with the calibrated values.
+
+        subtract_mean: bool
+            whether to subtract the constant c term (default True)
+
+        Returns
+        -------
+        g: array
+            The same array
+        """
+        _check_stacked_shear(g)
+        if subtract_mean:
+            g[0] -= self.c[0]
+            g[1] -= self.c[1]
+        g /= 1 + self.K
+        return g
+
 
 class HSCCalibrator(Calibrator):
     def __init__(self, R, K):
@@ -448,3 +567,33 @@ class HSCCalibrator(Calibrator):
         g1 = (g1 / (2 * self.R) - c1) / (1 + self.K)
         g2 = (g2 / (2 * self.R) - c2) / (1 + self.K)
         return g1, g2
+
+    def apply_inplace(self, g, c1, c2):
+        """
+        Calibrate a stacked array of shears in place.
+
+        See the apply method for details.
+
+        Parameters
+        ----------
+        g: array
+            Shape (2, n) float32 or float64 array of the two shear components.
+            Overwritten with the calibrated values.
+
+        c1: array or float
+            Shear 1 additive bias component
+
+        c2: array or float
+            Shear 2 additive bias component
+
+        Returns
+        -------
+        g: array
+            The same array
+        """
+        _check_stacked_shear(g)
+        g /= 2 * self.R
+        g[0] -= c1
+        g[1] -= c2
+        g /= 1 + self.K
+        return g
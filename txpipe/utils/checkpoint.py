@@ -0,0 +1,213 @@
+import os
+import pickle
+
+
+def _get_state(obj):
+    # Lists of objects, like the per-bin calculators, are saved item by item
+    if isinstance(obj, (list, tuple)):
+        return [_get_state(x) for x in obj]
+
+    # We don't save functions, like the selection functions, or the
+    # communicator, since these are set up fresh in each run anyway.
+    return {
+        key: value
+        for key, value in obj.__dict__.items()
+        if key != "comm" and not callable(value)
+    }
+
+
+def _set_state(obj, state):
+    if isinstance(obj, (list, tuple)):
+        if len(obj) != len(state):
+            raise ValueError("Checkpoint has a different number of objects to this run")
+        for x, s in zip(obj, state):
+            _set_state(x, s)
+    else:
+        obj.__dict__.update(state)
+
+
+class Checkpointer:
+    """
+    Save and restore the progress of a long loop over chunks of data.
+
+    This is designed for the stages that stream through very large
+    catalogs and accumulate statistics as they go, so that if they are
+    killed (e.g. by a wall-clock limit) they can pick up from where they
+    left off instead of starting again from the first row.
+
+    Each process saves its own file, containing the state of the accumulator
+    objects it is using (calculators, number density stats, etc.) and the end of
+    the last chunk it completed.  Attributes of those objects that are functions
+    (like the selection functions) or an MPI communicator are not saved, and
+    are kept from the new objects made in the restarted run.
+
+    Since chunks are assigned to processes in turn, resuming needs
+    the same number of processes and chunk size. This and the rest of the
+    configuration is checked before resuming, and if they don't match we
+    start from scratch.
+
+    Under MPI the output file has to be flushed before a checkpoint is saved,
+    since HDF5 only writes its metadata to disc then, and flushing a parallel
+    file is collective.  So the processes save together, after the same number of
+    chunks, and only for chunks that every process has; this needs the total
+    number of chunks, n_chunks.  We only resume if every process saved at the
+    same point.
+
+    The lifecycle is:
+    1. make the checkpointer, and check the resuming attribute to see if
+       the output file should be re-opened or made from scratch
+    2. make the accumulators, and pass them to restore, which gives the row
+       to restart from
+    3. call completed at the end of each chunk
+    4. call finish once the loop is done
+    """
+
+    def __init__(self, output_path, interval, key, rank=0, comm=None, n_chunks=None):
+        """
+        Parameters
+        ----------
+        output_path: str
+            The (in-progress) path of the main output file; checkpoint files
+            are put next to it
+        interval: int
+            Number of chunks between saves
+        key: dict
+            Information that must match for the checkpoint to be used, e.g.
+            the configuration and number of processes
+        rank: int
+            This process's rank
+        comm: MPI communicator or None
+            Used to make sure all processes agree whether to resume, and
+            to save at the same time
+        n_chunks: int or None
+            The total number of chunks in the loop, over all processes.
+            Required if comm is set.
+        """
+        if (comm is not None) and (n_chunks is None):
+            raise ValueError("Checkpointing under MPI needs the number of chunks")
+
+        self.output_path = output_path
+        self.filename = f"{output_path}.checkpoint.{rank}"
+        self.interval = interval
+        self.key = key
+        self.comm = comm
+        self.objects = {}
+        self.chunks_done = 0
+        self.saved = None
+
+        # Chunks are dealt out to processes in turn, so this many
+        # are done by all of them
+        if comm is not None:
+            self.shared_chunks = n_chunks // comm.size
+
+        # We can use our checkpoint if it exists and was made with the same
+        # set-up as this run. Otherwise we start afresh.
+        chunks_saved = None
+        if os.path.exists(self.filename):
+            with open(self.filename, "rb") as f:
+                saved = pickle.load(f)
+            if saved["key"] == key:
+                self.saved = saved
+                chunks_saved = saved.get("chunks_done")
+            else:
+                print(f"Ignoring checkpoint {self.filename} from a different set-up")
+
+        # The processes save together, but if the job was stopped while
+        # they were doing so then some may have a later checkpoint than others.
+        # We only resume if everyone agrees where to resume from.
+        if comm is None:
+            chunks_saved = [chunks_saved]
+        else:
+            chunks_saved = comm.allgather(chunks_saved)
+
+        self.resuming = (
+            (chunks_saved[0] is not None)
+            and all(c == chunks_saved[0] for c in chunks_saved)
+            and os.path.exists(output_path)
+        )
+
+        if not self.resuming:
+            self.saved = None
+
+    def restore(self, **objects):
+        """
+        Record the accumulator objects to save, and if resuming then
+        restore their state from the checkpoint.
+
+        Parameters
+        ----------
+        **objects
+            The accumulator objects, or lists of them, by name
+
+        Returns
+        -------
+        resume_row: int
+            The end of the last chunk this process completed in the
+            earlier run, or zero.
+        """
+        self.objects = objects
+
+        if self.saved is None:
+            return 0
+
+        for name, obj in objects.items():
+            _set_state(obj, self.saved["state"][name])
+
+        self.chunks_done = self.saved["chunks_done"]
+        resume_row = self.saved["resume_row"]
+        print(f"Resuming from checkpoint {self.filename} at row {resume_row:,}")
+        self.saved = None
+        return resume_row
+
+    def completed(self, end, output_file=None):
+        """
+        Tell the checkpointer that a chunk is complete, and save if
+        enough chunks have been done since the last save.
+
+        Parameters
+        ----------
+        end: int
+            The end row of the completed chunk
+        output_file: h5py.File or None
+            If set, this is flushed before the checkpoint is saved, so that
+            the written chunks are on disc.
+        """
+        self.chunks_done += 1
+        if self.chunks_done % self.interval:
+            return
+
+        if self.comm is not None:
+            # Every process must get here together, for the collective flush
+            if self.chunks_done > self.shared_chunks:
+                return
+            if output_file is not None:
+                output_file.flush()
+            # Don't save until everything is on disc
+            self.comm.Barrier()
+        elif output_file is not None:
+            output_file.flush()
+
+        self.save(end)
+
+    def save(self, end):
+        state = {name: _get_state(obj) for name, obj in self.objects.items()}
+        info = {
+            "key": self.key,
+            "resume_row": end,
+            "chunks_done": self.chunks_done,
+            "state": state,
+        }
+
+        # Write to a temporary file first, so that we never leave a broken
+        # checkpoint file if we are killed during this
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(info, f)
+        os.replace(tmp, self.filename)
+
+    def finish(self):
+        """
+        Remove the checkpoint file, once the loop is complete
+        """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
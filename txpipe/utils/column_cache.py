@@ -0,0 +1,153 @@
+import os
+import numpy as np
+
+
+class ColumnCache:
+    """
+    A cache of individual catalog columns, saved as raw .npy files.
+
+    Many stages read the same few columns (ra, dec, weight, ...) from
+    large catalogs with many columns. The first time a column is needed
+    it is copied out of the HDF5 file into a .npy file in the cache directory,
+    and after that it is memory-mapped, so reading chunks of it is just
+    a slice of the mapped array, served from the page cache if it is
+    hot.
+
+    Columns are identified by the UUID in the provenance of the file they
+    came from, so a re-generated file will never use stale columns.
+
+    The total size of the cache is limited by evicting the least recently
+    used columns when a new one is added. Use is tracked using the
+    modification time of the files.
+
+    If a communicator is supplied then only the root process copies
+    columns into the cache, and the others wait for it, so every process
+    of an MPI job must then call the column method together.
+    """
+
+    def __init__(self, directory, max_bytes, comm=None):
+        """
+        Parameters
+        ----------
+        directory: str
+            Where to put the cached columns
+        max_bytes: int
+            The maximum total size of the cache
+        comm: MPI communicator or None
+            The processes sharing the cache in this job
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.comm = comm
+
+    def path(self, uuid, group_name, col):
+        # Column and group names can include slashes, which just
+        # make sub-directories.
+        return os.path.join(self.directory, uuid, group_name, col + ".npy")
+
+    def column(self, uuid, group_name, col, dataset, block_rows=10_000_000):
+        """
+        Get a memory-mapped array for a column, copying it into the cache
+        first if it is not already there.
+
+        Parameters
+        ----------
+        uuid: str
+            The UUID of the file the column is from
+        group_name: str
+            The group in the file the column is in
+        col: str
+            The column name
+        dataset: h5py.Dataset
+            The column itself, used if it is not already cached
+        block_rows: int
+            The number of rows to copy at once when caching the column
+
+        Returns
+        -------
+        array: np.memmap
+            The read-only, memory-mapped column
+        """
+        path = self.path(uuid, group_name, col)
+
+        # Only one process copies the column, and the others wait until
+        # it has been renamed into place.
+        if (self.comm is None) or (self.comm.rank == 0):
+            if not os.path.exists(path):
+                self.evict(dataset.size * dataset.dtype.itemsize)
+                self.export(dataset, path, block_rows)
+
+        if self.comm is not None:
+            self.comm.Barrier()
+
+        try:
+            # Mark this column as recently used
+            os.utime(path)
+            column = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            # Another job sharing the cache evicted the column since
+            # we checked, so we copy it again for ourselves.
+            self.export(dataset, path, block_rows)
+            column = np.load(path, mmap_mode="r")
+
+        # Make sure everyone has mapped this column before the root
+        # process can evict it to make room for the next one.
+        if self.comm is not None:
+            self.comm.Barrier()
+
+        return column
+
+    def export(self, dataset, path, block_rows):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Several processes could be doing this at the same time,
+        # so each uses its own temporary file.  They are all
+        # the same, so it doesn't matter which one is kept.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        out = np.lib.format.open_memmap(
+            tmp, mode="w+", dtype=dataset.dtype, shape=dataset.shape
+        )
+        n = dataset.shape[0]
+        for s in range(0, n, block_rows):
+            e = min(s + block_rows, n)
+            out[s:e] = dataset[s:e]
+        out.flush()
+        del out
+        os.replace(tmp, path)
+
+    def cached_files(self):
+        """
+        Return a list of (mtime, size, path) for all the cached columns.
+        """
+        files = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".npy"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    # Another process just evicted it
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def evict(self, new_bytes):
+        """
+        Delete the least recently used columns until there is room
+        for a new one of the given size.
+        """
+        files = sorted(self.cached_files())
+        total = sum(f[1] for f in files)
+
+        for _, size, path in files:
+            if total + new_bytes <= self.max_bytes:
+                break
+            # Any process still using this column keeps its
+            # memory-map, since the data is only removed once that is closed.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
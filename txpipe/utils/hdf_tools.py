@@ -56,6 +56,92 @@ def create_dataset_early_allocated(group, name, size, dtype):
     return data_set
 
 
+# HDF5 chunks cannot be larger than 4GB
+MAX_CHUNK_BYTES = 2**32 - 1
+
+
+def create_catalog_dataset(
+    group,
+    name,
+    shape,
+    dtype,
+    chunk_rows=None,
+    compression=None,
+    downcast=False,
+    **kwargs,
+):
+    """
+    Create an HDF5 dataset for a catalog column, using the standard TXPipe
+    layout policy.
+
+    If chunk_rows is set, the dataset is chunked along its first axis with that
+    many rows per chunk, so that reading or writing with the same chunk_rows
+    touches whole chunks on disc.
+
+    If compression is set ("lzf", or "gzip" optionally with a level, e.g. "gzip:6"),
+    the byte-shuffle filter and that compression are applied. HDF5 filters
+    can only be used in parallel with collective writes, which TXPipe stages
+    don't do, so compression is ignored for files opened with the mpio driver.
+
+    If downcast is True then 64-bit float columns are stored as 32-bit.
+    This should only be used for columns that don't need the precision,
+    like magnitudes and their errors.
+
+    Parameters
+    ----------
+    group: h5py.Group
+        the parent for the dataset
+
+    name: str
+        name for the new dataset
+
+    shape: int or tuple
+        The shape of the new dataset
+
+    dtype: str or dtype
+        The data type, before any down-casting
+
+    chunk_rows: int or None
+        Number of rows per chunk
+
+    compression: str or None
+        Compression filter to use, if any
+
+    downcast: bool
+        Whether to store float64 data as float32
+
+    **kwargs
+        Passed on to h5py create_dataset, e.g. maxshape
+
+    Returns
+    -------
+    dataset: h5py.Dataset
+    """
+    if np.isscalar(shape):
+        shape = (shape,)
+    shape = tuple(shape)
+
+    dtype = np.dtype(dtype)
+    if downcast and dtype == np.float64:
+        dtype = np.dtype(np.float32)
+
+    n = shape[0]
+    if chunk_rows and n > 0:
+        row_bytes = dtype.itemsize * int(np.prod(shape[1:]))
+        rows = min(chunk_rows, n, MAX_CHUNK_BYTES // row_bytes)
+        kwargs["chunks"] = (rows,) + shape[1:]
+
+    if compression and group.file.driver != "mpio":
+        if compression.startswith("gzip:"):
+            kwargs["compression"] = "gzip"
+            kwargs["compression_opts"] = int(compression[5:])
+        else:
+            kwargs["compression"] = compression
+        kwargs["shuffle"] = True
+
+    return group.create_dataset(name, shape, dtype=dtype, **kwargs)
+
+
 class BatchWriter:
     """
     This class is designed to batch together writes to
@@ -122,3 +208,180 @@ class BatchWriter:
 
     def finish(self):
         self._write()
+
+
+def collective_write(dataset, start, data):
+    """
+    Write a 1D block of data to a dataset in a file opened with
+    the mpio driver, using a collective MPI-IO write.
+
+    Every process must call this the same number of times for each dataset.
+    Processes with nothing to write can pass an empty array.
+
+    We use the low-level h5py interface for this, because the high-level
+    one skips writes with nothing in them, which would leave the other
+    processes waiting.
+
+    Parameters
+    ----------
+    dataset: h5py.Dataset
+
+    start: int
+        Index in the dataset to start writing at
+
+    data: array
+        Data to write
+    """
+    n = len(data)
+    dxpl = h5py.h5p.create(h5py.h5p.DATASET_XFER)
+    dxpl.set_dxpl_mpio(h5py.h5fd.MPIO_COLLECTIVE)
+
+    file_space = dataset.id.get_space()
+    if n > 0:
+        data = np.ascontiguousarray(data, dtype=dataset.dtype)
+        file_space.select_hyperslab((start,), (n,))
+        mem_space = h5py.h5s.create_simple((n,))
+    else:
+        # The memory space can't be empty, so we make a dummy one
+        # and select nothing from it.
+        data = np.zeros(1, dtype=dataset.dtype)
+        file_space.select_none()
+        mem_space = h5py.h5s.create_simple((1,))
+        mem_space.select_none()
+
+    dataset.id.write(mem_space, file_space, data, dxpl=dxpl)
+
+
+class AsyncBatchWriter(BatchWriter):
+    """
+    A BatchWriter that does its writes in a background thread, so that
+    the process can carry on generating data while the previous batch
+    is written.
+
+    Two sets of buffers are used: one being filled, and the other being
+    written.  We only wait for a write to complete when the next buffer
+    is also full.
+
+    If collective is set and the file is open with the mpio driver then the
+    writes are done with collective MPI-IO calls, which can be much faster
+    on parallel file systems. Collective calls must be made the same number of
+    times by all processes, so in this case you must also pass the communicator
+    and the total number of rows that this process will write. Processes with
+    fewer batches do empty writes at the end to match the others.
+
+    The background thread makes HDF5 (and so MPI-IO) calls, so under MPI this
+    needs an MPI library with thread support (MPI_THREAD_MULTIPLE), which is
+    what mpi4py asks for by default.  Set background=False to do the writes
+    in the main thread instead.
+
+    If several writers are used together with collective writes, then
+    every process must make its writes to them in the same order. In that
+    case pass them all the same executor, so that their background writes
+    are done one at a time in the order they are made, and finish them
+    together with finish_batch_writers.
+    """
+
+    def __init__(
+        self,
+        group,
+        col_dtypes,
+        offset,
+        max_size=1_000_000,
+        background=True,
+        collective=False,
+        comm=None,
+        total_size=None,
+        executor=None,
+    ):
+        from concurrent.futures import ThreadPoolExecutor
+
+        super().__init__(group, col_dtypes, offset, max_size=max_size)
+        self.spare = {name: np.empty_like(col) for name, col in self.data.items()}
+
+        # We only shut down the executor if we made it ourselves
+        self.own_executor = background and (executor is None)
+        if not background:
+            self.executor = None
+        elif executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = executor
+        self.pending = None
+        self.write_count = 0
+
+        self.collective = collective and group.file.driver == "mpio"
+        if self.collective:
+            if (comm is None) or (total_size is None):
+                raise ValueError(
+                    "AsyncBatchWriter needs comm and total_size for collective writes"
+                )
+            my_writes = (total_size + max_size - 1) // max_size
+            self.max_writes = max(comm.allgather(my_writes))
+
+    def _write(self):
+        # We can only re-use the other set of buffers once
+        # the previous write has finished with them
+        self._wait()
+
+        n = self.index
+        start = self.written_index + self.offset
+        data = self.data
+        self.data, self.spare = self.spare, self.data
+        self.written_index += n
+        self.write_count += 1
+
+        if self.executor is None:
+            self._write_buffers(data, start, n)
+        else:
+            self.pending = self.executor.submit(self._write_buffers, data, start, n)
+
+    def _write_buffers(self, data, start, n):
+        for name, col in data.items():
+            if self.collective:
+                collective_write(self.group[name], start, col[:n])
+            else:
+                self.group[name][start : start + n] = col[:n]
+
+    def _wait(self):
+        # This also re-raises any error from the writing thread
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def finish(self):
+        finish_batch_writers(self)
+
+
+def finish_batch_writers(*writers):
+    """
+    Write out the remaining data in a set of AsyncBatchWriters, and close them.
+
+    For collective writes this also makes the empty writes needed to match
+    the other processes.  Writers that are used together, in turn, with the
+    same number of rows each time, should be finished together with this
+    rather than one at a time. The padding writes are then made in the same
+    order as the others, alternating between the writers, so that every
+    process makes its collective calls in the same order.
+
+    Parameters
+    ----------
+    *writers: AsyncBatchWriter
+        The writers to finish, in the order they are written to
+    """
+    for w in writers:
+        if w.index > 0:
+            w._write()
+            w.index = 0
+
+    # Match the number of collective writes made by the other processes
+    while True:
+        behind = [w for w in writers if w.collective and w.write_count < w.max_writes]
+        if not behind:
+            break
+        for w in behind:
+            w._write()
+
+    for w in writers:
+        w._wait()
+        if w.own_executor:
+            w.executor.shutdown()
@@ -1,5 +1,7 @@
 import hashlib
+import queue
 import string
+import threading
 import numpy as np
 
 
@@ -86,3 +88,183 @@ def rename_iterated(it, renames):
                 # delete the old column
                 del data[old]
         yield s, e, data
+
+
+def prefetch_iterated(it, depth=1):
+    """
+    Run an iterator in a background thread, reading up to depth items
+    ahead of the caller.
+
+    This is used to overlap reading chunks of data from files with
+    the processing of earlier chunks. h5py releases the GIL while it reads
+    so the two can run at the same time.
+
+    The thread is only started when the first item is requested, so
+    anything that affects the iterator can still be changed before
+    that point. Exceptions raised by the iterator are re-raised in
+    the calling thread.
+
+    If the caller stops early it should call close() on the result,
+    which stops the thread and closes the wrapped iterator.
+
+    Parameters
+    ----------
+    it: iterator
+        Any iterator
+    depth: int
+        The maximum number of items to read ahead. If zero or less then
+        the iterator is used directly.
+
+    Returns
+    -------
+    prefetcher: PrefetchIterator
+    """
+    return PrefetchIterator(it, depth)
+
+
+class PrefetchIterator:
+    """
+    The iterator returned by prefetch_iterated.
+    """
+
+    def __init__(self, it, depth=1):
+        self.it = iter(it)
+        self.depth = depth
+        self.items = queue.Queue(maxsize=max(depth, 1))
+        self.stop = threading.Event()
+        self.thread = None
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+
+        if self.depth <= 0:
+            return next(self.it)
+
+        # The thread does not refer back to this object, so if the caller
+        # drops it without closing it then it is still cleaned up.
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=_prefetch_worker,
+                args=(self.it, self.items, self.stop),
+                daemon=True,
+            )
+            self.thread.start()
+
+        item, error = self.items.get()
+        if error is not None:
+            self.close()
+            raise error
+        if item is _prefetch_done:
+            self.close()
+            raise StopIteration
+        return item
+
+    def close(self):
+        """
+        Stop the background thread, if it is running, and close the
+        wrapped iterator. This is safe to call more than once.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.stop.set()
+
+        if self.thread is not None:
+            # Empty the queue, in case the thread is waiting to add to it,
+            # and so that we don't keep the read-ahead chunks in memory
+            while self.thread.is_alive():
+                try:
+                    self.items.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.thread.join()
+            while not self.items.empty():
+                self.items.get_nowait()
+
+        # Only once the thread has stopped using it
+        close = getattr(self.it, "close", None)
+        if close is not None:
+            close()
+
+    def __del__(self):
+        if hasattr(self, "finished"):
+            self.close()
+
+
+_prefetch_done = object()
+
+
+def _prefetch_put(items, stop, item):
+    # Keep checking if the consumer has gone away, so that we don't
+    # block forever on a full queue
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _prefetch_worker(it, items, stop):
+    try:
+        for item in it:
+            if not _prefetch_put(items, stop, (item, None)):
+                return
+    except BaseException as error:
+        _prefetch_put(items, stop, (_prefetch_done, error))
+    else:
+        _prefetch_put(items, stop, (_prefetch_done, None))
+
+
+def grouped_histogram(values, groups, ngroup, edges, weights=None):
+    """
+    Histogram values separately for each of a number of groups,
+    e.g. to make a histogram for each object or each tomographic bin,
+    all at once.
+
+    This follows the conventions of np.histogram: bins include their lower
+    edge, apart from the last, which includes both, and values outside the
+    edges are dropped.
+
+    Parameters
+    ----------
+    values: array
+        The values to histogram
+    groups: int array
+        The group, from 0 to ngroup-1, that each value belongs to
+    ngroup: int
+        The number of groups
+    edges: array
+        Sorted bin edges, shared by all the groups
+    weights: array or None
+        Optional weight for each value
+
+    Returns
+    -------
+    counts: array of shape (ngroup, len(edges) - 1)
+        The histograms, as integers if no weights were used
+    """
+    nbin = len(edges) - 1
+    index = np.searchsorted(edges, values, side="right") - 1
+
+    # The upper edge of the last bin is included in it
+    index[values == edges[-1]] = nbin - 1
+
+    # Cut values outside the range
+    keep = (index >= 0) & (index < nbin)
+    if not keep.all():
+        index = index[keep]
+        groups = groups[keep]
+        if weights is not None:
+            weights = weights[keep]
+
+    # Offset by group, so that we can count everything in one go
+    index += groups * nbin
+    counts = np.bincount(index, weights=weights, minlength=ngroup * nbin)
+    return counts.reshape(ngroup, nbin)
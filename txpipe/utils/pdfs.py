@@ -0,0 +1,186 @@
+import numpy as np
+
+
+def pdf_quantiles(z, pdfs, levels):
+    """
+    Find quantiles of a set of PDFs tabulated on a common grid.
+
+    The CDF of each PDF is found with the trapezium rule and interpolated
+    linearly between grid points. All the objects are done together.
+
+    Parameters
+    ----------
+    z: array of shape (nz,)
+        The sorted redshift grid
+    pdfs: array of shape (nobj, nz)
+        The PDF values on the grid; they need not be normalized
+    levels: array of shape (nq,)
+        The quantile levels to find, between 0 and 1
+
+    Returns
+    -------
+    quantiles: array of shape (nobj, nq)
+        The redshift of each quantile for each object. Rows for PDFs that
+        are all zero or contain non-finite values are NaN.
+    """
+    nobj, nz = pdfs.shape
+    levels = np.asarray(levels)
+    cdf = np.zeros((nobj, nz))
+    np.cumsum(0.5 * (pdfs[:, 1:] + pdfs[:, :-1]) * np.diff(z), axis=1, out=cdf[:, 1:])
+
+    # The search below needs every row to be a valid CDF, or the other
+    # rows come out wrong too. Use a uniform one for any PDFs that we can't
+    # normalize, and flag them.
+    total = cdf[:, -1].copy()
+    bad = ~(np.isfinite(total) & (total > 0))
+    cdf[bad] = np.linspace(0.0, 1.0, nz)
+    total[bad] = 1.0
+    cdf /= total[:, np.newaxis]
+    # Any negative PDF values would make the CDF decrease
+    np.maximum.accumulate(cdf, axis=1, out=cdf)
+
+    # Offsetting each row by its index makes the whole array sorted,
+    # so we can search all the rows at once.
+    row = np.arange(nobj)[:, np.newaxis]
+    flat_cdf = (cdf + row).ravel()
+    target = levels[np.newaxis, :] + row
+    index = np.searchsorted(flat_cdf, target.ravel()).reshape(nobj, -1)
+
+    # Stay inside each row, and interpolate between the grid points either side
+    upper = np.clip(index - row * nz, 1, nz - 1)
+    lower = upper - 1
+    c_lo = np.take_along_axis(cdf, lower, axis=1)
+    c_hi = np.take_along_axis(cdf, upper, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        f = (levels[np.newaxis, :] - c_lo) / (c_hi - c_lo)
+    f = np.nan_to_num(f, nan=0.0, posinf=1.0, neginf=0.0).clip(0, 1)
+    quantiles = z[lower] + f * (z[upper] - z[lower])
+    quantiles[bad] = np.nan
+    return quantiles
+
+
+# Largest value of the quantized PDFs
+QUANTIZE_MAX = np.iinfo(np.uint16).max
+
+
+def quantize_pdfs(pdfs):
+    """
+    Compress PDFs to 16 bit integers, with a scale for each object.
+
+    Each PDF is scaled so that its peak is the largest 16 bit integer and
+    rounded, so the error on each value is at most 1 / 131070 of the
+    peak of that PDF.  Zeros stay zero, so the results compress well.
+    Any negative values, which can't be stored, are set to zero.
+
+    Parameters
+    ----------
+    pdfs: array of shape (nobj, nz)
+        PDF values
+
+    Returns
+    -------
+    quantized: uint16 array of shape (nobj, nz)
+
+    scale: float32 array of shape (nobj,)
+        Multiply by this to get the PDFs back
+    """
+    pdfs = np.clip(pdfs, 0, None)
+    scale = pdfs.max(axis=1).astype(np.float32) / QUANTIZE_MAX
+    # Avoid dividing by zero for any empty PDFs - they stay as zero
+    safe_scale = np.where(scale > 0, scale, 1)
+    quantized = np.rint(pdfs / safe_scale[:, np.newaxis]).astype(np.uint16)
+    return quantized, scale
+
+
+def dequantize_pdfs(quantized, scale):
+    """
+    Decode PDFs made with quantize_pdfs, as float32
+
+    Parameters
+    ----------
+    quantized: uint16 array of shape (nobj, nz)
+
+    scale: float32 array of shape (nobj,)
+
+    Returns
+    -------
+    pdfs: float32 array of shape (nobj, nz)
+    """
+    pdfs = quantized.astype(np.float32)
+    pdfs *= scale[:, np.newaxis]
+    return pdfs
+
+
+def pdfs_from_quantiles(z, quantiles, levels):
+    """
+    Rebuild PDFs on a grid from a set of their quantiles.
+
+    The CDF is taken to be linear between quantiles, and extrapolated to
+    zero and one half a quantile spacing beyond the outermost ones.
+    The PDF at each grid point is the probability in the cell around it
+    divided by the cell width, so the total of each PDF is preserved.
+
+    Parameters
+    ----------
+    z: array of shape (nz,)
+        The evenly spaced redshift grid
+    quantiles: array of shape (nobj, nq)
+        The redshifts at the quantile levels for each object
+    levels: array of shape (nq,)
+        The evenly spaced quantile levels, as made by e.g. the RAIL
+        estimation stages
+
+    Returns
+    -------
+    pdfs: float32 array of shape (nobj, nz)
+        Rows with any non-finite quantiles, as pdf_quantiles gives for
+        empty PDFs, are zero.
+    """
+    nobj, nq = quantiles.shape
+    levels = np.asarray(levels)
+    dz = z[1] - z[0]
+
+    # Non-finite rows would break the search for all the others, so
+    # give them dummy values here and zero them at the end.
+    bad = ~np.isfinite(quantiles).all(axis=1)
+    if bad.any():
+        quantiles = quantiles.copy()
+        quantiles[bad] = levels
+
+    # Add the end points of the CDF
+    q = np.empty((nobj, nq + 2))
+    q[:, 1:-1] = quantiles
+    q[:, 0] = quantiles[:, 0] - (quantiles[:, 1] - quantiles[:, 0]) * levels[0] / (
+        levels[1] - levels[0]
+    )
+    q[:, -1] = quantiles[:, -1] + (quantiles[:, -1] - quantiles[:, -2]) * (
+        1 - levels[-1]
+    ) / (levels[-1] - levels[-2])
+    # Guard against any equal quantiles so that the rows stay sorted
+    q = np.maximum.accumulate(q, axis=1)
+    c = np.concatenate([[0.0], levels, [1.0]])
+
+    # Evaluate the CDF at the cell edges, for all the rows at once by
+    # searching in the rows, offset so that they are sorted as a whole
+    edges = np.append(z - 0.5 * dz, z[-1] + 0.5 * dz)
+    span = q[:, -1] - q[:, 0] + 1.0
+    offset = np.concatenate([[0.0], np.cumsum(span)[:-1]])
+    offset -= q[:, 0]
+    flat_q = (q + offset[:, np.newaxis]).ravel()
+    target = edges[np.newaxis, :] + offset[:, np.newaxis]
+    index = np.searchsorted(flat_q, target.ravel(), side="right").reshape(nobj, -1)
+
+    # Index within each row of the quantile above each edge
+    row_start = (np.arange(nobj) * (nq + 2))[:, np.newaxis]
+    upper = np.clip(index - row_start, 1, nq + 1)
+    lower = upper - 1
+    q_lo = np.take_along_axis(q, lower, axis=1)
+    q_hi = np.take_along_axis(q, upper, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        f = (edges[np.newaxis, :] - q_lo) / (q_hi - q_lo)
+    f = np.nan_to_num(f, nan=1.0).clip(0, 1)
+    cdf = c[lower] + f * (c[upper] - c[lower])
+
+    pdfs = (np.diff(cdf, axis=1) / dz).astype(np.float32)
+    pdfs[bad] = 0.0
+    return pdfs
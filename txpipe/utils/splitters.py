@@ -1,4 +1,5 @@
 import numpy as np
+from .mpi_utils import in_place_reduce
 
 
 class Splitter:
@@ -17,9 +18,10 @@ class Splitter:
     - Splitter, for when you know the sizes of the subsets in advance
     - DynamicSplitter, for when you don't.
 
-    Splitter can be used in parallel by bin; DynamicSplitter cannot, as it
-    has to resize the arrays as it goes along, which doesn't work with
-    parallel HDF5.
+    Splitter can be used in parallel, either by bin or by rows if the
+    start index of each chunk in each bin is known (see chunk_bin_offsets
+    below); DynamicSplitter cannot, as it has to resize the arrays as it
+    goes along, which doesn't work with parallel HDF5.
 
     In each case the lifecycle is:
     1. open the output file and create the group you want
@@ -28,9 +30,15 @@ class Splitter:
     4. finalize the splitter
 
     The bins don't have to be non-overlapping.
+
+    If buffer_bytes is set then chunks for each bin are collected in
+    memory and written in larger contiguous blocks, like the BatchWriter
+    class in hdf_tools.  This avoids many small writes when the data per
+    chunk in each bin is small. Data is only guaranteed to be in the file
+    after calling finish.
     """
 
-    def __init__(self, group, name, columns, bin_sizes, dtypes=None):
+    def __init__(self, group, name, columns, bin_sizes, dtypes=None, buffer_bytes=0):
         """Create a fixed-size splitter
 
         Parameters
@@ -46,6 +54,9 @@ class Splitter:
         dtypes: dict or None
             Maps bins to HDF5 data types for the output columns.  Bins default
             to 8 byte floats if not found in this.
+        buffer_bytes: int
+            Memory to use for buffering output, split among the bins.
+            Default is zero, meaning data are written immediately.
         """
         self.bins = list(bin_sizes.keys())
 
@@ -54,8 +65,10 @@ class Splitter:
 
         self.columns = columns
 
-        # self.index will track how much data is written so far
+        # self.index will track where the next write to each bin goes,
+        # and self.count how much data this process has written to it
         self.index = {b: 0 for b in self.bins}
+        self.count = {b: 0 for b in self.bins}
         self.bin_sizes = bin_sizes
 
         # Make a subgroup for each bin in our data
@@ -63,7 +76,9 @@ class Splitter:
         for i, b in enumerate(self.bins):
             self.group.attrs[f"bin_{i}"] = b
 
-        self._setup_columns(dtypes or {})
+        dtypes = dtypes or {}
+        self._setup_columns(dtypes)
+        self._setup_buffers(dtypes, buffer_bytes)
 
     def _setup_columns(self, dtypes):
         # set up the columns with fixed sizes according to the
@@ -76,14 +91,38 @@ class Splitter:
                 dt = dtypes.get(col, "f8")
                 sub.create_dataset(col, (sz,), dtype=dt)
 
-    def write_bin(self, data, b):
+    def _setup_buffers(self, dtypes, buffer_bytes):
+        # Split the memory budget evenly between the bins, and
+        # work out how many rows that gives us for each of them
+        dtypes = {col: np.dtype(dtypes.get(col, "f8")) for col in self.columns}
+        row_bytes = sum(dt.itemsize for dt in dtypes.values())
+        self.buffer_rows = buffer_bytes // (row_bytes * len(self.bins))
+
+        # Where in the output the buffered data for each bin
+        # goes, and how much of it there is
+        self.buffer_start = {b: 0 for b in self.bins}
+        self.buffer_count = {b: 0 for b in self.bins}
+
+        if self.buffer_rows == 0:
+            self.buffers = None
+            return
+
+        # Same layout as the output - this is only actually
+        # allocated by the OS when we first use it.
+        self.buffers = {
+            b: {col: np.empty(self.buffer_rows, dtype=dt) for col, dt in dtypes.items()}
+            for b in self.bins
+        }
+
+    def write_bin(self, data, b, start=None):
         """
         Write a single chunk of data to the output, all to the same bin
 
         The bin value must be one of those specified on init.
 
-        This will work in parallel provided each process only adds data
-        to a single bin.
+        This will work in parallel provided either each process only adds data
+        to a single bin, or the start index of each chunk is specified so that
+        processes write to different ranges of the bin.
 
         Parameters
         ----------
@@ -92,48 +131,111 @@ class Splitter:
             to be split up. All must have the same size.
         b: any
             A single value of the bin to look up.  Must be in self.bins
+        start: int or None
+            The index in the bin at which to write this chunk. If None
+            then continue from the end of the previous chunk written to it.
         """
         # Length of this chunk
         n = len(data[self.columns[0]])
-        # Group where we will write the data
-        group = self.subgroups[b]
         # Indices of this output - start and end
-        s = self.index[b]
+        s = self.index[b] if start is None else start
         e = s + n
 
+        if self.buffers is None:
+            self._write(b, s, data, n)
+        else:
+            self._buffer(b, s, data, n)
+
+        # Update overall index
+        self.index[b] = e
+        self.count[b] += n
+
+    def _buffer(self, b, s, data, n):
+        # If this chunk does not carry on from where the buffered data
+        # finishes, or won't fit in the space remaining, write out what
+        # we have so far first.
+        m = self.buffer_count[b]
+        if m and ((s != self.buffer_start[b] + m) or (m + n > self.buffer_rows)):
+            self.flush([b])
+            m = 0
+
+        # Chunks larger than the whole buffer are already
+        # large enough to write directly
+        if n > self.buffer_rows:
+            self._write(b, s, data, n)
+            return
+
+        if m == 0:
+            self.buffer_start[b] = s
+
+        buf = self.buffers[b]
+        for col in self.columns:
+            buf[col][m : m + n] = data[col]
+        self.buffer_count[b] = m + n
+
+    def flush(self, bins=None):
+        """
+        Write out any buffered data for the given bins, or all bins.
+
+        Parameters
+        ----------
+        bins: list or None
+            The bins to flush.  Default is all of them.
+        """
+        if self.buffers is None:
+            return
+
+        if bins is None:
+            bins = self.bins
+
+        for b in bins:
+            n = self.buffer_count[b]
+            if n == 0:
+                continue
+            self._write(b, self.buffer_start[b], self.buffers[b], n)
+            self.buffer_count[b] = 0
+
+    def _write(self, b, s, data, n):
+        e = s + n
         self._size_check(b, e)
 
         # Write to columns
+        group = self.subgroups[b]
         for col in self.columns:
-            group[col][s:e] = data[col]
-
-        # Update overall index
-        self.index[b] = e
+            group[col][s:e] = data[col][:n]
 
     def _size_check(self, b, e):
         n = self.bin_sizes[b]
         if e > n:
             raise ValueError(f"Too much data added bin {b}: got {e}, expected max {n}")
 
-    def finish(self, bins=None):
+    def finish(self, bins=None, comm=None):
         """
         Finish up by checking that the right amount of data has been written to the file.
 
-        If running in parallel, only bins used by this process will have the correct sizes
+        If running in parallel by bin, only bins used by this process will have the correct sizes
         in this object.  In that case, specify my_bins for the list of bins this process
-        should check
+        should check.  If running in parallel by rows, pass the communicator instead, and
+        the counts from all the processes will be summed before checking.
 
         Parameters
         ----------
         bins: list or None
             The list of bins that this process has saved data for.
+        comm: MPI communicator or None
+            If set, sum the counts over all processes in the communicator
         """
         if bins is None:
             bins = self.bins
 
-        for b in bins:
+        self.flush(bins)
+
+        counts = np.array([self.count[b] for b in bins], dtype=np.int64)
+        if comm is not None:
+            in_place_reduce(counts, comm, allreduce=True)
+
+        for b, n in zip(bins, counts):
             c = self.bin_sizes[b]
-            n = self.index[b]
             if c != n:
                 raise ValueError(
                     f"Count error in bin {b}: expected {c} but copied in {n}"
@@ -147,12 +249,23 @@ class DynamicSplitter(Splitter):
     can't be used in parallel.
 
     The sizes pased to the initialization in this case represent an initial guess of
-    the column sizes; data will be resized above this.
+    the column sizes; data will be resized above this.  If you have a rough idea of the
+    likely final size, or an upper limit on it, then passing it as the capacity means
+    columns are resized straight up to it, rather than in many smaller steps.
 
     See the Splitter docstring for more detail.
     """
 
-    def __init__(self, group, name, columns, bin_sizes, dtypes=None):
+    def __init__(
+        self,
+        group,
+        name,
+        columns,
+        bin_sizes,
+        dtypes=None,
+        buffer_bytes=0,
+        capacity=None,
+    ):
         """Create a dynamic splitter.
 
 
@@ -170,8 +283,22 @@ class DynamicSplitter(Splitter):
         dtypes: dict or None
             Maps bins to HDF5 data types for the output columns.  Bins default
             to 8 byte floats if not found in this.
+        buffer_bytes: int
+            Memory to use for buffering output, split among the bins.
+            Default is zero, meaning data are written immediately.
+        capacity: int, dict, or None
+            Size to grow bins to when they first need resizing, either
+            the same for all bins or a dict mapping bin name to size.
         """
-        super().__init__(group, name, columns, bin_sizes, dtypes=dtypes)
+        if capacity is None:
+            capacity = {}
+        elif not isinstance(capacity, dict):
+            capacity = {b: capacity for b in bin_sizes}
+        self.capacity = capacity
+
+        super().__init__(
+            group, name, columns, bin_sizes, dtypes=dtypes, buffer_bytes=buffer_bytes
+        )
 
     def _setup_columns(self, dtypes):
         # same as in the parent class except we make them extensible by
@@ -189,8 +316,9 @@ class DynamicSplitter(Splitter):
             return
 
         # Otherwise resize the column to be 50%
-        # larger than the current maximum size.
-        new_size = int(e * 1.5)
+        # larger than the current maximum size,
+        # or to the expected capacity if that is bigger
+        new_size = max(int(e * 1.5), self.capacity.get(b, 0))
         sub = self.subgroups[b]
         for col in self.columns:
             sub[col].resize((new_size,))
@@ -203,8 +331,55 @@ class DynamicSplitter(Splitter):
         Finish up by resizing all the bin columns to the correct size, stripping off
         any excess space.  It's important to call this.
         """
+        self.flush()
+
         # resize everything to actual size
         for b, sub in self.subgroups.items():
             sz = self.index[b]
             for col in self.columns:
                 sub[col].resize((sz,))
+
+
+def chunk_bin_offsets(chunks, nbin, n_chunk, comm=None):
+    """
+    Work out where each chunk of a catalog should go in each bin of a split output.
+
+    This lets processes each handle different chunks of a catalog, but still write
+    into the same Splitter, with the objects in each bin in the same order they would
+    have if the catalog were split in serial.
+
+    The last column in the output is for a non-tomographic bin that includes all objects
+    with a bin value >= 0.
+
+    Parameters
+    ----------
+    chunks: iterable
+        Yields (chunk_index, bin_array) pairs for the chunks this process is responsible for.
+    nbin: int
+        The number of tomographic bins
+    n_chunk: int
+        The total number of chunks in the catalog, over all processes
+    comm: MPI communicator or None
+        If set, combine the chunk counts from all processes in this communicator
+
+    Returns
+    -------
+    offsets: array
+        Shape (n_chunk, nbin + 1) array of start indices for each chunk in each bin
+    """
+    counts = np.zeros((n_chunk, nbin + 1), dtype=np.int64)
+
+    for i, bins in chunks:
+        sel = bins[bins >= 0]
+        counts[i, :nbin] = np.bincount(sel, minlength=nbin)[:nbin]
+        counts[i, nbin] = sel.size
+
+    # Each process has filled in only its own chunks, so summing
+    # gives everyone the complete set of counts.
+    if comm is not None:
+        in_place_reduce(counts, comm, allreduce=True)
+
+    # An exclusive scan over the chunks gives the start points
+    offsets = np.zeros_like(counts)
+    np.cumsum(counts[:-1], axis=0, out=offsets[1:])
+    return offsets
@@ -1,4 +1,6 @@
 from timeit import default_timer
+import subprocess
+import sys
 
 
 class Timer:
@@ -17,3 +19,78 @@ class Timer:
             f"MARK {label}  {dt1} seconds since start and {dt2} seconds since last mark"
         )
         self.stamps.append((label, t))
+
+
+def parse_import_times(text):
+    """
+    Parse the output of python -X importtime into a list of
+    (module, self_us, cumulative_us) tuples.
+    """
+    timings = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+        timings.append((fields[2].strip(), self_us, cumulative_us))
+    return timings
+
+
+def import_time_report(statement, top=20):
+    """
+    Run a statement in a fresh python process with -X importtime, and
+    print a summary of where the time importing modules went.
+
+    This has to be a fresh process since modules are only imported
+    once, and the interpreter only records times if started with the flag.
+
+    Parameters
+    ----------
+    statement: str
+        Python code to time, e.g. "import txpipe"
+    top: int
+        The number of modules and packages to list
+
+    Returns
+    -------
+    timings: list
+        (module, self_us, cumulative_us) for every imported module
+    """
+    cmd = [sys.executable, "-X", "importtime", "-c", statement]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    timings = parse_import_times(proc.stderr)
+    if proc.returncode != 0:
+        print(proc.stderr)
+        raise RuntimeError(f"Could not run {statement!r} to time imports")
+
+    # The self times of all the modules add up to the total
+    total = sum(t[1] for t in timings)
+    print(f"Imported {len(timings)} modules in {total / 1e6:.2f} seconds for:")
+    print(f"    {statement}")
+
+    # Totals for each top-level package, which is usually the most useful
+    # thing to know - e.g. that jax took a second.
+    packages = {}
+    for module, self_us, _ in timings:
+        package = module.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    packages = sorted(packages.items(), key=lambda p: -p[1])
+
+    print("")
+    print("Slowest packages (seconds, including sub-modules):")
+    for package, t in packages[:top]:
+        print(f"    {t / 1e6:7.3f}  {package}")
+
+    print("")
+    print("Slowest individual imports (seconds, cumulative and self):")
+    for module, self_us, cumulative_us in sorted(timings, key=lambda t: -t[2])[:top]:
+        print(f"    {cumulative_us / 1e6:7.3f}  {self_us / 1e6:7.3f}  {module}")
+
+    return timings